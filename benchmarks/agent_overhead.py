@@ -0,0 +1,243 @@
+"""Measures the overhead of smolagents itself per agent step, without calling an LLM.
+
+Runs `CodeAgent` and `ToolCallingAgent` on a `ScriptedModel` replaying canned outputs, for a range of step counts,
+tool counts, observation sizes and image payloads. For each configuration, reports the time per step spent outside
+the (simulated) model latency, the memory growth and the number of allocated memory blocks, and saves everything as
+JSON so that results can be compared between commits.
+
+Usage:
+    python benchmarks/agent_overhead.py --steps 1 10 100 --output overhead.json
+    python benchmarks/agent_overhead.py --quick --compare overhead.json
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import PIL.Image
+from scripted_model import ScriptedModel
+
+import smolagents
+from smolagents import CodeAgent, Tool, ToolCallingAgent
+from smolagents.models import ChatMessage, ChatMessageToolCall, ChatMessageToolCallDefinition, MessageRole
+from smolagents.monitoring import LogLevel
+
+
+class EchoTool(Tool):
+    inputs = {"query": {"type": "string", "description": "The query to echo."}}
+    output_type = "string"
+
+    def __init__(self, index: int, observation_chars: int):
+        self.name = f"tool_{index}"
+        self.description = f"Returns an observation for the query, as tool number {index} of the benchmark."
+        self.observation = "x" * observation_chars
+        super().__init__()
+
+    def forward(self, query: str) -> str:
+        return self.observation
+
+
+def code_agent_outputs(n_steps: int, n_tools: int):
+    def output(call_index: int) -> ChatMessage:
+        if call_index >= n_steps - 1:
+            code = "final_answer('done')"
+        elif n_tools:
+            code = f"result = tool_{call_index % n_tools}(query='step {call_index}')\nprint(result)"
+        else:
+            code = f"result = [i * {call_index} for i in range(10)]\nprint(result)"
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=f"Thought: I will run step {call_index}.\nCode:\n```py\n{code}\n```<end_code>",
+        )
+
+    return output
+
+
+def tool_calling_agent_outputs(n_steps: int, n_tools: int):
+    def output(call_index: int) -> ChatMessage:
+        if call_index >= n_steps - 1:
+            name, arguments = "final_answer", {"answer": "done"}
+        else:
+            name, arguments = f"tool_{call_index % n_tools}", {"query": f"step {call_index}"}
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=f"I will call {name}.",
+            tool_calls=[
+                ChatMessageToolCall(
+                    id=f"call_{call_index}",
+                    type="function",
+                    function=ChatMessageToolCallDefinition(name=name, arguments=arguments),
+                )
+            ],
+        )
+
+    return output
+
+
+def make_agent(config: dict, model: ScriptedModel, n_tools: int):
+    tools = [EchoTool(index, config["observation_chars"]) for index in range(n_tools)]
+    agent_class = CodeAgent if config["agent"] == "CodeAgent" else ToolCallingAgent
+    return agent_class(
+        tools=tools,
+        model=model,
+        max_steps=config["steps"],
+        verbosity_level=LogLevel.OFF,
+        stream_outputs=config["stream"],
+    )
+
+
+def run_once(config: dict, trace_memory: bool) -> dict:
+    if config["agent"] == "CodeAgent":
+        n_tools = config["tools"]
+        outputs = code_agent_outputs(config["steps"], n_tools)
+    else:
+        # A tool calling agent needs a tool to call before its final answer
+        n_tools = max(1, config["tools"])
+        outputs = tool_calling_agent_outputs(config["steps"], n_tools)
+    model = ScriptedModel(
+        outputs,
+        time_to_first_token=config["time_to_first_token"],
+        time_per_chunk=config["time_per_chunk"],
+        chunk_size=config["chunk_size"],
+    )
+    agent = make_agent(config, model, n_tools)
+    images = [PIL.Image.new("RGB", (config["image_size"],) * 2)] if config["image_size"] else None
+
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+    start_time = time.perf_counter()
+    agent.run("Run the benchmark steps.", images=images)
+    duration = time.perf_counter() - start_time
+    result = {"duration": duration, "simulated_latency": model.simulated_latency, "steps": agent.step_number - 1}
+    if trace_memory:
+        snapshot_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        differences = snapshot_after.compare_to(snapshot_before, "filename")
+        result["memory_growth_bytes"] = sum(difference.size_diff for difference in differences)
+        result["allocated_blocks"] = sum(difference.count_diff for difference in differences)
+        result["peak_memory_bytes"] = peak
+    return result
+
+
+def benchmark(config: dict, repeats: int) -> dict:
+    timings = [run_once(config, trace_memory=False) for _ in range(repeats)]
+    overheads = [(timing["duration"] - timing["simulated_latency"]) / timing["steps"] for timing in timings]
+    # Tracing allocations slows the run down, so memory is measured in a separate run
+    memory = run_once(config, trace_memory=True)
+    steps = timings[0]["steps"]
+    return {
+        "config": config,
+        "steps": steps,
+        "overhead_per_step_ms": {
+            "median": statistics.median(overheads) * 1000,
+            "min": min(overheads) * 1000,
+            "max": max(overheads) * 1000,
+        },
+        "memory_growth_per_step_bytes": memory["memory_growth_bytes"] / steps,
+        "allocated_blocks_per_step": memory["allocated_blocks"] / steps,
+        "peak_memory_bytes": memory["peak_memory_bytes"],
+    }
+
+
+def config_key(config: dict) -> str:
+    return ", ".join(f"{key}={value}" for key, value in config.items())
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", nargs="+", default=["CodeAgent", "ToolCallingAgent"])
+    parser.add_argument("--steps", nargs="+", type=int, default=[1, 10, 100], help="Number of steps per run")
+    parser.add_argument("--tools", nargs="+", type=int, default=[1, 20], help="Number of tools given to the agent")
+    parser.add_argument(
+        "--observation-chars", nargs="+", type=int, default=[100, 10_000], help="Size of each tool observation"
+    )
+    parser.add_argument("--image-sizes", nargs="+", type=int, default=[0], help="Side of the task image, 0 for none")
+    parser.add_argument("--stream", action="store_true", help="Stream the model outputs")
+    parser.add_argument("--time-to-first-token", type=float, default=0.0, help="Simulated latency, in seconds")
+    parser.add_argument("--time-per-chunk", type=float, default=0.0, help="Simulated latency per chunk, in seconds")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Characters per streamed chunk")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per configuration")
+    parser.add_argument("--quick", action="store_true", help="Only run 1 and 10 steps with small observations")
+    parser.add_argument("--output", help="Path of the JSON file to save the results to")
+    parser.add_argument("--compare", help="Path of a previous JSON result file to compare with")
+    args = parser.parse_args()
+    if args.quick:
+        args.steps, args.observation_chars = [1, 10], [100]
+
+    configs = [
+        {
+            "agent": agent,
+            "steps": steps,
+            "tools": tools,
+            "observation_chars": observation_chars,
+            "image_size": image_size,
+            "stream": args.stream,
+            "time_to_first_token": args.time_to_first_token,
+            "time_per_chunk": args.time_per_chunk,
+            "chunk_size": args.chunk_size,
+        }
+        for agent, steps, tools, observation_chars, image_size in itertools.product(
+            args.agents, args.steps, args.tools, args.observation_chars, args.image_sizes
+        )
+    ]
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {config_key(result["config"]): result for result in json.load(f)["results"]}
+
+    results = []
+    print(f"{'Configuration':<75} {'ms/step':>9} {'KB/step':>9} {'blocks/step':>12} {'vs baseline':>12}")
+    for config in configs:
+        result = benchmark(config, args.repeats)
+        results.append(result)
+        overhead = result["overhead_per_step_ms"]["median"]
+        comparison = ""
+        if (previous := baseline.get(config_key(config))) is not None:
+            comparison = f"{overhead / previous['overhead_per_step_ms']['median']:.2f}x"
+        label = (
+            f"{config['agent']}, {config['steps']} steps, {config['tools']} tools, "
+            f"{config['observation_chars']} chars, image {config['image_size']}"
+        )
+        print(
+            f"{label:<75} {overhead:9.3f} {result['memory_growth_per_step_bytes'] / 1024:9.1f} "
+            f"{result['allocated_blocks_per_step']:12.0f} {comparison:>12}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "metadata": {
+                        "date": datetime.now(timezone.utc).isoformat(),
+                        "git_commit": get_git_commit(),
+                        "smolagents_version": smolagents.__version__,
+                        "python_version": platform.python_version(),
+                        "platform": platform.platform(),
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
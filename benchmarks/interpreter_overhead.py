@@ -0,0 +1,212 @@
+"""Measures how much slower the local Python interpreter of `CodeAgent` is than native Python execution.
+
+Runs a corpus of snippets typical of agent code through `LocalPythonExecutor` and through plain `exec`, and reports
+for each one the timing ratio, the number of operations evaluated by the interpreter and the peak memory of both.
+Each snippet stores its result in `result`, which is checked to be the same with both.
+
+Usage:
+    python benchmarks/interpreter_overhead.py
+    python benchmarks/interpreter_overhead.py --snippets function_recursion numpy --repeats 10 --output interpreter.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import smolagents
+from smolagents.local_python_executor import LocalPythonExecutor
+from smolagents.utils import _is_package_available
+
+
+SNIPPETS = {
+    "for_loop": """
+result = 0
+for i in range(20000):
+    if i % 3 == 0:
+        result += i
+""",
+    "while_loop": """
+result, n = 0, 0
+while n < 20000:
+    result += n * 2
+    n += 1
+""",
+    "comprehensions": """
+squares = [i * i for i in range(10000)]
+evens = {i: str(i) for i in range(5000) if i % 2 == 0}
+result = sum(squares) + len(evens) + sum(x for x in range(5000))
+""",
+    "string_building": """
+text = ""
+for i in range(3000):
+    text += f"line {i}: {i * 2}\\n"
+words = ", ".join(str(i) for i in range(3000))
+result = len(text) + len(words.upper().split(", "))
+""",
+    "function_recursion": """
+def fibonacci(n):
+    return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)
+
+result = fibonacci(18)
+""",
+    "class_definitions": """
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def norm(self):
+        return (self.x ** 2 + self.y ** 2) ** 0.5
+
+class Point3D(Point):
+    def __init__(self, x, y, z):
+        Point.__init__(self, x, y)
+        self.z = z
+
+points = [Point3D(i, i + 1, i + 2) for i in range(2000)]
+result = round(sum(point.norm() for point in points), 6)
+""",
+    "imports": """
+import collections
+import json
+import math
+import re
+
+counts = collections.Counter(re.findall(r"\\w+", "the quick brown fox jumps over the lazy dog " * 200))
+result = json.dumps(sorted(counts.items())) + str(math.factorial(50))
+""",
+    "exceptions": """
+result = 0
+for i in range(5000):
+    try:
+        result += 10 // (i % 5)
+    except ZeroDivisionError:
+        result -= 1
+""",
+    "sorting": """
+records = [{"name": f"item{i}", "score": (i * 7919) % 1000} for i in range(5000)]
+records.sort(key=lambda record: (record["score"], record["name"]))
+result = [record["name"] for record in records[:10]]
+""",
+    "numpy": """
+import numpy as np
+
+matrix = np.arange(250000, dtype=np.float64).reshape(500, 500)
+result = float(np.dot(matrix, matrix.T).trace() + np.linalg.norm(matrix) + matrix.mean(axis=0).sum())
+""",
+}
+
+
+def run_native(code: str) -> dict:
+    namespace = {}
+    # The interpreter captures prints: do the same for a fair comparison
+    with contextlib.redirect_stdout(io.StringIO()):
+        exec(compile(code, "<snippet>", "exec"), namespace)
+    return namespace
+
+
+def make_executor() -> LocalPythonExecutor:
+    executor = LocalPythonExecutor(additional_authorized_imports=["numpy", "numpy.*", "collections", "json", "re"])
+    executor.send_tools({})
+    return executor
+
+
+def time_runs(run, repeats: int) -> list[float]:
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start_time)
+    return durations
+
+
+def peak_memory(run) -> int:
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_snippet(code: str, repeats: int) -> dict:
+    native_result = run_native(code)["result"]
+    executor = make_executor()
+    executor(code)
+    if executor.state["result"] != native_result:
+        raise ValueError(f"The interpreter returned {executor.state['result']!r} instead of {native_result!r}")
+    operations = executor.state["_operations_count"]["counter"]
+
+    native_durations = time_runs(lambda: run_native(code), repeats)
+    # A fresh executor per run, created outside of the timing, as state could make later runs faster
+    executors = [make_executor() for _ in range(repeats)]
+    interpreter_durations = time_runs(lambda: executors.pop()(code), repeats)
+    native_time, interpreter_time = min(native_durations), min(interpreter_durations)
+    return {
+        "native_ms": native_time * 1000,
+        "interpreter_ms": interpreter_time * 1000,
+        "ratio": interpreter_time / native_time,
+        "interpreter_ms_stdev": statistics.stdev(interpreter_durations) * 1000 if repeats > 1 else 0.0,
+        "operations": operations,
+        "interpreter_ns_per_operation": interpreter_time / operations * 1e9 if operations else None,
+        "native_peak_memory_bytes": peak_memory(lambda: run_native(code)),
+        "interpreter_peak_memory_bytes": peak_memory(lambda: make_executor()(code)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snippets", nargs="+", choices=list(SNIPPETS), help="Snippets to run, all by default")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per snippet, the fastest one is kept")
+    parser.add_argument("--output", help="Path of the JSON file to save the results to")
+    args = parser.parse_args()
+
+    snippet_names = args.snippets or list(SNIPPETS)
+    if "numpy" in snippet_names and not _is_package_available("numpy"):
+        print("numpy is not installed: skipping the numpy snippet")
+        snippet_names.remove("numpy")
+
+    results = {}
+    print(
+        f"{'Snippet':<20} {'native ms':>10} {'interp. ms':>11} {'ratio':>8} {'operations':>11} "
+        f"{'ns/op':>8} {'native KB':>10} {'interp. KB':>11}"
+    )
+    for name in snippet_names:
+        result = results[name] = benchmark_snippet(SNIPPETS[name], args.repeats)
+        ns_per_operation = result["interpreter_ns_per_operation"]
+        print(
+            f"{name:<20} {result['native_ms']:10.3f} {result['interpreter_ms']:11.3f} {result['ratio']:7.1f}x "
+            f"{result['operations']:11,} {ns_per_operation or 0:8.0f} "
+            f"{result['native_peak_memory_bytes'] / 1024:10.1f} {result['interpreter_peak_memory_bytes'] / 1024:11.1f}"
+        )
+    geometric_mean_ratio = math.exp(statistics.mean(math.log(result["ratio"]) for result in results.values()))
+    print(f"Geometric mean slowdown: {geometric_mean_ratio:.1f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "metadata": {
+                        "date": datetime.now(timezone.utc).isoformat(),
+                        "smolagents_version": smolagents.__version__,
+                        "python_version": platform.python_version(),
+                        "platform": platform.platform(),
+                    },
+                    "geometric_mean_ratio": geometric_mean_ratio,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
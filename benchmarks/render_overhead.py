@@ -0,0 +1,76 @@
+"""Measures the console rendering overhead of streamed model outputs, per 1k tokens.
+
+Compares the former approach (rebuilding a `Markdown` view of the whole output for every token) with
+`StreamingRenderer`, on an interactive terminal, on a non-interactive console, and with logging turned off.
+
+Usage:
+    python benchmarks/render_overhead.py --tokens 2000
+"""
+
+import argparse
+import io
+import time
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+from smolagents.monitoring import AgentLogger, LogLevel, StreamingRenderer
+
+
+def make_tokens(n_tokens: int) -> list[str]:
+    words = ["Thought:", " I", " will", " use", " the", " `search`", " tool", ".\n", "```py\n", "x = 1\n", "```\n"]
+    return [words[i % len(words)] for i in range(n_tokens)]
+
+
+def run_legacy(tokens: list[str], console: Console) -> None:
+    text = ""
+    with Live("", console=console, vertical_overflow="visible") as live:
+        for token in tokens:
+            text += token
+            live.update(Markdown(text))
+
+
+def run_streaming_renderer(tokens: list[str], logger: AgentLogger) -> None:
+    with StreamingRenderer(logger) as renderer:
+        for token in tokens:
+            renderer.append(token)
+
+
+def time_per_1k_tokens(fn, n_tokens: int) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / n_tokens * 1000 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=2000, help="Number of streamed tokens")
+    args = parser.parse_args()
+    tokens = make_tokens(args.tokens)
+
+    def terminal_console():
+        return Console(file=io.StringIO(), force_terminal=True, width=120)
+
+    results = {
+        "legacy, terminal": time_per_1k_tokens(lambda: run_legacy(tokens, terminal_console()), args.tokens),
+        "StreamingRenderer, terminal": time_per_1k_tokens(
+            lambda: run_streaming_renderer(tokens, AgentLogger(LogLevel.INFO, console=terminal_console())),
+            args.tokens,
+        ),
+        "StreamingRenderer, no TTY": time_per_1k_tokens(
+            lambda: run_streaming_renderer(tokens, AgentLogger(LogLevel.INFO, console=Console(file=io.StringIO()))),
+            args.tokens,
+        ),
+        "StreamingRenderer, LogLevel.OFF": time_per_1k_tokens(
+            lambda: run_streaming_renderer(tokens, AgentLogger(LogLevel.OFF, console=terminal_console())),
+            args.tokens,
+        ),
+    }
+    print(f"Render overhead for {args.tokens} streamed tokens:")
+    for name, ms_per_1k in results.items():
+        print(f"  {name:<35} {ms_per_1k:10.2f} ms / 1k tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""A deterministic model replaying canned outputs, to benchmark smolagents without calling an LLM."""
+
+import time
+from collections.abc import Callable, Generator
+
+from smolagents.models import (
+    ChatMessage,
+    ChatMessageStreamDelta,
+    MessageRole,
+    Model,
+)
+from smolagents.monitoring import TokenUsage
+
+
+class ScriptedModel(Model):
+    """Replays canned outputs, one per call, optionally with a simulated latency.
+
+    Args:
+        outputs (`list[ChatMessage]` or `Callable[[int], ChatMessage]`): Outputs to return, in order, or a function
+            returning the output of the n-th call (starting at 0). A list is replayed in a loop.
+        time_to_first_token (`float`, default `0.0`): Simulated latency before the first token, in seconds.
+        time_per_chunk (`float`, default `0.0`): Simulated latency between two streamed chunks, in seconds.
+            Non-streaming calls wait for all the chunks.
+        chunk_size (`int`, default `16`): Number of characters per streamed chunk.
+        chars_per_token (`float`, default `4.0`): Used to report token usage.
+    """
+
+    def __init__(
+        self,
+        outputs: list[ChatMessage] | Callable[[int], ChatMessage],
+        time_to_first_token: float = 0.0,
+        time_per_chunk: float = 0.0,
+        chunk_size: int = 16,
+        chars_per_token: float = 4.0,
+    ):
+        super().__init__(model_id="scripted-model")
+        self.outputs = outputs
+        self.time_to_first_token = time_to_first_token
+        self.time_per_chunk = time_per_chunk
+        self.chunk_size = chunk_size
+        self.chars_per_token = chars_per_token
+        self.calls = 0
+        # Total latency simulated so far, to subtract it from measured durations
+        self.simulated_latency = 0.0
+
+    def reset(self):
+        self.calls = 0
+        self.simulated_latency = 0.0
+
+    def _next_output(self, messages) -> tuple[ChatMessage, TokenUsage]:
+        if callable(self.outputs):
+            output = self.outputs(self.calls)
+        else:
+            output = self.outputs[self.calls % len(self.outputs)]
+        self.calls += 1
+        input_chars = sum(
+            len(str(message["content"] if isinstance(message, dict) else message.content)) for message in messages
+        )
+        output_chars = len(output.content or "") + sum(
+            len(str(tool_call.function.arguments)) for tool_call in output.tool_calls or []
+        )
+        return output, TokenUsage(
+            input_tokens=int(input_chars / self.chars_per_token),
+            output_tokens=max(1, int(output_chars / self.chars_per_token)),
+        )
+
+    def _chunks(self, output: ChatMessage) -> list[str]:
+        content = output.content or ""
+        return [content[i : i + self.chunk_size] for i in range(0, len(content), self.chunk_size)] or [""]
+
+    def _sleep(self, duration: float):
+        if duration > 0:
+            time.sleep(duration)
+            self.simulated_latency += duration
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        output, token_usage = self._next_output(messages)
+        self._sleep(self.time_to_first_token + self.time_per_chunk * (len(self._chunks(output)) - 1))
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=output.content,
+            tool_calls=output.tool_calls,
+            token_usage=token_usage,
+        )
+
+    def generate_stream(
+        self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs
+    ) -> Generator[ChatMessageStreamDelta]:
+        output, token_usage = self._next_output(messages)
+        self._sleep(self.time_to_first_token)
+        for index, chunk in enumerate(self._chunks(output)):
+            if index > 0:
+                self._sleep(self.time_per_chunk)
+            yield ChatMessageStreamDelta(content=chunk)
+        if output.tool_calls:
+            yield ChatMessageStreamDelta(tool_calls=output.tool_calls)
+        yield ChatMessageStreamDelta(content="", token_usage=token_usage)
@@ -14,6 +14,7 @@ from tqdm import tqdm
 
 from smolagents import (
     AgentError,
+    CachedModel,
     CodeAgent,
     GoogleSearchTool,
     InferenceClientModel,
@@ -86,6 +87,18 @@ def parse_arguments():
         type=str,
         default="smolagents/answers",
     )
+    parser.add_argument(
+        "--cache-path",
+        type=str,
+        default=None,
+        help="Cache model responses in this SQLite file, so that re-runs do not call the model again",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        type=str,
+        default="record",
+        choices=["record", "read_only", "refresh"],
+    )
     return parser.parse_args()
 
 
@@ -243,6 +256,8 @@ if __name__ == "__main__":
         )
     else:
         model = InferenceClientModel(model_id=args.model_id, provider=args.provider, max_tokens=8192)
+    if args.cache_path:
+        model = CachedModel(model, cache_path=args.cache_path, mode=args.cache_mode)
 
     answer_questions(
         eval_ds,
@@ -15,18 +15,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import importlib
-import inspect
 import json
 import os
 import re
 import tempfile
 import textwrap
+import threading
 import time
 import warnings
+import weakref
 from abc import ABC, abstractmethod
 from collections.abc import Callable, Generator
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from contextvars import copy_context
+from dataclasses import dataclass, field
 from logging import getLogger
 from pathlib import Path
 from typing import TYPE_CHECKING, Any, Literal, TypedDict
@@ -36,8 +39,6 @@ import yaml
 from huggingface_hub import create_repo, metadata_update, snapshot_download, upload_folder
 from jinja2 import StrictUndefined, Template
 from rich.console import Group
-from rich.live import Live
-from rich.markdown import Markdown
 from rich.panel import Panel
 from rich.rule import Rule
 from rich.text import Text
@@ -52,7 +53,11 @@ from .local_python_executor import BASE_BUILTIN_MODULES, LocalPythonExecutor, Py
 from .memory import (
     ActionStep,
     AgentMemory,
+    CallbackEvent,
+    CallbackRegistry,
     FinalAnswerStep,
+    MemoryPolicy,
+    MemoryStep,
     Message,
     PlanningStep,
     SystemPromptStep,
@@ -67,13 +72,20 @@ from .models import (
     ChatMessageStreamDelta,
     MessageRole,
     Model,
+    StreamingToolCallParser,
+    TokenCounter,
+    ToolCallStreamAccumulator,
     parse_json_if_needed,
 )
 from .monitoring import (
     YELLOW_HEX,
     AgentLogger,
     LogLevel,
+    MetricsRegistry,
     Monitor,
+    RunProfiler,
+    StreamingRenderer,
+    profile_phase,
 )
 from .remote_executors import DockerExecutor, E2BExecutor
 from .tools import Tool
@@ -85,6 +97,7 @@ from .utils import (
     AgentParsingError,
     AgentToolCallError,
     AgentToolExecutionError,
+    CodeBlockDetector,
     extract_code_from_text,
     is_valid_name,
     make_init_file,
@@ -95,6 +108,10 @@ from .utils import (
 
 logger = getLogger(__name__)
 
+# Per-tool concurrency limit and slots of each tool thread pool, shared by all the agents using the pool
+_tool_semaphores_by_executor: "weakref.WeakKeyDictionary[ThreadPoolExecutor, dict[str, tuple[int, threading.BoundedSemaphore]]]" = weakref.WeakKeyDictionary()
+_tool_semaphores_lock = threading.Lock()
+
 
 def get_variable_names(self, template: str) -> set[str]:
     pattern = re.compile(r"\{\{([^{}]+)\}\}")
@@ -191,9 +208,12 @@ class RunResult:
     Attributes:
         output (Any | None): The final output of the agent run, if available.
         state (Literal["success", "max_steps_error"]): The final state of the agent after the run.
-        messages (list[dict]): The agent's memory, as a list of messages.
+        messages (list[dict]): The agent's memory, as a list of steps.
+            Model input messages are given as ranges of `message_log`.
         token_usage (TokenUsage | None): Count of tokens used during the run.
         timing (Timing): Timing details of the agent run: start time, end time, duration.
+        message_log (list[Message]): The messages sent to the model during the run, each message appearing once.
+        metrics (dict): Percentiles of the step, model, tool and executor durations, see `Monitor.get_metrics`.
     """
 
     output: Any | None
@@ -201,6 +221,8 @@ class RunResult:
     messages: list[dict]
     token_usage: TokenUsage | None
     timing: Timing
+    message_log: list[Message] = field(default_factory=list)
+    metrics: dict = field(default_factory=dict)
 
 
 class MultiStepAgent(ABC):
@@ -220,7 +242,9 @@ class MultiStepAgent(ABC):
             Parameter `grammar` is deprecated and will be removed in version 1.20.
             </Deprecated>
         managed_agents (`list`, *optional*): Managed agents that the agent can call.
-        step_callbacks (`list[Callable]`, *optional*): Callbacks that will be called at each step.
+        step_callbacks (`list[Callable]`, `dict` or [`CallbackRegistry`], *optional*): Callbacks that will be called
+            during the run. A list registers callbacks called at the end of each action step. A dict maps either a
+            [`CallbackEvent`] or a memory step type (for the end of steps of that type) to one or several callbacks.
         planning_interval (`int`, *optional*): Interval at which the agent will run a planning step.
         name (`str`, *optional*): Necessary for a managed agent only - the name by which this agent can be called.
         description (`str`, *optional*): Necessary for a managed agent only - the description of this agent.
@@ -229,6 +253,15 @@ class MultiStepAgent(ABC):
             Each function should:
             - Take the final answer and the agent's memory as arguments.
             - Return a boolean indicating whether the final answer is valid.
+        memory_policy ([`MemoryPolicy`], *optional*): Policy compacting the memory sent to the model to fit a token
+            budget, e.g. [`SlidingWindowPolicy`]. By default, the full memory is sent.
+        metrics_registry ([`MetricsRegistry`], *optional*): Process-wide registry to record the runs, steps, errors,
+            tokens and latencies of the agent into. It can be shared by several agents.
+        profiler ([`RunProfiler`], *optional*): Profiler breaking down the time of each run into model calls, tool
+            calls, code execution, prompt assembly, logging and callbacks.
+        count_input_tokens (`bool`, default `False`): Whether to count the input tokens of each step locally before
+            calling the model, to record the accuracy of the estimate in the monitor. This tokenizes the whole input
+            at each step. With a `memory_policy`, the estimate is always recorded, as the policy already counts them.
     """
 
     def __init__(
@@ -241,7 +274,10 @@ class MultiStepAgent(ABC):
         verbosity_level: LogLevel = LogLevel.INFO,
         grammar: dict[str, str] | None = None,
         managed_agents: list | None = None,
-        step_callbacks: list[Callable] | None = None,
+        step_callbacks: list[Callable]
+        | dict[CallbackEvent | type[MemoryStep], Callable | list[Callable]]
+        | CallbackRegistry
+        | None = None,
         planning_interval: int | None = None,
         name: str | None = None,
         description: str | None = None,
@@ -249,6 +285,10 @@ class MultiStepAgent(ABC):
         final_answer_checks: list[Callable] | None = None,
         return_full_result: bool = False,
         logger: AgentLogger | None = None,
+        memory_policy: MemoryPolicy | None = None,
+        metrics_registry: MetricsRegistry | None = None,
+        profiler: RunProfiler | None = None,
+        count_input_tokens: bool = False,
     ):
         self.agent_name = self.__class__.__name__
         self.model = model
@@ -286,7 +326,16 @@ class MultiStepAgent(ABC):
         self._validate_tools_and_managed_agents(tools, managed_agents)
 
         self.task: str | None = None
-        self.memory = AgentMemory(self.system_prompt)
+        # The policy may be shared by agents using other models: it counts tokens with the counter of this memory
+        self.memory = AgentMemory(
+            self.system_prompt,
+            policy=memory_policy,
+            token_counter=self.model.token_counter
+            if memory_policy is not None and isinstance(self.model, Model)
+            else None,
+        )
+        self.count_input_tokens = count_input_tokens
+        self._tools_token_counts: dict[tuple[str, ...], int] = {}
 
         if logger is None:
             self.logger = AgentLogger(level=verbosity_level)
@@ -294,8 +343,9 @@ class MultiStepAgent(ABC):
             self.logger = logger
 
         self.monitor = Monitor(self.model, self.logger)
-        self.step_callbacks = step_callbacks if step_callbacks is not None else []
-        self.step_callbacks.append(self.monitor.update_metrics)
+        self.metrics_registry = metrics_registry
+        self.profiler = profiler
+        self._setup_step_callbacks(step_callbacks)
         self.stream_outputs = False
 
     @property
@@ -313,6 +363,30 @@ class MultiStepAgent(ABC):
             raise ValueError(f"Agent name '{name}' must be a valid Python identifier and not a reserved keyword.")
         return name
 
+    def _setup_step_callbacks(self, step_callbacks) -> None:
+        """Register step callbacks once, so that dispatching them does not inspect their signatures at each step."""
+        if isinstance(step_callbacks, CallbackRegistry):
+            # Copied, as the callbacks of this agent are added to it and the registry may be shared with other agents
+            self.step_callbacks = step_callbacks.copy()
+        else:
+            self.step_callbacks = CallbackRegistry()
+            if isinstance(step_callbacks, dict):
+                for key, callbacks in step_callbacks.items():
+                    for callback in callbacks if isinstance(callbacks, list) else [callbacks]:
+                        if isinstance(key, type):
+                            self.step_callbacks.register(callback, CallbackEvent.STEP_END, step_type=key)
+                        else:
+                            self.step_callbacks.register(callback, key)
+            elif step_callbacks is not None:
+                for callback in step_callbacks:
+                    self.step_callbacks.append(callback)
+        self.step_callbacks.append(self.monitor.update_metrics)
+        if self.metrics_registry is not None:
+            self.step_callbacks.append(self.metrics_registry.record_step)
+        if hasattr(self.model, "record_step_outcome"):
+            # Models routing between several models, like CascadeModel, learn from the outcome of each step
+            self.step_callbacks.append(self.model.record_step_outcome)
+
     def _setup_managed_agents(self, managed_agents: list | None = None) -> None:
         """Setup managed agents with proper logging."""
         self.managed_agents = {}
@@ -389,6 +463,8 @@ You have been provided with these additional arguments, that you can access usin
         if reset:
             self.memory.reset()
             self.monitor.reset()
+            if self.profiler is not None:
+                self.profiler.reset()
 
         self.logger.log_task(
             content=self.task.strip(),
@@ -402,13 +478,18 @@ You have been provided with these additional arguments, that you can access usin
             self.python_executor.send_variables(variables=self.state)
             self.python_executor.send_tools({**self.tools, **self.managed_agents})
 
+        run_stream = self._run_stream(task=self.task, max_steps=max_steps, images=images)
+        if self.profiler is not None:
+            run_stream = self.profiler.profile_run(run_stream)
+        if self.metrics_registry is not None:
+            run_stream = self.metrics_registry.track_run(run_stream)
         if stream:
             # The steps are returned as they are executed through a generator to iterate on.
-            return self._run_stream(task=self.task, max_steps=max_steps, images=images)
+            return run_stream
         run_start_time = time.time()
         # Outputs are returned only at the end. We only look at the last step.
 
-        steps = list(self._run_stream(task=self.task, max_steps=max_steps, images=images))
+        steps = list(run_stream)
         assert isinstance(steps[-1], FinalAnswerStep)
         output = steps[-1].output
 
@@ -442,6 +523,8 @@ You have been provided with these additional arguments, that you can access usin
                 messages=messages,
                 timing=Timing(start_time=run_start_time, end_time=time.time()),
                 state=state,
+                message_log=self.memory.get_message_log(),
+                metrics=self.monitor.get_metrics(),
             )
 
         return output
@@ -461,11 +544,12 @@ You have been provided with these additional arguments, that you can access usin
             ):
                 planning_start_time = time.time()
                 planning_step = None
-                for element in self._generate_planning_step(
-                    task, is_first_step=(len(self.memory.steps) == 1), step=self.step_number
-                ):
-                    yield element
-                    planning_step = element
+                with profile_phase("planning", step=self.step_number):
+                    for element in self._generate_planning_step(
+                        task, is_first_step=(len(self.memory.steps) == 1), step=self.step_number
+                    ):
+                        yield element
+                        planning_step = element
                 assert isinstance(planning_step, PlanningStep)  # Last yielded element should be a PlanningStep
                 self.memory.steps.append(planning_step)
                 planning_end_time = time.time()
@@ -473,6 +557,7 @@ You have been provided with these additional arguments, that you can access usin
                     start_time=planning_start_time,
                     end_time=planning_end_time,
                 )
+                self.step_callbacks.dispatch(CallbackEvent.STEP_END, planning_step, agent=self)
 
             # Start action step!
             action_step_start_time = time.time()
@@ -481,12 +566,16 @@ You have been provided with these additional arguments, that you can access usin
                 timing=Timing(start_time=action_step_start_time),
                 observations_images=images,
             )
+            self.step_callbacks.dispatch(CallbackEvent.STEP_START, action_step, agent=self)
             try:
-                for el in self._execute_step(action_step):
-                    yield el
+                with profile_phase("step", step=self.step_number):
+                    for el in self._execute_step(action_step):
+                        yield el
                 final_answer = el
             except AgentGenerationError as e:
                 # Agent generation errors are not caused by a Model error but an implementation error: so we should raise them and exit.
+                # The step still records the error, for the step callbacks like metrics to see it.
+                action_step.error = e
                 raise e
             except AgentError as e:
                 # Other AgentError types are caused by the Model, so we should log them and iterate.
@@ -500,6 +589,7 @@ You have been provided with these additional arguments, that you can access usin
         if final_answer is None and self.step_number == max_steps + 1:
             final_answer = self._handle_max_steps_reached(task, images)
             yield action_step
+        self.step_callbacks.wait()
         yield FinalAnswerStep(handle_agent_output_types(final_answer))
 
     def _execute_step(self, memory_step: ActionStep) -> Generator[ChatMessageStreamDelta | FinalOutput]:
@@ -523,11 +613,7 @@ You have been provided with these additional arguments, that you can access usin
 
     def _finalize_step(self, memory_step: ActionStep):
         memory_step.timing.end_time = time.time()
-        for callback in self.step_callbacks:
-            # For compatibility with old callbacks that don't take the agent as an argument
-            callback(memory_step) if len(inspect.signature(callback).parameters) == 1 else callback(
-                memory_step, agent=self
-            )
+        self.step_callbacks.dispatch(CallbackEvent.STEP_END, memory_step, agent=self)
 
     def _handle_max_steps_reached(self, task: str, images: list["PIL.Image.Image"]) -> Any:
         action_step_start_time = time.time()
@@ -566,11 +652,11 @@ You have been provided with these additional arguments, that you can access usin
                 plan_message_content = ""
                 output_stream = self.model.generate_stream(input_messages, stop_sequences=["<end_plan>"])  # type: ignore
                 input_tokens, output_tokens = 0, 0
-                with Live("", console=self.logger.console, vertical_overflow="visible") as live:
+                with StreamingRenderer(self.logger) as renderer:
                     for event in output_stream:
                         if event.content is not None:
                             plan_message_content += event.content
-                            live.update(Markdown(plan_message_content))
+                            renderer.append(event.content)
                             if event.token_usage:
                                 output_tokens += event.token_usage.output_tokens
                                 input_tokens = event.token_usage.input_tokens
@@ -622,14 +708,14 @@ You have been provided with these additional arguments, that you can access usin
             if self.stream_outputs and hasattr(self.model, "generate_stream"):
                 plan_message_content = ""
                 input_tokens, output_tokens = 0, 0
-                with Live("", console=self.logger.console, vertical_overflow="visible") as live:
+                with StreamingRenderer(self.logger) as renderer:
                     for event in self.model.generate_stream(
                         input_messages,
                         stop_sequences=["<end_plan>"],
                     ):  # type: ignore
                         if event.content is not None:
                             plan_message_content += event.content
-                            live.update(Markdown(plan_message_content))
+                            renderer.append(event.content)
                             if event.token_usage:
                                 output_tokens += event.token_usage.output_tokens
                                 input_tokens = event.token_usage.input_tokens
@@ -645,9 +731,11 @@ You have been provided with these additional arguments, that you can access usin
                 f"""I still need to solve the task I was given:\n```\n{self.task}\n```\n\nHere are the facts I know and my new/updated plan of action to solve the task:\n```\n{plan_message_content}\n```"""
             )
         log_headline = "Initial plan" if is_first_step else "Updated plan"
-        self.logger.log(Rule(f"[bold]{log_headline}", style="orange"), Text(plan), level=LogLevel.INFO)
+        self.logger.log_lazy(
+            lambda: Rule(f"[bold]{log_headline}", style="orange"), lambda: Text(plan), level=LogLevel.INFO
+        )
         yield PlanningStep(
-            model_input_messages=input_messages,
+            model_input_messages=self.memory.message_log.record(input_messages, kind="planning"),
             plan=plan,
             model_output_message=ChatMessage(role=MessageRole.ASSISTANT, content=plan_message_content),
             token_usage=TokenUsage(input_tokens=input_tokens, output_tokens=output_tokens),
@@ -679,10 +767,44 @@ You have been provided with these additional arguments, that you can access usin
         that can be used as input to the LLM. Adds a number of keywords (such as PLAN, error, etc) to help
         the LLM.
         """
-        messages = self.memory.system_prompt.to_messages(summary_mode=summary_mode)
-        for memory_step in self.memory.steps:
-            messages.extend(memory_step.to_messages(summary_mode=summary_mode))
-        return messages
+        return self.memory.write_to_messages(summary_mode=summary_mode)
+
+    def estimate_input_tokens(
+        self, messages: list[Message] | None = None, tools_to_call_from: list[Tool] | None = None
+    ) -> int | None:
+        """Estimates the number of input tokens of a model call locally, before sending it.
+
+        Args:
+            messages (`list[Message]`, *optional*): Messages to send. Defaults to `write_memory_to_messages()`.
+            tools_to_call_from (`list[Tool]`, *optional*): Tools sent with the messages.
+
+        Returns:
+            `int | None`: Estimated number of input tokens, `None` if the model cannot count tokens.
+        """
+        if not isinstance(self.model, Model):
+            return None
+        if messages is None:
+            messages = self.write_memory_to_messages()
+        return self.model.count_tokens(messages, tools_to_call_from=tools_to_call_from)
+
+    def _estimate_step_input_tokens(
+        self, messages: list[Message], tools_to_call_from: list[Tool] | None = None
+    ) -> int | None:
+        """Returns the estimated input tokens of a step, reusing the count of the memory policy if there is one."""
+        if not isinstance(self.model, Model):
+            return None
+        if self.memory.last_token_count is None:
+            return self.estimate_input_tokens(messages, tools_to_call_from) if self.count_input_tokens else None
+        tokens = self.memory.last_token_count
+        if tools_to_call_from:
+            # Tool schemas rarely change between steps: count them once
+            tool_names = tuple(tool.name for tool in tools_to_call_from)
+            if tool_names not in self._tools_token_counts:
+                self._tools_token_counts[tool_names] = self.model.count_tokens(
+                    [], tools_to_call_from=tools_to_call_from
+                )
+            tokens += self._tools_token_counts[tool_names]
+        return tokens
 
     def _step_stream(self, memory_step: ActionStep) -> Generator[ChatMessageStreamDelta | FinalOutput]:
         """
@@ -1158,6 +1280,13 @@ class ToolCallingAgent(MultiStepAgent):
         max_tool_threads (`int`, *optional*): Maximum number of threads for parallel tool calls.
             Higher values increase concurrency but resource usage as well.
             Defaults to `ThreadPoolExecutor`'s default.
+        tool_executor (`ThreadPoolExecutor`, *optional*): Thread pool used to run parallel tool calls.
+            Pass the same executor to several agents to share one pool between them.
+            If not provided, the agent creates its own pool on first use and keeps it alive across steps.
+        tool_concurrency_limits (`dict[str, int]`, *optional*): Maximum number of concurrent calls per tool name,
+            e.g. `{"web_search": 2}`. Tools not listed are only limited by the size of the thread pool.
+            The limits hold across the agents sharing a `tool_executor`, which must not set different limits for the
+            same tool.
         **kwargs: Additional keyword arguments.
     """
 
@@ -1169,6 +1298,8 @@ class ToolCallingAgent(MultiStepAgent):
         planning_interval: int | None = None,
         stream_outputs: bool = False,
         max_tool_threads: int | None = None,
+        tool_executor: ThreadPoolExecutor | None = None,
+        tool_concurrency_limits: dict[str, int] | None = None,
         **kwargs,
     ):
         prompt_templates = prompt_templates or yaml.safe_load(
@@ -1189,6 +1320,67 @@ class ToolCallingAgent(MultiStepAgent):
             )
         # Tool calling setup
         self.max_tool_threads = max_tool_threads
+        self._tool_executor = tool_executor
+        # A pool given at init may be shared with other agents: it is not shut down by this one
+        self._owns_tool_executor = tool_executor is None
+        self.tool_concurrency_limits = tool_concurrency_limits or {}
+        if tool_executor is not None:
+            # Check the limits against the other agents sharing the pool right away
+            for tool_name in self.tool_concurrency_limits:
+                self._get_tool_semaphore(tool_name)
+        # Setups of the tools started while the model was streaming their call
+        self._tool_setups: dict[str, Future] = {}
+
+    @property
+    def tool_executor(self) -> ThreadPoolExecutor:
+        """Thread pool running parallel tool calls, created on first use and reused across steps."""
+        if self._tool_executor is None:
+            self._tool_executor = ThreadPoolExecutor(self.max_tool_threads, thread_name_prefix="smolagents-tool")
+        return self._tool_executor
+
+    def _get_tool_semaphore(self, tool_name: str) -> threading.BoundedSemaphore | None:
+        """Returns the concurrency slots of a tool, shared by the agents using the same tool thread pool."""
+        limit = self.tool_concurrency_limits.get(tool_name)
+        if limit is None:
+            return None
+        with _tool_semaphores_lock:
+            semaphores = _tool_semaphores_by_executor.setdefault(self.tool_executor, {})
+            pool_limit, semaphore = semaphores.setdefault(tool_name, (limit, threading.BoundedSemaphore(limit)))
+        if pool_limit != limit:
+            raise ValueError(
+                f"Tool {tool_name!r} is limited to {limit} concurrent calls, but another agent sharing the same "
+                f"tool_executor limits it to {pool_limit}: pass the same tool_concurrency_limits to both agents."
+            )
+        return semaphore
+
+    def cleanup(self):
+        """Shuts down the tool thread pool, unless it was given at init."""
+        if self._owns_tool_executor and self._tool_executor is not None:
+            self._tool_executor.shutdown(wait=False, cancel_futures=True)
+            self._tool_executor = None
+
+    def _run_stream(
+        self, task: str, max_steps: int, images: list["PIL.Image.Image"] | None = None
+    ) -> Generator[ActionStep | PlanningStep | FinalAnswerStep | ChatMessageStreamDelta]:
+        try:
+            yield from super()._run_stream(task=task, max_steps=max_steps, images=images)
+        finally:
+            # The pool is reused across the steps of a run, and created again by the next run
+            self.cleanup()
+
+    def _prepare_tool(self, tool_name: str | None):
+        """Starts the setup of a tool in the background as soon as the model calls it, while its arguments stream."""
+        tool = self.tools.get(tool_name)
+        if tool is None or tool.is_initialized or tool_name in self._tool_setups:
+            return
+        setup_future = self._tool_setups[tool_name] = self.tool_executor.submit(tool.setup)
+
+        def forget_setup(future: Future):
+            # A failed setup is started again the next time the model calls the tool
+            if self._tool_setups.get(tool_name) is future:
+                del self._tool_setups[tool_name]
+
+        setup_future.add_done_callback(forget_setup)
 
     def initialize_system_prompt(self) -> str:
         system_prompt = populate_template(
@@ -1203,78 +1395,111 @@ class ToolCallingAgent(MultiStepAgent):
         Yields ChatMessageStreamDelta during the run if streaming is enabled.
         At the end, yields either None if the step is not final, or the final answer.
         """
-        memory_messages = self.write_memory_to_messages()
-
-        input_messages = memory_messages.copy()
-
-        # Add new step in logs
-        memory_step.model_input_messages = input_messages
-
-        try:
-            if self.stream_outputs and hasattr(self.model, "generate_stream"):
-                output_stream = self.model.generate_stream(
-                    input_messages,
-                    stop_sequences=["Observation:", "Calling tools:"],
-                    tools_to_call_from=list(self.tools.values()),
-                )
-
-                model_output = ""
-                input_tokens, output_tokens = 0, 0
-                tool_calls = {}
+        with profile_phase("prompt_assembly"):
+            input_messages = self.write_memory_to_messages()
+
+            # Add new step in logs: the message log only stores the messages not sent at the previous step
+            memory_step.model_input_messages = self.memory.message_log.record(input_messages)
+            memory_step.memory_compaction = self.memory.last_compaction
+            memory_step.estimated_input_tokens = self._estimate_step_input_tokens(
+                input_messages, tools_to_call_from=list(self.tools.values())
+            )
 
-                with Live("", console=self.logger.console, vertical_overflow="visible") as live:
-                    for event in output_stream:
-                        if event.content is not None:
-                            model_output += event.content
-                            if event.token_usage:
-                                output_tokens += event.token_usage.output_tokens
-                                input_tokens = event.token_usage.input_tokens
-                        if event.tool_calls:
-                            tool_calls.update({tool_call.id: tool_call for tool_call in event.tool_calls})
-                        # Propagate the streaming delta
-                        live.update(
-                            Markdown(model_output + "\n".join([str(tool_call) for tool_call in tool_calls.values()]))
+        with profile_phase("model"):
+            try:
+                model_start_time = time.perf_counter()
+                if self.stream_outputs and hasattr(self.model, "generate_stream"):
+                    output_stream = self.model.generate_stream(
+                        input_messages,
+                        stop_sequences=["Observation:", "Calling tools:"],
+                        tools_to_call_from=list(self.tools.values()),
+                    )
+
+                    model_output = ""
+                    input_tokens, output_tokens = 0, 0
+                    tool_call_accumulator = ToolCallStreamAccumulator()
+                    # For models writing tool calls as text, to find the called tool before the end of the output
+                    text_tool_call_parser = StreamingToolCallParser(
+                        getattr(self.model, "tool_name_key", "name"),
+                        getattr(self.model, "tool_arguments_key", "arguments"),
+                    )
+                    first_token_time = None
+
+                    with StreamingRenderer(
+                        self.logger,
+                        footer=lambda: "\n".join(
+                            str(tool_call) for tool_call in tool_call_accumulator.get_tool_calls()
+                        ),
+                    ) as renderer:
+                        for event in output_stream:
+                            if first_token_time is None and (event.content or event.tool_calls):
+                                first_token_time = time.perf_counter()
+                            if event.content is not None:
+                                model_output += event.content
+                                if event.token_usage:
+                                    output_tokens += event.token_usage.output_tokens
+                                    input_tokens = event.token_usage.input_tokens
+                                if event.content and text_tool_call_parser.tool_name is None:
+                                    text_tool_call_parser.feed(event.content)
+                                    self._prepare_tool(text_tool_call_parser.tool_name)
+                            if event.tool_calls:
+                                tool_call_accumulator.add(event.tool_calls)
+                                for tool_call in event.tool_calls:
+                                    if tool_call.function is not None:
+                                        self._prepare_tool(tool_call.function.name)
+                            renderer.append(event.content)
+                            # Propagate the streaming delta
+                            yield event
+                    memory_step.metrics.record_model_call(
+                        model_start_time, time.perf_counter(), first_token_time, output_tokens
+                    )
+
+                    chat_message = ChatMessage(
+                        role=MessageRole.ASSISTANT,
+                        content=model_output,
+                        token_usage=TokenUsage(
+                            input_tokens=input_tokens,
+                            output_tokens=output_tokens,
+                        ),
+                        tool_calls=tool_call_accumulator.get_tool_calls(),
+                    )
+                else:
+                    chat_message: ChatMessage = self.model.generate(
+                        input_messages,
+                        stop_sequences=["Observation:", "Calling tools:"],
+                        tools_to_call_from=list(self.tools.values()),
+                    )
+                    memory_step.metrics.record_model_call(
+                        model_start_time,
+                        time.perf_counter(),
+                        output_tokens=chat_message.token_usage.output_tokens if chat_message.token_usage else None,
+                    )
+
+                    model_output = chat_message.content
+                    if self.logger.is_enabled(LogLevel.DEBUG):
+                        self.logger.log_markdown(
+                            content=model_output if model_output else str(chat_message.raw),
+                            title="Output message of the LLM:",
+                            level=LogLevel.DEBUG,
                         )
-                        yield event
 
-                chat_message = ChatMessage(
-                    role=MessageRole.ASSISTANT,
-                    content=model_output,
-                    token_usage=TokenUsage(
-                        input_tokens=input_tokens,
-                        output_tokens=output_tokens,
-                    ),
-                    tool_calls=list(tool_calls.values()),
-                )
-            else:
-                chat_message: ChatMessage = self.model.generate(
-                    input_messages,
-                    stop_sequences=["Observation:", "Calling tools:"],
-                    tools_to_call_from=list(self.tools.values()),
-                )
-
-                model_output = chat_message.content
-                self.logger.log_markdown(
-                    content=model_output if model_output else str(chat_message.raw),
-                    title="Output message of the LLM:",
-                    level=LogLevel.DEBUG,
-                )
-
-            # Record model output
-            memory_step.model_output_message = chat_message
-            memory_step.model_output = model_output
-            memory_step.token_usage = chat_message.token_usage
-        except Exception as e:
-            raise AgentGenerationError(f"Error while generating output:\n{e}", self.logger) from e
-
-        if chat_message.tool_calls is None or len(chat_message.tool_calls) == 0:
-            try:
-                chat_message = self.model.parse_tool_calls(chat_message)
+                # Record model output
+                memory_step.model_output_message = chat_message
+                memory_step.model_output = model_output
+                memory_step.token_usage = chat_message.token_usage
             except Exception as e:
-                raise AgentParsingError(f"Error while parsing tool call from model output: {e}", self.logger)
-        else:
-            for tool_call in chat_message.tool_calls:
-                tool_call.function.arguments = parse_json_if_needed(tool_call.function.arguments)
+                raise AgentGenerationError(f"Error while generating output:\n{e}", self.logger) from e
+        self.step_callbacks.dispatch(CallbackEvent.MODEL_OUTPUT, memory_step, agent=self)
+
+        with profile_phase("parsing"):
+            if chat_message.tool_calls is None or len(chat_message.tool_calls) == 0:
+                try:
+                    chat_message = self.model.parse_tool_calls(chat_message)
+                except Exception as e:
+                    raise AgentParsingError(f"Error while parsing tool call from model output: {e}", self.logger)
+            else:
+                for tool_call in chat_message.tool_calls:
+                    tool_call.function.arguments = parse_json_if_needed(tool_call.function.arguments)
         yield from self.process_tool_calls(chat_message, memory_step)
 
     def process_tool_calls(self, chat_message: ChatMessage, memory_step: ActionStep):
@@ -1289,7 +1514,6 @@ class ToolCallingAgent(MultiStepAgent):
         """
         model_outputs = []
         tool_calls = []
-        observations = []
 
         final_answer_call = None
         parallel_calls = []
@@ -1308,13 +1532,18 @@ class ToolCallingAgent(MultiStepAgent):
         # Helper function to process a single tool call
         def process_single_tool_call(call_info):
             tool_name, tool_arguments = call_info
-            self.logger.log(
-                Panel(Text(f"Calling tool: '{tool_name}' with arguments: {tool_arguments}")),
+            self.logger.log_lazy(
+                lambda: Panel(Text(f"Calling tool: '{tool_name}' with arguments: {tool_arguments}")),
                 level=LogLevel.INFO,
             )
             if tool_arguments is None:
                 tool_arguments = {}
-            tool_call_result = self.execute_tool_call(tool_name, tool_arguments)
+            tool_start_time = time.perf_counter()
+            try:
+                with profile_phase("tool", tool=tool_name):
+                    tool_call_result = self.execute_tool_call(tool_name, tool_arguments)
+            finally:
+                memory_step.metrics.record_tool_call(tool_name, time.perf_counter() - tool_start_time)
             tool_call_result_type = type(tool_call_result)
             if tool_call_result_type in [AgentImage, AgentAudio]:
                 if tool_call_result_type == AgentImage:
@@ -1326,31 +1555,71 @@ class ToolCallingAgent(MultiStepAgent):
                 observation = f"Stored '{observation_name}' in memory."
             else:
                 observation = str(tool_call_result).strip()
-            self.logger.log(
-                f"Observations: {observation.replace('[', '|')}",  # escape potential rich-tag-like components
+            self.logger.log_lazy(
+                lambda: f"Observations: {observation.replace('[', '|')}",  # escape potential rich-tag-like components
                 level=LogLevel.INFO,
             )
             return observation
 
         # Process non-final-answer tool calls in parallel
+        observations = [None] * len(parallel_calls)
         if parallel_calls:
             if len(parallel_calls) == 1:
                 # If there's only one call, process it directly
-                observations.append(process_single_tool_call(parallel_calls[0]))
+                semaphore = self._get_tool_semaphore(parallel_calls[0][0])
+                with semaphore if semaphore is not None else nullcontext():
+                    observations[0] = process_single_tool_call(parallel_calls[0])
+                self.step_callbacks.dispatch(
+                    CallbackEvent.TOOL_RESULT,
+                    memory_step,
+                    agent=self,
+                    tool_call=tool_calls[0],
+                    tool_output=observations[0],
+                )
                 yield FinalOutput(output=None)
             else:
-                # If multiple tool calls, process them in parallel
-                with ThreadPoolExecutor(self.max_tool_threads) as executor:
-                    futures = [executor.submit(process_single_tool_call, call_info) for call_info in parallel_calls]
-                    for future in as_completed(futures):
-                        observations.append(future.result())
-                        yield FinalOutput(output=None)
+                # If multiple tool calls, process them in parallel on the persistent pool
+                pending_calls = list(enumerate(parallel_calls))
+                future_to_index = {}
+                try:
+                    while pending_calls or future_to_index:
+                        # Calls are submitted once their tool has a free slot, so that pool workers never wait for one.
+                        # When nothing runs, the slots are held by other agents sharing the pool: wait for one.
+                        for index, call_info in list(pending_calls):
+                            semaphore = self._get_tool_semaphore(call_info[0])
+                            if semaphore is not None and not semaphore.acquire(blocking=not future_to_index):
+                                continue
+                            pending_calls.remove((index, call_info))
+                            # Tool calls run in the context of the step, e.g. to be profiled with the run
+                            future = self.tool_executor.submit(copy_context().run, process_single_tool_call, call_info)
+                            if semaphore is not None:
+                                future.add_done_callback(lambda _, semaphore=semaphore: semaphore.release())
+                            future_to_index[future] = index
+                        done_futures, _ = wait(future_to_index, return_when=FIRST_COMPLETED)
+                        for future in done_futures:
+                            # Results stream in completion order, but are stored in tool call order, tagged with
+                            # their call id to be matched with their call
+                            index = future_to_index.pop(future)
+                            observation = future.result()
+                            observations[index] = f"Call id: {tool_calls[index].id}\n{observation}"
+                            self.step_callbacks.dispatch(
+                                CallbackEvent.TOOL_RESULT,
+                                memory_step,
+                                agent=self,
+                                tool_call=tool_calls[index],
+                                tool_output=observation,
+                            )
+                            yield FinalOutput(output=None)
+                finally:
+                    # The pool outlives this step: drop calls that have not started yet if we exit early
+                    for future in future_to_index:
+                        future.cancel()
 
         # Process final_answer call if present
         if final_answer_call:
             tool_name, tool_arguments = final_answer_call
-            self.logger.log(
-                Panel(Text(f"Calling tool: '{tool_name}' with arguments: {tool_arguments}")),
+            self.logger.log_lazy(
+                lambda: Panel(Text(f"Calling tool: '{tool_name}' with arguments: {tool_arguments}")),
                 level=LogLevel.INFO,
             )
             answer = (
@@ -1362,18 +1631,28 @@ class ToolCallingAgent(MultiStepAgent):
                 # if the answer is a state variable, return the value
                 # State variables are not JSON-serializable (AgentImage, AgentAudio) so can't be passed as arguments to execute_tool_call
                 final_answer = self.state[answer]
-                self.logger.log(
-                    f"[bold {YELLOW_HEX}]Final answer:[/bold {YELLOW_HEX}] Extracting key '{answer}' from state to return value '{final_answer}'.",
+                self.logger.log_lazy(
+                    lambda: (
+                        f"[bold {YELLOW_HEX}]Final answer:[/bold {YELLOW_HEX}] Extracting key '{answer}' from state to return value '{final_answer}'."
+                    ),
                     level=LogLevel.INFO,
                 )
             else:
                 # Allow arbitrary keywords
-                final_answer = self.execute_tool_call("final_answer", tool_arguments)
-                self.logger.log(
-                    Text(f"Final answer: {final_answer}", style=f"bold {YELLOW_HEX}"),
+                tool_start_time = time.perf_counter()
+                try:
+                    with profile_phase("tool", tool="final_answer"):
+                        final_answer = self.execute_tool_call("final_answer", tool_arguments)
+                finally:
+                    memory_step.metrics.record_tool_call("final_answer", time.perf_counter() - tool_start_time)
+                self.logger.log_lazy(
+                    lambda: Text(f"Final answer: {final_answer}", style=f"bold {YELLOW_HEX}"),
                     level=LogLevel.INFO,
                 )
             memory_step.action_output = final_answer
+            self.step_callbacks.dispatch(
+                CallbackEvent.TOOL_RESULT, memory_step, agent=self, tool_call=tool_calls[-1], tool_output=final_answer
+            )
             yield FinalOutput(output=final_answer)
 
         # Update memory step with all results
@@ -1414,6 +1693,9 @@ class ToolCallingAgent(MultiStepAgent):
         tool = available_tools[tool_name]
         arguments = self._substitute_state_variables(arguments)
         is_managed_agent = tool_name in self.managed_agents
+        if (setup_future := self._tool_setups.get(tool_name)) is not None:
+            # Wait for the setup started during generation: a failed setup is run again by the call, raising its error
+            setup_future.exception()
 
         try:
             # Call tool with appropriate arguments
@@ -1571,79 +1853,119 @@ class CodeAgent(MultiStepAgent):
         Yields ChatMessageStreamDelta during the run if streaming is enabled.
         At the end, yields either None if the step is not final, or the final answer.
         """
-        memory_messages = self.write_memory_to_messages()
-
-        input_messages = memory_messages.copy()
-        ### Generate model output ###
-        memory_step.model_input_messages = input_messages
-        try:
-            additional_args: dict[str, Any] = {}
-            if self.grammar:
-                additional_args["grammar"] = self.grammar
-            if self._use_structured_outputs_internally:
-                additional_args["response_format"] = CODEAGENT_RESPONSE_FORMAT
-            if self.stream_outputs:
-                output_stream = self.model.generate_stream(
-                    input_messages,
-                    stop_sequences=["<end_code>", "Observation:", "Calling tools:"],
-                    **additional_args,
-                )
-                output_text = ""
-                input_tokens, output_tokens = 0, 0
-                with Live("", console=self.logger.console, vertical_overflow="visible") as live:
-                    for event in output_stream:
-                        if event.content is not None:
-                            output_text += event.content
-                            live.update(Markdown(output_text))
+        with profile_phase("prompt_assembly"):
+            input_messages = self.write_memory_to_messages()
+            ### Generate model output ###
+            memory_step.model_input_messages = self.memory.message_log.record(input_messages)
+            memory_step.memory_compaction = self.memory.last_compaction
+            memory_step.estimated_input_tokens = self._estimate_step_input_tokens(input_messages)
+        with profile_phase("model"):
+            try:
+                additional_args: dict[str, Any] = {}
+                if self.grammar:
+                    additional_args["grammar"] = self.grammar
+                if self._use_structured_outputs_internally:
+                    additional_args["response_format"] = CODEAGENT_RESPONSE_FORMAT
+                model_start_time = time.perf_counter()
+                if self.stream_outputs:
+                    output_stream = self.model.generate_stream(
+                        input_messages,
+                        stop_sequences=["<end_code>", "Observation:", "Calling tools:"],
+                        **additional_args,
+                    )
+                    output_text = ""
+                    input_tokens, output_tokens = 0, 0
+                    received_token_usage = stream_interrupted = False
+                    first_token_time = None
+                    # Structured outputs are JSON, so code fences are only meaningful in plain text outputs
+                    code_block_detector = None if self._use_structured_outputs_internally else CodeBlockDetector()
+                    with StreamingRenderer(self.logger) as renderer:
+                        for event in output_stream:
+                            assert isinstance(event, ChatMessageStreamDelta)
+                            if event.token_usage:
+                                received_token_usage = True
+                            if event.content:
+                                if first_token_time is None:
+                                    first_token_time = time.perf_counter()
+                                if code_block_detector is not None and code_block_detector.feed(event.content):
+                                    # The code block is complete: drop anything generated after its closing fence
+                                    event = ChatMessageStreamDelta(
+                                        content=code_block_detector.text[
+                                            len(output_text) : code_block_detector.code_end
+                                        ],
+                                        token_usage=event.token_usage,
+                                    )
+                                    stream_interrupted = True
+                                output_text += event.content
+                                renderer.append(event.content)
                             if event.token_usage:
                                 output_tokens += event.token_usage.output_tokens
                                 input_tokens = event.token_usage.input_tokens
-                        assert isinstance(event, ChatMessageStreamDelta)
-                        yield event
-
-                chat_message = ChatMessage(
-                    role="assistant",
-                    content=output_text,
-                    token_usage=TokenUsage(input_tokens=input_tokens, output_tokens=output_tokens),
-                )
-                memory_step.model_output_message = chat_message
-                output_text = chat_message.content
-            else:
-                chat_message: ChatMessage = self.model.generate(
-                    input_messages,
-                    stop_sequences=["<end_code>", "Observation:", "Calling tools:"],
-                    **additional_args,
-                )
-                memory_step.model_output_message = chat_message
-                output_text = chat_message.content
-                self.logger.log_markdown(
-                    content=output_text,
-                    title="Output message of the LLM:",
-                    level=LogLevel.DEBUG,
-                )
-
-            # This adds <end_code> sequence to the history.
-            # This will nudge ulterior LLM calls to finish with <end_code>, thus efficiently stopping generation.
-            if output_text and output_text.strip().endswith("```"):
-                output_text += "<end_code>"
-                memory_step.model_output_message.content = output_text
-
-            memory_step.token_usage = chat_message.token_usage
-            memory_step.model_output = output_text
-        except Exception as e:
-            raise AgentGenerationError(f"Error in generating model output:\n{e}", self.logger) from e
+                            yield event
+                            if stream_interrupted:
+                                break
+                    if stream_interrupted and hasattr(output_stream, "close"):
+                        # Stop the generation early rather than waiting for a stop sequence
+                        output_stream.close()
+                    memory_step.metrics.record_model_call(
+                        model_start_time, time.perf_counter(), first_token_time, output_tokens
+                    )
+
+                    chat_message = ChatMessage(
+                        role="assistant",
+                        content=output_text,
+                        token_usage=(
+                            TokenUsage(input_tokens=input_tokens, output_tokens=output_tokens)
+                            # Providers reporting usage only at the end of the stream give no count when it is cut short
+                            if received_token_usage or not stream_interrupted
+                            else None
+                        ),
+                    )
+                    memory_step.model_output_message = chat_message
+                    output_text = chat_message.content
+                else:
+                    chat_message: ChatMessage = self.model.generate(
+                        input_messages,
+                        stop_sequences=["<end_code>", "Observation:", "Calling tools:"],
+                        **additional_args,
+                    )
+                    memory_step.metrics.record_model_call(
+                        model_start_time,
+                        time.perf_counter(),
+                        output_tokens=chat_message.token_usage.output_tokens if chat_message.token_usage else None,
+                    )
+                    memory_step.model_output_message = chat_message
+                    output_text = chat_message.content
+                    self.logger.log_markdown(
+                        content=output_text,
+                        title="Output message of the LLM:",
+                        level=LogLevel.DEBUG,
+                    )
+
+                # This adds <end_code> sequence to the history.
+                # This will nudge ulterior LLM calls to finish with <end_code>, thus efficiently stopping generation.
+                if output_text and output_text.strip().endswith("```"):
+                    output_text += "<end_code>"
+                    memory_step.model_output_message.content = output_text
+
+                memory_step.token_usage = chat_message.token_usage
+                memory_step.model_output = output_text
+            except Exception as e:
+                raise AgentGenerationError(f"Error in generating model output:\n{e}", self.logger) from e
+        self.step_callbacks.dispatch(CallbackEvent.MODEL_OUTPUT, memory_step, agent=self)
 
         ### Parse output ###
-        try:
-            if self._use_structured_outputs_internally:
-                code_action = json.loads(output_text)["code"]
-                code_action = extract_code_from_text(code_action) or code_action
-            else:
-                code_action = parse_code_blobs(output_text)
-            code_action = fix_final_answer_code(code_action)
-        except Exception as e:
-            error_msg = f"Error in code parsing:\n{e}\nMake sure to provide correct code blobs."
-            raise AgentParsingError(error_msg, self.logger)
+        with profile_phase("parsing"):
+            try:
+                if self._use_structured_outputs_internally:
+                    code_action = json.loads(output_text)["code"]
+                    code_action = extract_code_from_text(code_action) or code_action
+                else:
+                    code_action = parse_code_blobs(output_text)
+                code_action = fix_final_answer_code(code_action)
+            except Exception as e:
+                error_msg = f"Error in code parsing:\n{e}\nMake sure to provide correct code blobs."
+                raise AgentParsingError(error_msg, self.logger)
 
         memory_step.tool_calls = [
             ToolCall(
@@ -1656,25 +1978,22 @@ class CodeAgent(MultiStepAgent):
         ### Execute action ###
         self.logger.log_code(title="Executing parsed code:", content=code_action, level=LogLevel.INFO)
         is_final_answer = False
+        executor_start_time = time.perf_counter()
         try:
-            output, execution_logs, is_final_answer = self.python_executor(code_action)
-            execution_outputs_console = []
-            if len(execution_logs) > 0:
-                execution_outputs_console += [
-                    Text("Execution logs:", style="bold"),
-                    Text(execution_logs),
-                ]
+            with profile_phase("interpreter"):
+                output, execution_logs, is_final_answer = self.python_executor(code_action)
+            self._record_executor_metrics(memory_step, executor_start_time)
             observation = "Execution logs:\n" + execution_logs
         except Exception as e:
+            self._record_executor_metrics(memory_step, executor_start_time)
             if hasattr(self.python_executor, "state") and "_print_outputs" in self.python_executor.state:
                 execution_logs = str(self.python_executor.state["_print_outputs"])
                 if len(execution_logs) > 0:
-                    execution_outputs_console = [
-                        Text("Execution logs:", style="bold"),
-                        Text(execution_logs),
-                    ]
                     memory_step.observations = "Execution logs:\n" + execution_logs
-                    self.logger.log(Group(*execution_outputs_console), level=LogLevel.INFO)
+                    self.logger.log_lazy(
+                        lambda: Group(Text("Execution logs:", style="bold"), Text(execution_logs)),
+                        level=LogLevel.INFO,
+                    )
             error_msg = str(e)
             if "Import of " in error_msg and " is not allowed" in error_msg:
                 self.logger.log(
@@ -1687,16 +2006,35 @@ class CodeAgent(MultiStepAgent):
         observation += "Last output from code snippet:\n" + truncated_output
         memory_step.observations = observation
 
-        execution_outputs_console += [
-            Text(
-                f"{('Out - Final answer' if is_final_answer else 'Out')}: {truncated_output}",
-                style=(f"bold {YELLOW_HEX}" if is_final_answer else ""),
-            ),
-        ]
-        self.logger.log(Group(*execution_outputs_console), level=LogLevel.INFO)
+        def format_execution_outputs() -> Group:
+            execution_outputs_console = []
+            if len(execution_logs) > 0:
+                execution_outputs_console += [
+                    Text("Execution logs:", style="bold"),
+                    Text(execution_logs),
+                ]
+            execution_outputs_console += [
+                Text(
+                    f"{('Out - Final answer' if is_final_answer else 'Out')}: {truncated_output}",
+                    style=(f"bold {YELLOW_HEX}" if is_final_answer else ""),
+                ),
+            ]
+            return Group(*execution_outputs_console)
+
+        self.logger.log_lazy(format_execution_outputs, level=LogLevel.INFO)
         memory_step.action_output = output
+        self.step_callbacks.dispatch(
+            CallbackEvent.TOOL_RESULT, memory_step, agent=self, tool_call=memory_step.tool_calls[0], tool_output=output
+        )
         yield FinalOutput(output=output if is_final_answer else None)
 
+    def _record_executor_metrics(self, memory_step: ActionStep, executor_start_time: float) -> None:
+        memory_step.metrics.executor_duration = time.perf_counter() - executor_start_time
+        # Only the local executor counts the operations it evaluates
+        operations_count = getattr(self.python_executor, "state", {}).get("_operations_count")
+        if operations_count is not None:
+            memory_step.metrics.executor_operations = operations_count["counter"]
+
     def to_dict(self) -> dict[str, Any]:
         """Convert the agent to a dictionary representation.
 
@@ -1734,3 +2072,137 @@ class CodeAgent(MultiStepAgent):
         code_agent_kwargs.update(kwargs)
         # Call the parent class's from_dict method
         return super().from_dict(agent_dict, **code_agent_kwargs)
+
+
+class _LockstepBatcher:
+    """Collects the model calls of agents running in lockstep, and answers them with batched calls.
+
+    A call waits until every agent still running has made its own, then the calls are grouped by generation arguments
+    and each group is sent to `model.generate_batch`.
+    """
+
+    def __init__(self, model: Model, participants: int):
+        self.model = model
+        self.participants = participants
+        self.batch_sizes: list[int] = []
+        self._pending: list[tuple[list, dict, Future]] = []
+        self._lock = threading.Lock()
+
+    def generate(self, messages: list, **kwargs) -> ChatMessage:
+        future = Future()
+        with self._lock:
+            self._pending.append((messages, kwargs, future))
+            batch = self._take_batch()
+        if batch:
+            self._run(batch)
+        return future.result()
+
+    def leave(self):
+        """Called when an agent finishes, so that the others stop waiting for its calls."""
+        with self._lock:
+            self.participants -= 1
+            batch = self._take_batch()
+        if batch:
+            self._run(batch)
+
+    def _take_batch(self) -> list[tuple[list, dict, Future]]:
+        if not self._pending or len(self._pending) < self.participants:
+            return []
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _run(self, batch: list[tuple[list, dict, Future]]):
+        groups: dict[str, list[tuple[list, dict, Future]]] = {}
+        for call in batch:
+            kwargs = dict(call[1])
+            tools = kwargs.pop("tools_to_call_from", None)
+            key = repr((sorted(kwargs.items()), [tool.name for tool in tools] if tools else None))
+            groups.setdefault(key, []).append(call)
+        for calls in groups.values():
+            self.batch_sizes.append(len(calls))
+            try:
+                outputs = self.model.generate_batch([messages for messages, _, _ in calls], **calls[0][1])
+            except Exception as e:
+                for _, _, future in calls:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), output in zip(calls, outputs):
+                future.set_result(output)
+
+
+class _LockstepModel(Model):
+    """Stands in for the model of an agent running in lockstep, sending its calls to the shared batcher."""
+
+    def __init__(self, model: Model, batcher: _LockstepBatcher):
+        super().__init__(
+            flatten_messages_as_text=model.flatten_messages_as_text,
+            tool_name_key=model.tool_name_key,
+            tool_arguments_key=model.tool_arguments_key,
+            model_id=model.model_id,
+        )
+        self.model = model
+        self.batcher = batcher
+
+    def create_token_counter(self) -> TokenCounter:
+        return self.model.token_counter
+
+    def parse_tool_calls(self, message: ChatMessage) -> ChatMessage:
+        return self.model.parse_tool_calls(message)
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        return self.batcher.generate(
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+
+
+def run_agents_in_lockstep(agents: list[MultiStepAgent], tasks: list[str], **run_kwargs) -> list[Any]:
+    """Runs agents on their tasks in lockstep, answering the model calls of each round with batched calls.
+
+    Each agent runs in its own thread. Once every agent still running waits for its model, the calls of agents sharing
+    a model and generation arguments are sent together to the model's `generate_batch`, which for instance lets a
+    [`VLLMModel`] process them in a single batch. Model outputs are not streamed during the run.
+
+    Args:
+        agents (`list[MultiStepAgent]`): Agents to run, each one a distinct object.
+        tasks (`list[str]`): Task of each agent.
+        **run_kwargs: Keyword arguments passed to the `run` method of every agent, for instance `max_steps`.
+
+    Returns:
+        `list`: The outputs of the agents' runs, in order.
+
+    Example:
+    ```py
+    model = VLLMModel(model_id="Qwen/Qwen2.5-Coder-7B-Instruct")
+    agents = [CodeAgent(tools=[], model=model) for _ in tasks]
+    answers = run_agents_in_lockstep(agents, tasks, max_steps=5)
+    ```
+    """
+    if len(agents) != len(tasks):
+        raise ValueError(f"Got {len(agents)} agents for {len(tasks)} tasks: there should be one task per agent.")
+    if len({id(agent) for agent in agents}) != len(agents):
+        raise ValueError("Each agent can only run one task at a time: pass distinct agent objects.")
+    if run_kwargs.get("stream"):
+        raise ValueError("Agents running in lockstep cannot be streamed.")
+    batchers: dict[int, _LockstepBatcher] = {}
+    for agent in agents:
+        if id(agent.model) not in batchers:
+            batchers[id(agent.model)] = _LockstepBatcher(agent.model, 0)
+        batchers[id(agent.model)].participants += 1
+
+    def run_agent(agent: MultiStepAgent, task: str) -> Any:
+        model, stream_outputs = agent.model, agent.stream_outputs
+        batcher = batchers[id(model)]
+        agent.model, agent.stream_outputs = _LockstepModel(model, batcher), False
+        try:
+            return agent.run(task, **run_kwargs)
+        finally:
+            agent.model, agent.stream_outputs = model, stream_outputs
+            batcher.leave()
+
+    with ThreadPoolExecutor(max_workers=len(agents), thread_name_prefix="smolagents-lockstep") as executor:
+        futures = [executor.submit(copy_context().run, run_agent, agent, task) for agent, task in zip(agents, tasks)]
+    return [future.result() for future in futures]
@@ -1,9 +1,14 @@
-from dataclasses import asdict, dataclass
+import copy
+import inspect
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from enum import Enum
 from logging import getLogger
 from typing import TYPE_CHECKING, Any, TypedDict
 
-from smolagents.models import ChatMessage, MessageRole
-from smolagents.monitoring import AgentLogger, LogLevel, Timing, TokenUsage
+from smolagents.models import ChatMessage, HeuristicTokenCounter, MessageRole
+from smolagents.monitoring import AgentLogger, LogLevel, StepMetrics, Timing, TokenUsage, profile_phase
 from smolagents.utils import AgentError, make_json_serializable
 
 
@@ -22,6 +27,91 @@ class Message(TypedDict):
     content: str | list[dict[str, Any]]
 
 
+class MessageLog:
+    """Append-only log of the messages sent to the model during a run, shared by the memory steps.
+
+    Successive model inputs mostly extend the previous one, so each input is stored as ranges of the log: only the
+    messages that differ from the previous input are appended. Inputs of different kinds, like planning and action
+    prompts, are interleaved during a run: each input is compared with the previous input of the same kind.
+    """
+
+    def __init__(self):
+        self.messages: list[Message] = []
+        self._last_views: dict[str, MessageView] = {}
+
+    def record(self, messages: list[Message], kind: str = "action") -> "MessageView":
+        """Appends the messages that are not shared with the previously recorded input of the same kind, and returns a
+        view on them.
+
+        Args:
+            messages (`list[Message]`): Model input to record.
+            kind (`str`, default `"action"`): Kind of the model input, e.g. `"planning"` for planning prompts.
+        """
+        ranges = []
+        last_view = self._last_views.get(kind)
+        if last_view is not None:
+            shared_length = 0
+            for previous_message, message in zip(last_view, messages):
+                if previous_message is not message and previous_message != message:
+                    break
+                shared_length += 1
+            for start, end in last_view.ranges:
+                if shared_length <= 0:
+                    break
+                ranges.append((start, min(end, start + shared_length)))
+                shared_length -= end - start
+        offset = sum(end - start for start, end in ranges)
+        if offset < len(messages):
+            start = len(self.messages)
+            self.messages.extend(messages[offset:])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], len(self.messages))
+            else:
+                ranges.append((start, len(self.messages)))
+        view = self._last_views[kind] = MessageView(self, tuple(ranges))
+        return view
+
+
+class MessageView(Sequence):
+    """Read-only sequence of messages, stored as ranges of a [`MessageLog`].
+
+    Messages are only materialized when the view is indexed or iterated: use `list(view)` to get a list.
+    """
+
+    def __init__(self, log: MessageLog, ranges: tuple[tuple[int, int], ...]):
+        self.log = log
+        self.ranges = ranges
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def __iter__(self) -> Iterator[Message]:
+        for start, end in self.ranges:
+            yield from self.log.messages[start:end]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        for start, end in self.ranges:
+            if 0 <= index < end - start:
+                return self.log.messages[start + index]
+            index -= end - start
+        raise IndexError("MessageView index out of range")
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, MessageView) and other.log is self.log:
+            return other.ranges == self.ranges
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"MessageView(ranges={list(self.ranges)})"
+
+    def dict(self) -> dict:
+        return {"message_log_ranges": [list(message_range) for message_range in self.ranges]}
+
+
 @dataclass
 class ToolCall:
     name: str
@@ -39,6 +129,32 @@ class ToolCall:
         }
 
 
+def _model_input_messages_dict(model_input_messages: list[Message] | MessageView | None):
+    # Views are exported as ranges of the message log, so that each message is exported once per run
+    if isinstance(model_input_messages, MessageView):
+        return model_input_messages.dict()
+    return model_input_messages
+
+
+@dataclass
+class MemoryCompaction:
+    """Record of how a [`MemoryPolicy`] compacted the memory sent to the model at a step.
+
+    Step indices refer to `AgentMemory.steps`.
+    """
+
+    policy: str
+    max_tokens: int
+    tokens_before: int
+    tokens_after: int | None = None
+    dropped_steps: list[int] = field(default_factory=list)
+    summarized_steps: list[int] = field(default_factory=list)
+    dropped_images: int = 0
+
+    def dict(self):
+        return asdict(self)
+
+
 @dataclass
 class MemoryStep:
     def dict(self):
@@ -52,7 +168,7 @@ class MemoryStep:
 class ActionStep(MemoryStep):
     step_number: int
     timing: Timing
-    model_input_messages: list[Message] | None = None
+    model_input_messages: list[Message] | MessageView | None = None
     tool_calls: list[ToolCall] | None = None
     error: AgentError | None = None
     model_output_message: ChatMessage | None = None
@@ -61,11 +177,14 @@ class ActionStep(MemoryStep):
     observations_images: list["PIL.Image.Image"] | None = None
     action_output: Any = None
     token_usage: TokenUsage | None = None
+    memory_compaction: MemoryCompaction | None = None
+    estimated_input_tokens: int | None = None
+    metrics: StepMetrics = field(default_factory=StepMetrics)
 
     def dict(self):
         # We overwrite the method to parse the tool_calls and action_output manually
         return {
-            "model_input_messages": self.model_input_messages,
+            "model_input_messages": _model_input_messages_dict(self.model_input_messages),
             "tool_calls": [tc.dict() for tc in self.tool_calls] if self.tool_calls else [],
             "timing": self.timing.dict(),
             "token_usage": asdict(self.token_usage) if self.token_usage else None,
@@ -75,6 +194,9 @@ class ActionStep(MemoryStep):
             "model_output": self.model_output,
             "observations": self.observations,
             "action_output": make_json_serializable(self.action_output),
+            "memory_compaction": self.memory_compaction.dict() if self.memory_compaction else None,
+            "estimated_input_tokens": self.estimated_input_tokens,
+            "metrics": self.metrics.dict(),
         }
 
     def to_messages(self, summary_mode: bool = False) -> list[Message]:
@@ -140,12 +262,21 @@ class ActionStep(MemoryStep):
 
 @dataclass
 class PlanningStep(MemoryStep):
-    model_input_messages: list[Message]
+    model_input_messages: list[Message] | MessageView
     model_output_message: ChatMessage
     plan: str
     timing: Timing
     token_usage: TokenUsage | None = None
 
+    def dict(self):
+        return {
+            "model_input_messages": _model_input_messages_dict(self.model_input_messages),
+            "model_output_message": self.model_output_message.dict(),
+            "plan": self.plan,
+            "timing": self.timing.dict(),
+            "token_usage": asdict(self.token_usage) if self.token_usage else None,
+        }
+
     def to_messages(self, summary_mode: bool = False) -> list[Message]:
         if summary_mode:
             return []
@@ -186,12 +317,51 @@ class FinalAnswerStep(MemoryStep):
 
 
 class AgentMemory:
-    def __init__(self, system_prompt: str):
+    """Memory of an agent: its system prompt and the steps of its run.
+
+    Args:
+        system_prompt (`str`): System prompt of the agent.
+        policy ([`MemoryPolicy`], *optional*): Policy compacting the memory sent to the model to fit a token budget.
+        token_counter (`Callable[[list[Message]], int]`, *optional*): Function counting the tokens of messages for the
+            policy, if the policy has no token counter of its own. Agents pass the [`TokenCounter`] of their model.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str,
+        policy: "MemoryPolicy | None" = None,
+        token_counter: Callable[[list[Message]], int] | None = None,
+    ):
         self.system_prompt = SystemPromptStep(system_prompt=system_prompt)
         self.steps: list[TaskStep | ActionStep | PlanningStep] = []
+        self.message_log = MessageLog()
+        self.policy = policy
+        self.token_counter = token_counter
+        self.last_compaction: MemoryCompaction | None = None
+        # Tokens of the last messages written by the policy, counted while applying it
+        self.last_token_count: int | None = None
 
     def reset(self):
         self.steps = []
+        self.message_log = MessageLog()
+
+    def write_to_messages(self, summary_mode: bool = False) -> list[Message]:
+        """Converts the memory into messages for the model, compacted by the memory policy if there is one.
+
+        The compaction performed, if any, is stored in `last_compaction`, and the number of tokens of the messages
+        counted by the policy in `last_token_count`.
+        """
+        self.last_compaction = None
+        self.last_token_count = None
+        if self.policy is not None:
+            messages, self.last_compaction = self.policy.apply(
+                self, summary_mode=summary_mode, token_counter=self.token_counter
+            )
+            return messages
+        messages = self.system_prompt.to_messages(summary_mode=summary_mode)
+        for memory_step in self.steps:
+            messages.extend(memory_step.to_messages(summary_mode=summary_mode))
+        return messages
 
     def get_succinct_steps(self) -> list[dict]:
         return [
@@ -199,8 +369,13 @@ class AgentMemory:
         ]
 
     def get_full_steps(self) -> list[dict]:
+        """Returns the steps as dicts. Model input messages are given as ranges of [`~AgentMemory.get_message_log`]."""
         return [step.dict() for step in self.steps]
 
+    def get_message_log(self) -> list[Message]:
+        """Returns the messages sent to the model during the run, each message appearing once."""
+        return list(self.message_log.messages)
+
     def replay(self, logger: AgentLogger, detailed: bool = False):
         """Prints a pretty replay of the agent's steps.
 
@@ -217,14 +392,429 @@ class AgentMemory:
             elif isinstance(step, ActionStep):
                 logger.log_rule(f"Step {step.step_number}", level=LogLevel.ERROR)
                 if detailed and step.model_input_messages is not None:
-                    logger.log_messages(step.model_input_messages, level=LogLevel.ERROR)
+                    logger.log_messages(list(step.model_input_messages), level=LogLevel.ERROR)
                 if step.model_output is not None:
                     logger.log_markdown(title="Agent output:", content=step.model_output, level=LogLevel.ERROR)
             elif isinstance(step, PlanningStep):
                 logger.log_rule("Planning step", level=LogLevel.ERROR)
                 if detailed and step.model_input_messages is not None:
-                    logger.log_messages(step.model_input_messages, level=LogLevel.ERROR)
+                    logger.log_messages(list(step.model_input_messages), level=LogLevel.ERROR)
                 logger.log_markdown(title="Agent output:", content=step.plan, level=LogLevel.ERROR)
 
 
-__all__ = ["AgentMemory"]
+@dataclass
+class _StepMessages:
+    index: int
+    step: MemoryStep
+    messages: list[Message]
+    tokens: int
+
+
+# Token counter of the policies used without the token counter of a model
+_default_token_counter = HeuristicTokenCounter()
+
+
+class MemoryPolicy:
+    """Base class for the policies compacting the memory sent to the model when it exceeds a token budget.
+
+    Subclasses implement `compact`. The system prompt, task steps and the most recent steps are never compacted.
+
+    Args:
+        max_tokens (`int`, *optional*): Token budget of the messages sent to the model. Not needed for policies used
+            inside a [`CompositeMemoryPolicy`].
+        keep_last_steps (`int`, default `1`): Number of most recent steps kept as is.
+        token_counter (`Callable[[list[Message]], int]`, *optional*): Function counting the tokens of messages.
+            If not set, the policy uses the token counter given to `apply`, which agents set to the [`TokenCounter`]
+            of their model, or else a local estimate of about 4 characters per token.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        keep_last_steps: int = 1,
+        token_counter: Callable[[list[Message]], int] | None = None,
+    ):
+        self.max_tokens = max_tokens
+        self.keep_last_steps = keep_last_steps
+        self.token_counter = token_counter
+
+    def apply(
+        self,
+        memory: "AgentMemory",
+        summary_mode: bool = False,
+        token_counter: Callable[[list[Message]], int] | None = None,
+    ) -> tuple[list[Message], MemoryCompaction | None]:
+        """Converts the memory into messages fitting the token budget.
+
+        The number of tokens of the messages is stored in the `last_token_count` of the memory.
+
+        Args:
+            memory ([`AgentMemory`]): Memory to convert.
+            summary_mode (`bool`, default `False`): Whether to convert the steps in summary mode.
+            token_counter (`Callable[[list[Message]], int]`, *optional*): Token counter to use if the policy has
+                none of its own. Policies can be shared by agents using different models: they are not changed.
+
+        Returns:
+            `tuple[list[Message], MemoryCompaction | None]`: The messages, and a record of the compaction if the
+            memory exceeded the budget.
+        """
+        if self.max_tokens is None:
+            raise ValueError(f"{type(self).__name__} needs `max_tokens` to be applied to a memory.")
+        token_counter = self.token_counter or token_counter or _default_token_counter
+        system_messages = memory.system_prompt.to_messages(summary_mode=summary_mode)
+        system_tokens = token_counter(system_messages)
+        entries = []
+        for index, step in enumerate(memory.steps):
+            step_messages = step.to_messages(summary_mode=summary_mode)
+            entries.append(_StepMessages(index, step, step_messages, token_counter(step_messages)))
+        tokens = system_tokens + sum(entry.tokens for entry in entries)
+        compaction = None
+        if tokens > self.max_tokens:
+            compaction = MemoryCompaction(policy=type(self).__name__, max_tokens=self.max_tokens, tokens_before=tokens)
+            entries = self.compact(entries, self.max_tokens - system_tokens, compaction, token_counter)
+            tokens = compaction.tokens_after = system_tokens + sum(entry.tokens for entry in entries)
+        memory.last_token_count = tokens
+        return system_messages + [message for entry in entries for message in entry.messages], compaction
+
+    def compact(
+        self,
+        entries: list[_StepMessages],
+        budget: int,
+        compaction: MemoryCompaction,
+        token_counter: Callable[[list[Message]], int],
+    ) -> list[_StepMessages]:
+        """Compacts the messages of the steps to fit the budget, recording what was compacted.
+
+        Args:
+            entries (`list`): Messages of each memory step, with their token count.
+            budget (`int`): Number of tokens available for the messages of the steps.
+            compaction ([`MemoryCompaction`]): Record to update.
+            token_counter (`Callable[[list[Message]], int]`): Token counter to count compacted messages with.
+        """
+        raise NotImplementedError
+
+    def _compactable(self, entries: list[_StepMessages]) -> list[_StepMessages]:
+        """Returns the entries that may be compacted, oldest first."""
+        recent = entries[-self.keep_last_steps :] if self.keep_last_steps > 0 else []
+        return [
+            entry
+            for entry in entries
+            if not isinstance(entry.step, TaskStep) and all(entry is not other for other in recent)
+        ]
+
+    @staticmethod
+    def _update_tokens(entry: _StepMessages, token_counter: Callable[[list[Message]], int]):
+        entry.tokens = token_counter(entry.messages)
+
+
+class SlidingWindowPolicy(MemoryPolicy):
+    """Drops the oldest steps until the memory fits the token budget."""
+
+    def compact(self, entries, budget, compaction, token_counter):
+        tokens = sum(entry.tokens for entry in entries)
+        dropped = set()
+        for entry in self._compactable(entries):
+            if tokens <= budget:
+                break
+            tokens -= entry.tokens
+            dropped.add(entry.index)
+            compaction.dropped_steps.append(entry.index)
+        return [entry for entry in entries if entry.index not in dropped]
+
+
+class KeepErrorsPolicy(MemoryPolicy):
+    """Reduces the oldest steps to their errors until the memory fits the token budget.
+
+    Errors tell the model which approaches already failed, so they are kept longer than model outputs and
+    observations, while the observations of the most recent steps are kept as is.
+    """
+
+    def compact(self, entries, budget, compaction, token_counter):
+        tokens = sum(entry.tokens for entry in entries)
+        for entry in self._compactable(entries):
+            if tokens <= budget:
+                break
+            tokens -= entry.tokens
+            error = getattr(entry.step, "error", None)
+            if error is not None:
+                entry.messages = [
+                    Message(role=MessageRole.TOOL_RESPONSE, content=[{"type": "text", "text": f"Error:\n{error}"}])
+                ]
+                self._update_tokens(entry, token_counter)
+                tokens += entry.tokens
+            else:
+                entry.messages = []
+                entry.tokens = 0
+            compaction.dropped_steps.append(entry.index)
+        return [entry for entry in entries if entry.messages]
+
+
+class DropImagesPolicy(MemoryPolicy):
+    """Removes images from the oldest steps until the memory fits the token budget."""
+
+    def compact(self, entries, budget, compaction, token_counter):
+        tokens = sum(entry.tokens for entry in entries)
+        for entry in self._compactable(entries):
+            if tokens <= budget:
+                break
+            messages = []
+            for message in entry.messages:
+                if isinstance(message["content"], list):
+                    content = [item for item in message["content"] if item["type"] != "image"]
+                    compaction.dropped_images += len(message["content"]) - len(content)
+                    if not content:
+                        continue
+                    message = Message(role=message["role"], content=content)
+                messages.append(message)
+            tokens -= entry.tokens
+            entry.messages = messages
+            self._update_tokens(entry, token_counter)
+            tokens += entry.tokens
+        return entries
+
+
+class SummarizePolicy(MemoryPolicy):
+    """Replaces the oldest steps with a summary written by a model, ideally a cheap one.
+
+    The last summary is cached, and extended rather than rewritten when more steps need to be summarized.
+
+    Args:
+        model ([`Model`]): Model writing the summaries.
+        max_summary_tokens (`int`, default `1000`): Number of tokens reserved for the summary in the budget.
+        **kwargs: Arguments of [`MemoryPolicy`].
+    """
+
+    summary_prompt = (
+        "Summarize the following steps of an agent solving a task. Keep the facts it learned, the actions that "
+        "failed and why, and any values needed to continue. Be concise."
+    )
+
+    def __init__(self, model, max_summary_tokens: int = 1000, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.max_summary_tokens = max_summary_tokens
+        self._summarized_steps: list[MemoryStep] = []
+        self._summary: str | None = None
+
+    def compact(self, entries, budget, compaction, token_counter):
+        tokens = sum(entry.tokens for entry in entries) + self.max_summary_tokens
+        to_summarize = []
+        for entry in self._compactable(entries):
+            if tokens <= budget:
+                break
+            tokens -= entry.tokens
+            to_summarize.append(entry)
+        if not to_summarize:
+            return entries
+        summary_entry = to_summarize[0]
+        summary_entry.messages = [
+            Message(
+                role=MessageRole.USER,
+                content=[{"type": "text", "text": f"Summary of previous steps:\n{self._summarize(to_summarize)}"}],
+            )
+        ]
+        self._update_tokens(summary_entry, token_counter)
+        compaction.summarized_steps.extend(entry.index for entry in to_summarize)
+        summarized = {entry.index for entry in to_summarize[1:]}
+        return [entry for entry in entries if entry.index not in summarized]
+
+    def _summarize(self, entries: list[_StepMessages]) -> str:
+        steps = [entry.step for entry in entries]
+        cached_steps = self._summarized_steps
+        if len(cached_steps) <= len(steps) and all(a is b for a, b in zip(cached_steps, steps)):
+            if len(cached_steps) == len(steps):
+                return self._summary
+            # Extend the cached summary with the steps summarized since
+            previous_summary = f"Summary of previous steps:\n{self._summary}\n" if cached_steps else ""
+            entries = entries[len(cached_steps) :]
+        else:
+            previous_summary = ""
+        steps_text = "\n".join(
+            item["text"]
+            for entry in entries
+            for message in entry.messages
+            for item in (
+                message["content"]
+                if isinstance(message["content"], list)
+                else [{"type": "text", "text": message["content"]}]
+            )
+            if item["type"] == "text"
+        )
+        chat_message = self.model.generate(
+            [
+                Message(role=MessageRole.SYSTEM, content=[{"type": "text", "text": self.summary_prompt}]),
+                Message(role=MessageRole.USER, content=[{"type": "text", "text": previous_summary + steps_text}]),
+            ]
+        )
+        self._summarized_steps = steps
+        self._summary = chat_message.content or ""
+        return self._summary
+
+
+class CompositeMemoryPolicy(MemoryPolicy):
+    """Applies several policies in order, until the memory fits the token budget.
+
+    For instance, `CompositeMemoryPolicy([DropImagesPolicy(), SlidingWindowPolicy()], max_tokens=50_000)` drops
+    images first, then the oldest steps if that was not enough.
+
+    Args:
+        policies (`list[MemoryPolicy]`): Policies to apply, counting tokens with the token counter of the composite
+            policy. They are copied, so that the state of stateful policies is not shared.
+        **kwargs: Arguments of [`MemoryPolicy`].
+    """
+
+    def __init__(self, policies: list[MemoryPolicy], **kwargs):
+        super().__init__(**kwargs)
+        self.policies = [copy.copy(policy) for policy in policies]
+
+    def compact(self, entries, budget, compaction, token_counter):
+        for policy in self.policies:
+            if sum(entry.tokens for entry in entries) <= budget:
+                break
+            # Entries are counted with the same counter throughout
+            entries = policy.compact(entries, budget, compaction, token_counter)
+        return entries
+
+
+class CallbackEvent(str, Enum):
+    """Points of the agent loop at which the callbacks of a [`CallbackRegistry`] are dispatched."""
+
+    STEP_START = "step_start"
+    MODEL_OUTPUT = "model_output"
+    TOOL_RESULT = "tool_result"
+    STEP_END = "step_end"
+
+
+@dataclass
+class _RegisteredCallback:
+    function: Callable
+    step_type: type[MemoryStep]
+    run_async: bool
+    # Keyword arguments accepted by the callback, None if it accepts any
+    accepted_kwargs: frozenset[str] | None
+
+
+def _get_accepted_kwargs(callback: Callable) -> frozenset[str] | None:
+    try:
+        parameters = list(inspect.signature(callback).parameters.values())
+    except (TypeError, ValueError):
+        return frozenset()
+    if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters):
+        return None
+    # The first parameter receives the memory step
+    return frozenset(
+        parameter.name
+        for parameter in parameters[1:]
+        if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)
+    )
+
+
+def _run_async_callback(callback: Callable, memory_step: MemoryStep, kwargs: dict[str, Any]):
+    # Nobody awaits the result of an asynchronous callback: log its errors instead of swallowing them
+    try:
+        callback(memory_step, **kwargs)
+    except Exception:
+        logger.exception("Asynchronous step callback failed")
+
+
+class CallbackRegistry:
+    """Registry of the callbacks that an agent dispatches while it runs.
+
+    Each callback is registered for a [`CallbackEvent`] and a memory step type. Its signature is inspected once, at
+    registration: the callback is then called with the memory step as first argument, plus the keyword arguments of
+    the event that it accepts (`agent` for all events, and `tool_call` and `tool_output` for
+    `CallbackEvent.TOOL_RESULT`).
+
+    Callbacks registered with `run_async=True` run on a background thread, so that slow work such as saving
+    screenshots or exporting telemetry does not block the agent loop. They should not modify the memory step.
+
+    Args:
+        max_async_workers (`int`, default `1`): Number of threads running asynchronous callbacks. With a single
+            thread, asynchronous callbacks run in the order their events were dispatched.
+    """
+
+    def __init__(self, max_async_workers: int = 1):
+        self.max_async_workers = max_async_workers
+        self._callbacks: dict[CallbackEvent, list[_RegisteredCallback]] = {event: [] for event in CallbackEvent}
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: list[Future] = []
+
+    def register(
+        self,
+        callback: Callable,
+        event: CallbackEvent | str = CallbackEvent.STEP_END,
+        step_type: type[MemoryStep] = MemoryStep,
+        run_async: bool = False,
+    ):
+        """Registers a callback.
+
+        Args:
+            callback (`Callable`): Function taking the memory step as first argument.
+            event (`CallbackEvent` or `str`, default `CallbackEvent.STEP_END`): Event triggering the callback.
+            step_type (`type[MemoryStep]`, default `MemoryStep`): Only memory steps of this type trigger the callback.
+            run_async (`bool`, default `False`): Whether to run the callback on a background thread.
+        """
+        self._callbacks[CallbackEvent(event)].append(
+            _RegisteredCallback(
+                function=callback,
+                step_type=step_type,
+                run_async=run_async,
+                accepted_kwargs=_get_accepted_kwargs(callback),
+            )
+        )
+
+    def append(self, callback: Callable):
+        """Registers a callback for the end of each action step, like items of a `step_callbacks` list."""
+        self.register(callback, CallbackEvent.STEP_END, ActionStep)
+
+    def __len__(self) -> int:
+        return sum(len(callbacks) for callbacks in self._callbacks.values())
+
+    def copy(self) -> "CallbackRegistry":
+        """Returns a new registry with the same callbacks, that callbacks can be registered to independently."""
+        registry = CallbackRegistry(max_async_workers=self.max_async_workers)
+        registry._callbacks = {event: list(callbacks) for event, callbacks in self._callbacks.items()}
+        return registry
+
+    def dispatch(self, event: CallbackEvent, memory_step: MemoryStep, **kwargs):
+        """Calls the callbacks registered for this event and the type of the memory step."""
+        if not self._callbacks[event]:
+            return
+        with profile_phase("callbacks", event=event.value):
+            for registered in self._callbacks[event]:
+                if not isinstance(memory_step, registered.step_type):
+                    continue
+                if registered.accepted_kwargs is not None:
+                    call_kwargs = {key: value for key, value in kwargs.items() if key in registered.accepted_kwargs}
+                else:
+                    call_kwargs = kwargs
+                if registered.run_async:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(
+                            self.max_async_workers, thread_name_prefix="smolagents-callback"
+                        )
+                    self._pending = [future for future in self._pending if not future.done()]
+                    self._pending.append(
+                        self._executor.submit(_run_async_callback, registered.function, memory_step, call_kwargs)
+                    )
+                else:
+                    registered.function(memory_step, **call_kwargs)
+
+    def wait(self):
+        """Blocks until the asynchronous callbacks dispatched so far have run."""
+        pending, self._pending = self._pending, []
+        wait(pending)
+
+
+__all__ = [
+    "AgentMemory",
+    "CallbackEvent",
+    "CallbackRegistry",
+    "CompositeMemoryPolicy",
+    "DropImagesPolicy",
+    "KeepErrorsPolicy",
+    "MemoryCompaction",
+    "MemoryPolicy",
+    "SlidingWindowPolicy",
+    "SummarizePolicy",
+]
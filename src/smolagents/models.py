@@ -11,25 +11,48 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import hashlib
 import json
 import logging
 import os
+import queue
+import random
 import re
+import sqlite3
+import threading
+import time
 import uuid
 import warnings
-from collections.abc import Generator
+from collections import OrderedDict, deque
+from collections.abc import Callable, Generator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from enum import Enum
+from functools import partial
+from pathlib import Path
 from threading import Thread
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Literal
 
-from .monitoring import TokenUsage
+from .monitoring import TokenUsage, _percentile, profile_phase
 from .tools import Tool
-from .utils import _is_package_available, encode_image_base64, make_image_url, parse_json_blob
+from .utils import (
+    AgentExecutionError,
+    AgentParsingError,
+    IncrementalJSONParser,
+    JSONStreamDecodeError,
+    _is_package_available,
+    encode_image_base64,
+    make_image_url,
+    parse_json_blob,
+)
 
 
 if TYPE_CHECKING:
+    import torch
     from transformers import StoppingCriteriaList
 
 
@@ -149,6 +172,80 @@ class ToolCallStreamDelta:
     function: dict[str, Any] | None = None
 
 
+class ToolCallStreamAccumulator:
+    """Reassembles the tool calls of a streamed model output from their deltas.
+
+    Streaming models send each tool call as [`ToolCallStreamDelta`]s: the first one gives its index, id and function
+    name, the next ones fragments of its arguments. Fragments are parsed as they arrive with an
+    [`IncrementalJSONParser`], so that invalid arguments are detected while the model is still generating and
+    complete arguments are never parsed again. Complete [`ChatMessageToolCall`]s are accepted as well.
+    """
+
+    def __init__(self):
+        self._tool_calls: dict[int | str, ChatMessageToolCall] = {}
+        self._argument_fragments: dict[int | str, list[str]] = {}
+        self._parsers: dict[int | str, IncrementalJSONParser] = {}
+        self.errors: dict[int | str, JSONStreamDecodeError] = {}
+
+    def add(self, tool_call_deltas: list[ToolCallStreamDelta | ChatMessageToolCall]):
+        for delta in tool_call_deltas:
+            if isinstance(delta, ChatMessageToolCall):
+                self._tool_calls[delta.id] = delta
+                continue
+            key = delta.index if delta.index is not None else 0
+            tool_call = self._tool_calls.get(key)
+            if tool_call is None:
+                tool_call = self._tool_calls[key] = ChatMessageToolCall(
+                    function=ChatMessageToolCallDefinition(name="", arguments=None), id=delta.id, type="function"
+                )
+                self._argument_fragments[key] = []
+                self._parsers[key] = IncrementalJSONParser(strict=False)
+            if delta.id:
+                tool_call.id = delta.id
+            if delta.type:
+                tool_call.type = delta.type
+            if delta.function is None:
+                continue
+            if delta.function.name:
+                tool_call.function.name = delta.function.name
+            arguments = delta.function.arguments
+            if isinstance(arguments, str):
+                self._feed_arguments(key, arguments)
+            elif arguments is not None:
+                tool_call.function.arguments = arguments
+
+    def _feed_arguments(self, key: int | str, fragment: str):
+        self._argument_fragments[key].append(fragment)
+        if key in self.errors:
+            return
+        try:
+            self._parsers[key].feed(fragment)
+        except JSONStreamDecodeError as e:
+            self.errors[key] = e
+
+    def get_tool_calls(self) -> list[ChatMessageToolCall]:
+        """Returns the tool calls received so far, with their arguments parsed if they are complete and valid."""
+        tool_calls = []
+        for key, tool_call in self._tool_calls.items():
+            arguments = tool_call.function.arguments
+            if self._argument_fragments.get(key):
+                parser = self._parsers[key]
+                # Invalid or incomplete arguments are kept as text, to show the model what it generated
+                arguments = (
+                    parser.value
+                    if parser.is_complete and key not in self.errors
+                    else "".join(self._argument_fragments[key])
+                )
+            tool_calls.append(
+                ChatMessageToolCall(
+                    function=ChatMessageToolCallDefinition(name=tool_call.function.name, arguments=arguments),
+                    id=tool_call.id,
+                    type=tool_call.type,
+                )
+            )
+        return tool_calls
+
+
 class MessageRole(str, Enum):
     USER = "user"
     ASSISTANT = "assistant"
@@ -189,11 +286,80 @@ def get_tool_json_schema(tool: Tool) -> dict:
     }
 
 
+def _find_subsequence(sequence: str | list[int], subsequence: str | list[int]) -> int:
+    if isinstance(sequence, str):
+        return sequence.find(subsequence)
+    length = len(subsequence)
+    for index in range(len(sequence) - length + 1):
+        if sequence[index : index + length] == subsequence:
+            return index
+    return -1
+
+
+class StopSequenceMatcher:
+    """Finds the first stop sequence in a stream of text or token ids, in time linear in the length of the stream.
+
+    Chunks are fed as they are generated: the matcher returns the part of each chunk that is certain to come before
+    any stop sequence, and holds back the end of the stream as long as it could be the start of a stop sequence. Only
+    this tail, shorter than the longest stop sequence, is kept in memory. Create one matcher per generation.
+
+    Args:
+        stop_sequences (`list[str]` or `list[list[int]]`): Stop strings, or stop sequences of token ids.
+
+    Example:
+    ```python
+    >>> matcher = StopSequenceMatcher(["<end_code>"])
+    >>> matcher.feed("print(1)<end")
+    'print(1)'
+    >>> matcher.feed("_code> and more")
+    ''
+    >>> matcher.stopped
+    True
+    ```
+    """
+
+    def __init__(self, stop_sequences: list[str] | list[list[int]]):
+        self.stop_sequences = [stop_sequence for stop_sequence in stop_sequences if len(stop_sequence) > 0]
+        self.is_text = all(isinstance(stop_sequence, str) for stop_sequence in self.stop_sequences)
+        if not self.is_text:
+            self.stop_sequences = [list(stop_sequence) for stop_sequence in self.stop_sequences]
+        self.max_length = max((len(stop_sequence) for stop_sequence in self.stop_sequences), default=0)
+        self.stopped = False
+        self._tail = "" if self.is_text else []
+
+    def feed(self, chunk: str | list[int]) -> str | list[int]:
+        """Adds a chunk to the stream, and returns the new part of the stream that comes before any stop sequence."""
+        if not self.is_text:
+            chunk = list(chunk)
+        if self.stopped:
+            return chunk[:0]
+        buffer = self._tail + chunk
+        stop_indices = [_find_subsequence(buffer, stop_sequence) for stop_sequence in self.stop_sequences]
+        stop_indices = [index for index in stop_indices if index != -1]
+        if stop_indices:
+            self.stopped = True
+            self._tail = buffer[:0]
+            return buffer[: min(stop_indices)]
+        # Hold back the longest end of the buffer that starts a stop sequence
+        held_length = 0
+        for length in range(min(len(buffer), self.max_length - 1), 0, -1):
+            if any(stop_sequence[:length] == buffer[-length:] for stop_sequence in self.stop_sequences):
+                held_length = length
+                break
+        self._tail = buffer[len(buffer) - held_length :]
+        return buffer[: len(buffer) - held_length]
+
+    def flush(self) -> str | list[int]:
+        """Ends the stream, returning the end that was held back as a possible start of a stop sequence."""
+        tail, self._tail = self._tail, self._tail[:0]
+        return tail
+
+
 def remove_stop_sequences(content: str, stop_sequences: list[str]) -> str:
-    for stop_seq in stop_sequences:
-        if content[-len(stop_seq) :] == stop_seq:
-            content = content[: -len(stop_seq)]
-    return content
+    """Truncates the content at its first stop sequence."""
+    matcher = StopSequenceMatcher(stop_sequences)
+    content = matcher.feed(content)
+    return content if matcher.stopped else content + matcher.flush()
 
 
 def get_clean_message_list(
@@ -212,6 +378,18 @@ def get_clean_message_list(
         convert_images_to_image_urls (`bool`, default `False`): Whether to convert images to image URLs.
         flatten_messages_as_text (`bool`, default `False`): Whether to flatten messages as text.
     """
+    with profile_phase("prompt_assembly"):
+        return _get_clean_message_list(
+            message_list, role_conversions, convert_images_to_image_urls, flatten_messages_as_text
+        )
+
+
+def _get_clean_message_list(
+    message_list: list[dict[str, str | list[dict]]],
+    role_conversions: dict[MessageRole, MessageRole] | dict[str, str],
+    convert_images_to_image_urls: bool,
+    flatten_messages_as_text: bool,
+) -> list[dict[str, str | list[dict]]]:
     output_message_list: list[dict[str, str | list[dict]]] = []
     message_list = deepcopy(message_list)  # Avoid modifying the original list
     for message in message_list:
@@ -259,6 +437,12 @@ def get_clean_message_list(
 
 def get_tool_call_from_text(text: str, tool_name_key: str, tool_arguments_key: str) -> ChatMessageToolCall:
     tool_call_dictionary, _ = parse_json_blob(text)
+    return _get_tool_call_from_dictionary(tool_call_dictionary, tool_name_key, tool_arguments_key)
+
+
+def _get_tool_call_from_dictionary(
+    tool_call_dictionary: dict, tool_name_key: str, tool_arguments_key: str
+) -> ChatMessageToolCall:
     try:
         tool_name = tool_call_dictionary[tool_name_key]
     except Exception as e:
@@ -275,6 +459,182 @@ def get_tool_call_from_text(text: str, tool_name_key: str, tool_arguments_key: s
     )
 
 
+class StreamingToolCallParser:
+    """Parses a tool call written as a JSON blob in a streamed model output, as [`get_tool_call_from_text`] does
+    with the complete output.
+
+    The text before the first `{` is skipped, and the blob is parsed as chunks arrive with an
+    [`IncrementalJSONParser`]. `tool_name` is known as soon as its value is complete, so that the tool can be
+    prepared while the model is still generating its arguments.
+
+    Args:
+        tool_name_key (`str`, default `"name"`): Key of the tool name in the JSON blob.
+        tool_arguments_key (`str`, default `"arguments"`): Key of the tool arguments in the JSON blob.
+    """
+
+    def __init__(self, tool_name_key: str = "name", tool_arguments_key: str = "arguments"):
+        self.tool_name_key = tool_name_key
+        self.tool_arguments_key = tool_arguments_key
+        self.parser = IncrementalJSONParser(strict=False, stop_at_end=True)
+        self.error: JSONStreamDecodeError | None = None
+        self._blob_started = False
+
+    def feed(self, chunk: str) -> bool:
+        """Parses a chunk of the model output, and returns whether the JSON blob is complete."""
+        if self.error is not None or self.parser.is_complete:
+            return self.parser.is_complete
+        if not self._blob_started:
+            first_accolade_index = chunk.find("{")
+            if first_accolade_index == -1:
+                return False
+            chunk = chunk[first_accolade_index:]
+            self._blob_started = True
+        try:
+            return self.parser.feed(chunk)
+        except JSONStreamDecodeError as e:
+            self.error = e
+            return False
+
+    @property
+    def tool_name(self) -> str | None:
+        """The name of the called tool, once it has been completely generated."""
+        value = self.parser.value
+        # Strings are only added to their container once complete, so a name is never a prefix of the actual one
+        tool_name = value.get(self.tool_name_key) if isinstance(value, dict) else None
+        return tool_name if isinstance(tool_name, str) else None
+
+    def get_tool_call(self) -> ChatMessageToolCall:
+        """Returns the parsed tool call, raising a `ValueError` if the JSON blob is missing, invalid or incomplete."""
+        if self.error is not None:
+            raise ValueError(f"The JSON blob you used is invalid due to the following error: {self.error}.")
+        if not self._blob_started:
+            raise ValueError("The model output does not contain any JSON blob.")
+        try:
+            tool_call_dictionary = self.parser.close()
+        except JSONStreamDecodeError as e:
+            raise ValueError(f"The JSON blob you used is invalid due to the following error: {e}.")
+        return _get_tool_call_from_dictionary(tool_call_dictionary, self.tool_name_key, self.tool_arguments_key)
+
+
+# Typical number of tokens of an image for the vision models of API providers
+IMAGE_TOKENS_ESTIMATE = 765
+
+
+class TokenCounter:
+    """Counts the tokens of messages locally, to estimate the size of a model input before sending it.
+
+    Subclasses implement `count_text`. Instances are callables counting the tokens of a list of messages.
+
+    Args:
+        tokens_per_message (`int`, default `4`): Tokens added by the chat template for each message.
+        tokens_per_image (`int`, default `765`): Tokens counted for each image.
+    """
+
+    def __init__(self, tokens_per_message: int = 4, tokens_per_image: int = IMAGE_TOKENS_ESTIMATE):
+        self.tokens_per_message = tokens_per_message
+        self.tokens_per_image = tokens_per_image
+
+    def count_text(self, text: str) -> int:
+        raise NotImplementedError("This method must be implemented in child classes")
+
+    def count_messages(self, messages: list[dict[str, str | list[dict]] | ChatMessage]) -> int:
+        """Counts the tokens of messages, including the tokens of their images and the chat template overhead."""
+        tokens = 0
+        for message in messages:
+            if isinstance(message, ChatMessage):
+                message = message.dict()
+            tokens += self.tokens_per_message
+            content = message["content"]
+            if isinstance(content, str):
+                tokens += self.count_text(content)
+                continue
+            for element in content or []:
+                if element["type"] == "text":
+                    tokens += self.count_text(element["text"])
+                elif element["type"] in ("image", "image_url"):
+                    tokens += self.tokens_per_image
+        return tokens
+
+    def __call__(self, messages: list[dict[str, str | list[dict]] | ChatMessage]) -> int:
+        return self.count_messages(messages)
+
+
+class HeuristicTokenCounter(TokenCounter):
+    """Estimates token counts from the number of characters, without any tokenizer.
+
+    Args:
+        chars_per_token (`float`, default `4.0`): Average number of characters per token.
+        **kwargs: Arguments of [`TokenCounter`].
+    """
+
+    def __init__(self, chars_per_token: float = 4.0, **kwargs):
+        super().__init__(**kwargs)
+        self.chars_per_token = chars_per_token
+
+    def count_text(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token)
+
+
+class TiktokenTokenCounter(TokenCounter):
+    """Counts tokens with a [tiktoken](https://github.com/openai/tiktoken) encoding, as used by OpenAI models.
+
+    Args:
+        model_id (`str`, *optional*): Model whose encoding to use.
+        encoding_name (`str`, default `"o200k_base"`): Encoding used if `model_id` is not given or not known.
+        **kwargs: Arguments of [`TokenCounter`].
+    """
+
+    def __init__(self, model_id: str | None = None, encoding_name: str = "o200k_base", **kwargs):
+        try:
+            import tiktoken
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError("Please install 'tiktoken' to use TiktokenTokenCounter: `pip install tiktoken`")
+        super().__init__(**kwargs)
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_id) if model_id else tiktoken.get_encoding(encoding_name)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count_text(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+class TokenizerTokenCounter(TokenCounter):
+    """Counts tokens exactly with the tokenizer of a local model, applying its chat template when it has one.
+
+    Args:
+        tokenizer (`PreTrainedTokenizerBase`): Tokenizer of the model.
+        **kwargs: Arguments of [`TokenCounter`].
+    """
+
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(**kwargs)
+        self.tokenizer = tokenizer
+
+    def count_text(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count_messages(self, messages: list[dict[str, str | list[dict]] | ChatMessage]) -> int:
+        if getattr(self.tokenizer, "chat_template", None) is None:
+            return super().count_messages(messages)
+        # Images are not part of the text given to the tokenizer: count them separately
+        text_messages, n_images = [], 0
+        for message in messages:
+            if isinstance(message, ChatMessage):
+                message = message.dict()
+            role = tool_role_conversions.get(message["role"], message["role"])
+            content = message["content"]
+            if not isinstance(content, str):
+                n_images += sum(1 for element in content or [] if element["type"] in ("image", "image_url"))
+                content = "\n".join(element["text"] for element in content or [] if element["type"] == "text")
+            if text_messages and text_messages[-1]["role"] == role:
+                text_messages[-1]["content"] += "\n" + content
+            else:
+                text_messages.append({"role": role, "content": content})
+        token_ids = self.tokenizer.apply_chat_template(text_messages, add_generation_prompt=True, tokenize=True)
+        return len(token_ids) + n_images * self.tokens_per_image
+
+
 def supports_stop_parameter(model_id: str) -> bool:
     """
     Check if the model supports the `stop` parameter.
@@ -300,6 +660,7 @@ class Model:
         tool_name_key: str = "name",
         tool_arguments_key: str = "arguments",
         model_id: str | None = None,
+        token_counter: TokenCounter | None = None,
         **kwargs,
     ):
         self.flatten_messages_as_text = flatten_messages_as_text
@@ -309,6 +670,43 @@ class Model:
         self._last_input_token_count: int | None = None
         self._last_output_token_count: int | None = None
         self.model_id: str | None = model_id
+        self._token_counter = token_counter
+
+    @property
+    def token_counter(self) -> TokenCounter:
+        """[`TokenCounter`] estimating the size of inputs of this model before sending them."""
+        if getattr(self, "_token_counter", None) is None:
+            self._token_counter = self.create_token_counter()
+        return self._token_counter
+
+    @token_counter.setter
+    def token_counter(self, value: TokenCounter):
+        self._token_counter = value
+
+    def create_token_counter(self) -> TokenCounter:
+        """Creates the default token counter of the model: a character-based estimate, unless overridden."""
+        return HeuristicTokenCounter()
+
+    def count_tokens(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        tools_to_call_from: list[Tool] | None = None,
+    ) -> int:
+        """Estimates the number of input tokens of a model call, without calling the model.
+
+        Parameters:
+            messages (`list[dict[str, str | list[dict]]] | list[ChatMessage]`): Messages to send to the model.
+            tools_to_call_from (`list[Tool]`, *optional*): Tools whose JSON schemas are sent with the messages.
+
+        Returns:
+            `int`: Estimated number of input tokens.
+        """
+        tokens = self.token_counter.count_messages(messages)
+        if tools_to_call_from:
+            tokens += self.token_counter.count_text(
+                json.dumps([get_tool_json_schema(tool) for tool in tools_to_call_from])
+            )
+        return tokens
 
     @property
     def last_input_token_count(self) -> int | None:
@@ -410,6 +808,45 @@ class Model:
         """
         raise NotImplementedError("This method must be implemented in child classes")
 
+    def generate_batch(
+        self,
+        messages_batch: list[list[dict[str, str | list[dict]] | ChatMessage]],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> list[ChatMessage]:
+        """Returns the model's responses to several independent conversations.
+
+        This default implementation calls `generate` for each conversation in turn: models able to process several
+        prompts at once override it with a single batched call.
+
+        Parameters:
+            messages_batch (`list[list[dict[str, str | list[dict]]] | list[ChatMessage]]`):
+                The conversations to respond to, each one a list of messages as taken by `generate`.
+            stop_sequences (`List[str]`, *optional*):
+                A list of strings that will stop the generation if encountered in the model's output.
+            response_format (`dict[str, str]`, *optional*):
+                The response format to use in the model's responses.
+            tools_to_call_from (`List[Tool]`, *optional*):
+                A list of tools that the model can use to generate responses.
+            **kwargs:
+                Additional keyword arguments to be passed to the underlying model.
+
+        Returns:
+            `list[ChatMessage]`: The responses, in the order of the conversations, each with its own token usage.
+        """
+        return [
+            self.generate(
+                messages,
+                stop_sequences=stop_sequences,
+                response_format=response_format,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            )
+            for messages in messages_batch
+        ]
+
     def __call__(self, *args, **kwargs):
         return self.generate(*args, **kwargs)
 
@@ -494,6 +931,9 @@ class VLLMModel(Model):
         self.tokenizer = get_tokenizer(model_id)
         self._is_vlm = False  # VLLMModel does not support vision models yet.
 
+    def create_token_counter(self) -> TokenCounter:
+        return TokenizerTokenCounter(self.tokenizer)
+
     def cleanup(self):
         import gc
 
@@ -519,29 +959,48 @@ class VLLMModel(Model):
         tools_to_call_from: list[Tool] | None = None,
         **kwargs,
     ) -> ChatMessage:
-        from vllm import SamplingParams  # type: ignore
-
-        completion_kwargs = self._prepare_completion_kwargs(
-            messages=messages,
-            flatten_messages_as_text=(not self._is_vlm),
+        return self.generate_batch(
+            [messages],
             stop_sequences=stop_sequences,
+            response_format=response_format,
             tools_to_call_from=tools_to_call_from,
             **kwargs,
-        )
-        # Override the OpenAI schema for VLLM compatibility
-        guided_options_request = {"guided_json": response_format["json_schema"]["schema"]} if response_format else None
+        )[0]
 
-        messages = completion_kwargs.pop("messages")
-        prepared_stop_sequences = completion_kwargs.pop("stop", [])
-        tools = completion_kwargs.pop("tools", None)
-        completion_kwargs.pop("tool_choice", None)
+    def generate_batch(
+        self,
+        messages_batch: list[list[dict[str, str | list[dict]] | ChatMessage]],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> list[ChatMessage]:
+        from vllm import SamplingParams  # type: ignore
 
-        prompt = self.tokenizer.apply_chat_template(
-            messages,
-            tools=tools,
-            add_generation_prompt=True,
-            tokenize=False,
-        )
+        prompts, completion_kwargs_batch = [], []
+        for messages in messages_batch:
+            completion_kwargs = self._prepare_completion_kwargs(
+                messages=messages,
+                flatten_messages_as_text=(not self._is_vlm),
+                stop_sequences=stop_sequences,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            )
+            messages = completion_kwargs.pop("messages")
+            prepared_stop_sequences = completion_kwargs.pop("stop", [])
+            tools = completion_kwargs.pop("tools", None)
+            completion_kwargs.pop("tool_choice", None)
+            prompts.append(
+                self.tokenizer.apply_chat_template(
+                    messages,
+                    tools=tools,
+                    add_generation_prompt=True,
+                    tokenize=False,
+                )
+            )
+            completion_kwargs_batch.append(completion_kwargs)
+        # Override the OpenAI schema for VLLM compatibility
+        guided_options_request = {"guided_json": response_format["json_schema"]["schema"]} if response_format else None
 
         sampling_params = SamplingParams(
             n=kwargs.get("n", 1),
@@ -550,24 +1009,30 @@ class VLLMModel(Model):
             stop=prepared_stop_sequences,
         )
 
-        out = self.model.generate(
-            prompt,
+        # vLLM schedules all the prompts together, with continuous batching
+        outputs = self.model.generate(
+            prompts,
             sampling_params=sampling_params,
             guided_options_request=guided_options_request,
         )
 
-        output_text = out[0].outputs[0].text
-        self._last_input_token_count = len(out[0].prompt_token_ids)
-        self._last_output_token_count = len(out[0].outputs[0].token_ids)
-        return ChatMessage(
-            role=MessageRole.ASSISTANT,
-            content=output_text,
-            raw={"out": output_text, "completion_kwargs": completion_kwargs},
-            token_usage=TokenUsage(
-                input_tokens=len(out[0].prompt_token_ids),
-                output_tokens=len(out[0].outputs[0].token_ids),
-            ),
-        )
+        chat_messages = []
+        for out, completion_kwargs in zip(outputs, completion_kwargs_batch):
+            output_text = out.outputs[0].text
+            chat_messages.append(
+                ChatMessage(
+                    role=MessageRole.ASSISTANT,
+                    content=output_text,
+                    raw={"out": output_text, "completion_kwargs": completion_kwargs},
+                    token_usage=TokenUsage(
+                        input_tokens=len(out.prompt_token_ids),
+                        output_tokens=len(out.outputs[0].token_ids),
+                    ),
+                )
+            )
+        self._last_input_token_count = sum(message.token_usage.input_tokens for message in chat_messages)
+        self._last_output_token_count = sum(message.token_usage.output_tokens for message in chat_messages)
+        return chat_messages
 
 
 class MLXModel(Model):
@@ -662,12 +1127,13 @@ class MLXModel(Model):
 
         output_tokens = 0
         text = ""
+        stop_matcher = StopSequenceMatcher(stops)
         for response in self.stream_generate(self.model, self.tokenizer, prompt=prompt_ids, **completion_kwargs):
             output_tokens += 1
-            text += response.text
-            if any((stop_index := text.rfind(stop)) != -1 for stop in stops):
-                text = text[:stop_index]
+            text += stop_matcher.feed(response.text)
+            if stop_matcher.stopped:
                 break
+        text += stop_matcher.flush()
 
         self._last_input_token_count = len(prompt_ids)
         self._last_output_token_count = output_tokens
@@ -682,6 +1148,190 @@ class MLXModel(Model):
         )
 
 
+class _PrefixKVCache:
+    """Least recently used store of the key-value caches of previous generations, one per conversation.
+
+    Agent conversations are append-only, so the prompt of a step starts with the prompt and output of the previous
+    one: the longest common token prefix of the stored cache is reused, and only the rest of the prompt is prefilled.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+        self._entries: OrderedDict[str, tuple[list[int], Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cached_tokens(self) -> int:
+        with self._lock:
+            return sum(len(token_ids) for token_ids, _ in self._entries.values())
+
+    def take(self, key: str, input_ids: list[int]) -> tuple[Any | None, int]:
+        """Removes the cache of a conversation and crops it to its common prefix with `input_ids`.
+
+        Returns the cropped cache, or `None` if nothing can be reused, and the number of reused tokens. The cache is
+        removed while in use so that concurrent calls on the same conversation never share it.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        prefix_length, past_key_values = 0, None
+        if entry is not None:
+            cached_ids, past_key_values = entry
+            # The last input token is always prefilled, as its logits give the first generated token
+            max_length = min(len(input_ids) - 1, len(cached_ids))
+            while prefix_length < max_length and cached_ids[prefix_length] == input_ids[prefix_length]:
+                prefix_length += 1
+        with self._lock:
+            self.reused_tokens += prefix_length
+            self.prefilled_tokens += len(input_ids) - prefix_length
+        if prefix_length == 0:
+            return None, 0
+        past_key_values.crop(prefix_length)
+        return past_key_values, prefix_length
+
+    def put(self, key: str, token_ids: list[int], past_key_values: Any):
+        """Stores the cache of a conversation, evicting the least recently used ones above the token budget."""
+        # Only caches that can be cropped to a prefix can be reused, which excludes e.g. sliding window caches
+        if not hasattr(past_key_values, "crop") or not hasattr(past_key_values, "get_seq_length"):
+            return
+        # The cache does not include the last generated token, which was never fed back to the model
+        token_ids = token_ids[: past_key_values.get_seq_length()]
+        if len(token_ids) > self.max_tokens:
+            return
+        with self._lock:
+            self._entries[key] = (token_ids, past_key_values)
+            total_tokens = sum(len(ids) for ids, _ in self._entries.values())
+            while total_tokens > self.max_tokens:
+                _, (evicted_ids, _) = self._entries.popitem(last=False)
+                total_tokens -= len(evicted_ids)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@dataclass
+class _GenerationRequest:
+    generation_kwargs: dict[str, Any]
+    stop_sequences: list[str] | None = None
+    conversation_key: str | None = None
+    future: Future = field(default_factory=Future)
+
+    @property
+    def batch_key(self) -> str:
+        # Only requests with the same generation arguments can run in the same batch
+        return repr(
+            sorted(
+                (key, value)
+                for key, value in self.generation_kwargs.items()
+                if key not in ("inputs", "stopping_criteria")
+            )
+        )
+
+
+class _GenerationBatcher:
+    """Queues generation requests from any number of threads, and runs them in batches on a worker thread.
+
+    A request submitted while no other request is queued or running runs right away in the calling thread. Otherwise
+    it is queued: the worker waits up to `max_wait_time` after the first queued request for others to join its batch,
+    then runs compatible requests together with `run_batch`, which must set the future of each request. Batches never
+    run concurrently, and the worker only lives while there are queued requests.
+    """
+
+    def __init__(
+        self, run_batch: Callable[[list[_GenerationRequest]], None], max_batch_size: int, max_wait_time: float
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self.batch_sizes: deque[int] = deque(maxlen=1000)
+        self._queue: queue.Queue[_GenerationRequest] = queue.Queue()
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._worker: Thread | None = None
+        self._running_directly = False
+
+    def submit(self, request: _GenerationRequest) -> Future:
+        with self._lock:
+            run_directly = self._worker is None and not self._running_directly
+            if run_directly:
+                self._running_directly = True
+            else:
+                self._queue.put(request)
+                if self._worker is None:
+                    self._worker = Thread(target=self._run, name="smolagents-generation-batcher", daemon=True)
+                    self._worker.start()
+        if run_directly:
+            # Nothing to batch with: do not make the request wait for others
+            try:
+                with self._run_lock:
+                    self._run_batches([request])
+            finally:
+                with self._lock:
+                    self._running_directly = False
+        return request.future
+
+    def _next_batch(self) -> list[_GenerationRequest]:
+        requests = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_time
+        while len(requests) < self.max_batch_size:
+            try:
+                requests.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return requests
+
+    def _run_batches(self, requests: list[_GenerationRequest]):
+        batches: dict[str, list[_GenerationRequest]] = {}
+        for request in requests:
+            batches.setdefault(request.batch_key, []).append(request)
+        for requests in batches.values():
+            self.batch_sizes.append(len(requests))
+            try:
+                self.run_batch(requests)
+            except Exception as e:
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._queue.empty():
+                    self._worker = None
+                    return
+            # Requests keep queuing while a request running directly holds the lock, to be batched together next
+            with self._run_lock:
+                self._run_batches(self._next_batch())
+
+
+def _make_stopping_criteria(stop_sequences_per_row: list[list[str] | None], tokenizer) -> "StoppingCriteriaList":
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class StopOnStrings(StoppingCriteria):
+        def __init__(self, stop_strings_per_row: list[list[str] | None], tokenizer):
+            self.stop_strings_per_row = stop_strings_per_row
+            self.tokenizer = tokenizer
+            self.reset()
+
+        def reset(self):
+            self.matchers = [StopSequenceMatcher(stop_strings or []) for stop_strings in self.stop_strings_per_row]
+
+        def __call__(self, input_ids, scores, **kwargs):
+            for row, matcher in enumerate(self.matchers):
+                if not matcher.stopped:
+                    matcher.feed(self.tokenizer.decode(input_ids[row][-1], skip_special_tokens=True))
+            if len(self.matchers) == 1:
+                return self.matchers[0].stopped
+            import torch
+
+            # Each row of a batch stops on its own
+            return torch.tensor([matcher.stopped for matcher in self.matchers], device=input_ids.device)
+
+    return StoppingCriteriaList([StopOnStrings(stop_sequences_per_row, tokenizer)])
+
+
 class TransformersModel(Model):
     """A class that uses Hugging Face's Transformers library for language model interaction.
 
@@ -700,6 +1350,17 @@ class TransformersModel(Model):
             The torch_dtype to initialize your model with.
         trust_remote_code (bool, default `False`):
             Some models on the Hub require running remote code: for this model, you would have to set this flag to True.
+        prefix_cache_max_tokens (`int`, default `32768`):
+            Maximum number of tokens of the key-value caches kept between calls, summed over conversations. Each call
+            reuses the cache of the longest token prefix it shares with the previous call of its conversation, so
+            that only the new messages are prefilled. Conversations are identified by their first two messages, and
+            the least recently used ones are evicted first. Set to 0 to disable. Not used with vision models.
+        max_batch_size (`int`, default `8`):
+            Maximum number of concurrent `generate` calls, e.g. from agents running in different threads, that are
+            padded and run together in a single batched `model.generate`. Set to 1 to run calls one by one.
+        batch_wait_time (`float`, default `0.01`):
+            Time in seconds that a call waits for others to join its batch, if it was queued behind a running call.
+            Calls made while the model is idle run right away.
         kwargs (dict, *optional*):
             Any additional keyword arguments that you want to use in model.generate(), for instance `max_new_tokens` or `device`.
         **kwargs:
@@ -728,6 +1389,9 @@ class TransformersModel(Model):
         device_map: str | None = None,
         torch_dtype: str | None = None,
         trust_remote_code: bool = False,
+        prefix_cache_max_tokens: int = 32768,
+        max_batch_size: int = 8,
+        batch_wait_time: float = 0.01,
         **kwargs,
     ):
         try:
@@ -737,7 +1401,6 @@ class TransformersModel(Model):
                 AutoModelForImageTextToText,
                 AutoProcessor,
                 AutoTokenizer,
-                TextIteratorStreamer,
             )
         except ModuleNotFoundError:
             raise ModuleNotFoundError(
@@ -774,7 +1437,6 @@ class TransformersModel(Model):
             )
             self.processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=trust_remote_code)
             self._is_vlm = True
-            self.streamer = TextIteratorStreamer(self.processor.tokenizer, skip_prompt=True, skip_special_tokens=True)  # type: ignore
 
         except ValueError as e:
             if "Unrecognized configuration class" in str(e):
@@ -785,33 +1447,97 @@ class TransformersModel(Model):
                     trust_remote_code=trust_remote_code,
                 )
                 self.tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=trust_remote_code)
-                self.streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)  # type: ignore
             else:
                 raise e
         except Exception as e:
             raise ValueError(f"Failed to load tokenizer and model for {model_id=}: {e}") from e
+        # Image inputs are not part of the token ids, so prefixes of vision models cannot be compared
+        self.prefix_cache = (
+            _PrefixKVCache(prefix_cache_max_tokens) if prefix_cache_max_tokens and not self._is_vlm else None
+        )
+        self.batcher = (
+            _GenerationBatcher(self._run_batch, max_batch_size, batch_wait_time) if max_batch_size > 1 else None
+        )
         super().__init__(flatten_messages_as_text=not self._is_vlm, model_id=model_id, **kwargs)
 
+    def create_token_counter(self) -> TokenCounter:
+        return TokenizerTokenCounter(self.processor.tokenizer if self._is_vlm else self.tokenizer)
+
     def make_stopping_criteria(self, stop_sequences: list[str], tokenizer) -> "StoppingCriteriaList":
-        from transformers import StoppingCriteria, StoppingCriteriaList
-
-        class StopOnStrings(StoppingCriteria):
-            def __init__(self, stop_strings: list[str], tokenizer):
-                self.stop_strings = stop_strings
-                self.tokenizer = tokenizer
-                self.stream = ""
-
-            def reset(self):
-                self.stream = ""
-
-            def __call__(self, input_ids, scores, **kwargs):
-                generated = self.tokenizer.decode(input_ids[0][-1], skip_special_tokens=True)
-                self.stream += generated
-                if any([self.stream.endswith(stop_string) for stop_string in self.stop_strings]):
-                    return True
-                return False
+        return _make_stopping_criteria([stop_sequences], tokenizer)
+
+    def _get_conversation_key(self, messages: list[dict[str, str | list[dict]] | ChatMessage]) -> str:
+        # The system prompt and the task identify a conversation, whose later messages are only appended
+        canonical_json = json.dumps(messages[:2], sort_keys=True, default=_canonical_json_default)
+        return hashlib.sha256(canonical_json.encode()).hexdigest()
+
+    def _reuse_prefix_cache(self, conversation_key: str, generation_kwargs: dict[str, Any]) -> int:
+        """Adds the cached prefix of the conversation to the generation arguments, returning its number of tokens."""
+        past_key_values, reused_tokens = self.prefix_cache.take(
+            conversation_key, generation_kwargs["inputs"][0].tolist()
+        )
+        # The returned cache is needed to store it for the next call
+        generation_kwargs["return_dict_in_generate"] = True
+        if past_key_values is not None:
+            # `generate` only prefills the input ids after the ones already in the cache
+            generation_kwargs["past_key_values"] = past_key_values
+        return reused_tokens
+
+    def _generate(self, conversation_key: str | None, **generation_kwargs):
+        out = self.model.generate(**generation_kwargs)
+        if conversation_key is None:
+            return out
+        self.prefix_cache.put(conversation_key, out.sequences[0].tolist(), out.past_key_values)
+        return out.sequences
+
+    def _generate_single(self, request: _GenerationRequest) -> tuple["torch.Tensor", int]:
+        """Runs a request on its own, reusing the cached prefix of its conversation. Returns the generated tokens."""
+        generation_kwargs = dict(request.generation_kwargs)
+        count_prompt_tokens = generation_kwargs["inputs"].shape[1]  # type: ignore
+        reused_tokens = 0
+        if request.conversation_key is not None:
+            reused_tokens = self._reuse_prefix_cache(request.conversation_key, generation_kwargs)
+        out = self._generate(request.conversation_key, **generation_kwargs)
+        return out[0, count_prompt_tokens:], reused_tokens
+
+    def _run_batch(self, requests: list[_GenerationRequest]):
+        """Runs requests with the same generation arguments in one batch, left-padding their prompts."""
+        if len(requests) == 1:
+            requests[0].future.set_result(self._generate_single(requests[0]))
+            return
+        import torch
 
-        return StoppingCriteriaList([StopOnStrings(stop_sequences, tokenizer)])
+        tokenizer = self.processor.tokenizer if self._is_vlm else self.tokenizer
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        prompts = [request.generation_kwargs["inputs"][0] for request in requests]
+        padded_length = max(len(prompt) for prompt in prompts)
+        input_ids = torch.full((len(prompts), padded_length), pad_token_id, dtype=prompts[0].dtype)
+        attention_mask = torch.zeros((len(prompts), padded_length), dtype=torch.long)
+        for row, prompt in enumerate(prompts):
+            # Decoder-only models generate after the last position, so prompts are padded on the left
+            input_ids[row, padded_length - len(prompt) :] = prompt
+            attention_mask[row, padded_length - len(prompt) :] = 1
+        generation_kwargs = {
+            key: value
+            for key, value in requests[0].generation_kwargs.items()
+            if key not in ("inputs", "stopping_criteria")
+        }
+        out = self.model.generate(
+            inputs=input_ids.to(self.model.device),
+            attention_mask=attention_mask.to(self.model.device),
+            pad_token_id=pad_token_id,
+            stopping_criteria=_make_stopping_criteria([request.stop_sequences for request in requests], tokenizer),
+            **generation_kwargs,
+        )
+        eos_token_id = self.model.generation_config.eos_token_id
+        end_token_ids = {pad_token_id, *(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])}
+        for row, request in enumerate(requests):
+            generated_tokens = out[row, padded_length:]
+            # Rows that finished early are padded up to the longest one
+            end_indices = [index for index, token in enumerate(generated_tokens.tolist()) if token in end_token_ids]
+            if end_indices:
+                generated_tokens = generated_tokens[: end_indices[0] + 1]
+            request.future.set_result((generated_tokens, 0))
 
     def _prepare_completion_args(
         self,
@@ -878,10 +1604,15 @@ class TransformersModel(Model):
             **kwargs,
         )
         count_prompt_tokens = generation_kwargs["inputs"].shape[1]  # type: ignore
-        out = self.model.generate(
-            **generation_kwargs,
+        request = _GenerationRequest(
+            generation_kwargs=generation_kwargs,
+            stop_sequences=stop_sequences,
+            conversation_key=self._get_conversation_key(messages) if self.prefix_cache is not None else None,
         )
-        generated_tokens = out[0, count_prompt_tokens:]
+        if self.batcher is not None:
+            generated_tokens, reused_tokens = self.batcher.submit(request).result()
+        else:
+            generated_tokens, reused_tokens = self._generate_single(request)
         if hasattr(self, "processor"):
             output_text = self.processor.decode(generated_tokens, skip_special_tokens=True)
         else:
@@ -898,6 +1629,7 @@ class TransformersModel(Model):
             raw={
                 "out": output_text,
                 "completion_kwargs": {key: value for key, value in generation_kwargs.items() if key != "inputs"},
+                "cached_input_tokens": reused_tokens,
             },
             token_usage=TokenUsage(
                 input_tokens=count_prompt_tokens,
@@ -922,13 +1654,24 @@ class TransformersModel(Model):
             tools_to_call_from=tools_to_call_from,
             **kwargs,
         )
+        from transformers import TextIteratorStreamer
+
         count_prompt_tokens = generation_kwargs["inputs"].shape[1]  # type: ignore
+        conversation_key = self._get_conversation_key(messages) if self.prefix_cache is not None else None
+        if conversation_key:
+            self._reuse_prefix_cache(conversation_key, generation_kwargs)
 
-        thread = Thread(target=self.model.generate, kwargs={"streamer": self.streamer, **generation_kwargs})
+        # One streamer per call, so that concurrent calls never read each other's tokens
+        streamer = TextIteratorStreamer(
+            self.processor.tokenizer if self._is_vlm else self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        thread = Thread(
+            target=self._generate, args=(conversation_key,), kwargs={"streamer": streamer, **generation_kwargs}
+        )
         thread.start()
 
         # Generate with streaming
-        for new_text in self.streamer:
+        for new_text in streamer:
             self._last_input_token_count = count_prompt_tokens
             self._last_output_token_count = 1
             yield ChatMessageStreamDelta(
@@ -939,6 +1682,302 @@ class TransformersModel(Model):
         thread.join()
 
 
+class RateLimiter:
+    """Shares the quota of a provider between the models, agents and threads of a process.
+
+    Requests wait for token buckets of requests and tokens per minute and for a cap on in-flight requests. Requests
+    failing with a rate limit (429), timeout or server error are retried with jittered exponential backoff, waiting
+    at least as long as the provider's `Retry-After` header asks.
+
+    Parameters:
+        requests_per_minute (`float`, *optional*): Maximum number of requests per minute.
+        tokens_per_minute (`float`, *optional*): Maximum number of tokens per minute, counting the estimated input
+            tokens and the maximum number of output tokens of each request.
+        max_concurrent_requests (`int`, *optional*): Maximum number of requests in flight.
+        max_retries (`int`, default `5`): Maximum number of retries of a failed request.
+        base_delay (`float`, default `1.0`): Delay in seconds before the first retry, doubled at each retry.
+        max_delay (`float`, default `60.0`): Maximum backoff delay in seconds between retries. A longer `Retry-After`
+            sent by the provider is still waited for.
+    """
+
+    retryable_status_codes = (408, 429, 500, 502, 503, 504, 529)
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_concurrent_requests: int | None = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.total_retries = 0
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrent_requests) if max_concurrent_requests else None
+        # Buckets start full: a minute's worth of quota can be spent at once
+        self._available_requests = requests_per_minute
+        self._available_tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        if self.requests_per_minute is not None:
+            self._available_requests = min(
+                self.requests_per_minute, self._available_requests + elapsed_minutes * self.requests_per_minute
+            )
+        if self.tokens_per_minute is not None:
+            self._available_tokens = min(
+                self.tokens_per_minute, self._available_tokens + elapsed_minutes * self.tokens_per_minute
+            )
+
+    def acquire(self, tokens: int = 0):
+        """Blocks until the buckets allow one more request of this number of tokens, then takes it from them."""
+        if self.tokens_per_minute is not None:
+            # A request larger than the bucket would wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                wait_minutes = 0.0
+                if self.requests_per_minute is not None and self._available_requests < 1:
+                    wait_minutes = (1 - self._available_requests) / self.requests_per_minute
+                if self.tokens_per_minute is not None and self._available_tokens < tokens:
+                    wait_minutes = max(wait_minutes, (tokens - self._available_tokens) / self.tokens_per_minute)
+                if wait_minutes == 0:
+                    if self.requests_per_minute is not None:
+                        self._available_requests -= 1
+                    if self.tokens_per_minute is not None:
+                        self._available_tokens -= tokens
+                    return
+            time.sleep(wait_minutes * 60)
+
+    @contextmanager
+    def concurrency_slot(self):
+        """Holds one of the in-flight request slots."""
+        if self._semaphore is None:
+            yield
+            return
+        with self._semaphore:
+            yield
+
+    def call(self, api_call: Callable[[], Any], tokens: int = 0, hold_slot: bool = True) -> Any:
+        """Calls the API once the quota allows it, retrying on rate limits and transient errors.
+
+        Parameters:
+            api_call (`Callable[[], Any]`): Function calling the provider API.
+            tokens (`int`, default `0`): Number of tokens the request counts for.
+            hold_slot (`bool`, default `True`): Whether to hold an in-flight request slot during the call. Streaming
+                calls hold it themselves with `concurrency_slot()`, until the stream is consumed.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            try:
+                if hold_slot:
+                    with self.concurrency_slot():
+                        return api_call()
+                return api_call()
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.get_retry_delay(e, attempt)
+                self.total_retries += 1
+                logger.warning(f"Provider API call failed ({e}), retrying in {delay:.1f}s.")
+                time.sleep(delay)
+
+    def is_retryable(self, error: Exception) -> bool:
+        status_code = _get_error_status_code(error)
+        if status_code is not None:
+            return status_code in self.retryable_status_codes
+        return isinstance(error, (ConnectionError, TimeoutError)) or any(
+            name in type(error).__name__ for name in ("Timeout", "Connection")
+        )
+
+    def get_retry_delay(self, error: Exception, attempt: int) -> float:
+        """Returns a jittered exponential delay, or the `Retry-After` of the error if it is longer."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        retry_after = _get_error_retry_after(error)
+        if retry_after is not None:
+            # Retrying before the time requested by the provider would only be rejected again
+            delay = max(delay, retry_after)
+        return delay
+
+
+def _get_error_status_code(error: Exception) -> int | None:
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and isinstance(response, dict):
+        # botocore errors
+        status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    elif status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def _get_error_retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    else:
+        headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class ClientRegistry:
+    """Shares API clients, and their connection pools, between the models of a process.
+
+    Each API model otherwise creates its own client, so that creating a model per request or cloning agents opens new
+    connections, each paying a TCP and TLS handshake. Models given the same registry share one client per model
+    class, base URL and credentials. Registry keys only hold a hash of the client arguments, never the credentials.
+
+    Clients of the OpenAI SDK use an HTTP client configured by the registry, whose connections are tracked per host
+    in `connection_metrics()`. Clients of [`InferenceClientModel`] are shared as well, but their connections are
+    pooled process-wide by `huggingface_hub`, which the pool settings below do not apply to.
+
+    Parameters:
+        max_connections (`int`, default `100`): Maximum number of connections of each HTTP client.
+        max_keepalive_connections (`int`, default `20`): Maximum number of idle connections kept open per client.
+        keepalive_expiry (`float`, default `30.0`): Time in seconds after which an idle connection is closed.
+        timeout (`float`, default `600.0`): Timeout of requests, in seconds.
+        connect_timeout (`float`, default `5.0`): Timeout to open a connection, in seconds.
+        http2 (`bool`, default `False`): Whether to use HTTP/2 with the servers supporting it, to multiplex
+            concurrent requests over one connection. Requires `pip install 'httpx[http2]'`.
+
+    Example:
+    ```python
+    >>> registry = ClientRegistry.get_default()
+    >>> model = OpenAIServerModel(model_id="gpt-4o", api_key="...", client_registry=registry)
+    >>> other_model = OpenAIServerModel(model_id="gpt-4o-mini", api_key="...", client_registry=registry)
+    >>> model.client is other_model.client
+    True
+    ```
+    """
+
+    _default: "ClientRegistry | None" = None
+    _default_lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 600.0,
+        connect_timeout: float = 5.0,
+        http2: bool = False,
+    ):
+        if http2 and not _is_package_available("h2"):
+            raise ModuleNotFoundError("Please install 'h2' to use HTTP/2: `pip install 'httpx[http2]'`")
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.http2 = http2
+        # Reentrant, as creating a shared client can create an HTTP client
+        self._lock = threading.RLock()
+        self._clients: dict[tuple, Any] = {}
+        self._http_clients: list = []
+        self._metrics: dict[str, dict[str, float]] = {}
+
+    @classmethod
+    def get_default(cls) -> "ClientRegistry":
+        """Returns the registry of the whole process, created with the default settings on first use."""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def get_client(self, model: "ApiModel") -> Any:
+        """Returns the client shared by the models calling the same API as this one, created on first use."""
+        client_kwargs = getattr(model, "client_kwargs", {})
+        base_url = client_kwargs.get("base_url") or client_kwargs.get("azure_endpoint")
+        kwargs_hash = hashlib.sha256(json.dumps(client_kwargs, sort_keys=True, default=repr).encode()).hexdigest()
+        key = (type(model), base_url, kwargs_hash)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = model.create_client()
+            return self._clients[key]
+
+    def create_http_client(self) -> Any:
+        """Creates an `httpx.Client` with the pool settings of the registry, tracking its connections."""
+        import httpx
+
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            http2=self.http2,
+            event_hooks={"request": [self._track_request]},
+        )
+        with self._lock:
+            self._http_clients.append(http_client)
+        return http_client
+
+    def _track_request(self, request):
+        host = request.url.netloc.decode()
+        with self._lock:
+            metrics = self._metrics.setdefault(
+                host, {"requests": 0, "connections_opened": 0, "tls_handshakes": 0, "handshake_time": 0.0}
+            )
+            metrics["requests"] += 1
+        started_at = {}
+
+        def trace(event_name: str, info: dict):
+            # Called by the connection pool while sending the request, only when it opens a new connection
+            step, _, status = event_name.rpartition(".")
+            if step not in ("connection.connect_tcp", "connection.start_tls"):
+                return
+            if status == "started":
+                started_at[step] = time.perf_counter()
+            elif status == "complete" and step in started_at:
+                with self._lock:
+                    metrics["handshake_time"] += time.perf_counter() - started_at[step]
+                    metrics["connections_opened" if step == "connection.connect_tcp" else "tls_handshakes"] += 1
+
+        request.extensions["trace"] = trace
+
+    def connection_metrics(self) -> dict[str, dict[str, float]]:
+        """Returns the connection metrics of each host called through the HTTP clients of the registry.
+
+        For each host: the number of `requests`, of `connections_opened` and `tls_handshakes`, the total
+        `handshake_time` in seconds, and the number of requests sent on `reused_connections`.
+        """
+        with self._lock:
+            return {
+                host: {**metrics, "reused_connections": max(metrics["requests"] - metrics["connections_opened"], 0)}
+                for host, metrics in self._metrics.items()
+            }
+
+    def close(self):
+        """Closes the HTTP clients created by the registry, and forgets the shared clients."""
+        with self._lock:
+            http_clients, self._http_clients = self._http_clients, []
+            self._clients.clear()
+        for http_client in http_clients:
+            http_client.close()
+
+
 class ApiModel(Model):
     """
     Base class for API-based language models.
@@ -954,20 +1993,160 @@ class ApiModel(Model):
             Mapping to convert  between internal role names and API-specific role names. Defaults to None.
         client (`Any`, **optional**):
             Pre-configured API client instance. If not provided, a default client will be created. Defaults to None.
+        rate_limiter ([`RateLimiter`], **optional**):
+            Rate limiter for the calls to the API. Share it between models to share a provider quota.
+        client_registry ([`ClientRegistry`], **optional**):
+            Registry of clients shared between models, to reuse their connections. Ignored if `client` is given.
         **kwargs: Additional keyword arguments to pass to the parent class.
     """
 
     def __init__(
-        self, model_id: str, custom_role_conversions: dict[str, str] | None = None, client: Any | None = None, **kwargs
+        self,
+        model_id: str,
+        custom_role_conversions: dict[str, str] | None = None,
+        client: Any | None = None,
+        rate_limiter: RateLimiter | None = None,
+        client_registry: ClientRegistry | None = None,
+        **kwargs,
     ):
         super().__init__(model_id=model_id, **kwargs)
         self.custom_role_conversions = custom_role_conversions or {}
-        self.client = client or self.create_client()
+        self.rate_limiter = rate_limiter
+        self.client_registry = client_registry
+        if client is None:
+            client = client_registry.get_client(self) if client_registry is not None else self.create_client()
+        self.client = client
 
     def create_client(self):
         """Create the API client for the specific service."""
         raise NotImplementedError("Subclasses must implement this method to create a client")
 
+    def _count_request_tokens(
+        self, messages: list[dict[str, str | list[dict]] | ChatMessage], completion_kwargs: dict
+    ):
+        # Providers count the maximum number of output tokens against token quotas
+        max_output_tokens = completion_kwargs.get("max_tokens") or completion_kwargs.get("max_completion_tokens")
+        return self.count_tokens(messages) + (max_output_tokens or 0)
+
+    def _estimate_stream_usage(
+        self, messages: list[dict[str, str | list[dict]] | ChatMessage], output_text: str
+    ) -> ChatMessageStreamDelta:
+        """Returns a delta with the estimated token usage of a stream closed before the provider sent its usage."""
+        self._last_input_token_count = self.count_tokens(messages)
+        self._last_output_token_count = self.token_counter.count_text(output_text)
+        return ChatMessageStreamDelta(
+            content="",
+            token_usage=TokenUsage(
+                input_tokens=self._last_input_token_count, output_tokens=self._last_output_token_count
+            ),
+        )
+
+    def _call_api(
+        self,
+        api_call: Callable,
+        input_messages: list[dict[str, str | list[dict]] | ChatMessage],
+        /,
+        **completion_kwargs,
+    ) -> Any:
+        """Calls the API with the completion kwargs, through the rate limiter if there is one."""
+        if self.rate_limiter is None:
+            return api_call(**completion_kwargs)
+        return self.rate_limiter.call(
+            partial(api_call, **completion_kwargs),
+            tokens=self._count_request_tokens(input_messages, completion_kwargs),
+        )
+
+    def _stream_api(
+        self,
+        api_call: Callable,
+        input_messages: list[dict[str, str | list[dict]] | ChatMessage],
+        /,
+        **completion_kwargs,
+    ) -> Generator:
+        """Iterates over a streaming API call, holding an in-flight slot of the rate limiter until the stream ends."""
+        if self.rate_limiter is None:
+            yield from api_call(**completion_kwargs)
+            return
+        with self.rate_limiter.concurrency_slot():
+            yield from self.rate_limiter.call(
+                partial(api_call, **completion_kwargs),
+                tokens=self._count_request_tokens(input_messages, completion_kwargs),
+                hold_slot=False,
+            )
+
+    def _stream_chat_completion(
+        self,
+        api_call: Callable,
+        input_messages: list[dict[str, str | list[dict]] | ChatMessage],
+        completion_kwargs: dict[str, Any],
+        stop_sequences: list[str] | None = None,
+    ) -> Generator[ChatMessageStreamDelta]:
+        """Streams a chat completion of an OpenAI-compatible API as deltas of its content and tool calls.
+
+        Tool calls are streamed as true deltas: each [`ToolCallStreamDelta`] only holds the new fragment of the
+        arguments of the tool call at its index, to be reassembled with a [`ToolCallStreamAccumulator`].
+        """
+        stop_matcher = StopSequenceMatcher(stop_sequences) if stop_sequences else None
+        output_text = ""
+        events = self._stream_api(
+            api_call,
+            input_messages,
+            **completion_kwargs,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for event in events:
+            if event.choices:
+                choice = event.choices[0]
+                if choice.delta is None:
+                    if not getattr(choice, "finish_reason", None):
+                        raise ValueError(f"No content or tool calls in event: {event}")
+                else:
+                    delta = choice.delta
+                    if delta.content:
+                        content = delta.content
+                        output_text += content
+                        if stop_matcher is not None:
+                            content = stop_matcher.feed(content)
+                            if stop_matcher.stopped and "stop" not in completion_kwargs:
+                                # The provider does not know the stop sequences: close its stream here, so that it
+                                # stops generating, and estimate the usage it would have sent at the end
+                                yield ChatMessageStreamDelta(content=content)
+                                events.close()
+                                yield self._estimate_stream_usage(input_messages, output_text)
+                                return
+                        if content:
+                            yield ChatMessageStreamDelta(content=content)
+                    if delta.tool_calls:
+                        yield ChatMessageStreamDelta(
+                            tool_calls=[
+                                ToolCallStreamDelta(
+                                    index=tool_call_delta.index,
+                                    id=tool_call_delta.id,
+                                    type=tool_call_delta.type,
+                                    function=ChatMessageToolCallDefinition(
+                                        name=tool_call_delta.function.name,
+                                        arguments=tool_call_delta.function.arguments,
+                                    )
+                                    if tool_call_delta.function
+                                    else None,
+                                )
+                                for tool_call_delta in delta.tool_calls
+                            ]
+                        )
+            if event.usage:
+                self._last_input_token_count = event.usage.prompt_tokens
+                self._last_output_token_count = event.usage.completion_tokens
+                yield ChatMessageStreamDelta(
+                    content="",
+                    token_usage=TokenUsage(
+                        input_tokens=event.usage.prompt_tokens,
+                        output_tokens=event.usage.completion_tokens,
+                    ),
+                )
+        if stop_matcher is not None and not stop_matcher.stopped:
+            yield ChatMessageStreamDelta(content=stop_matcher.flush())
+
 
 class LiteLLMModel(ApiModel):
     """Model to use [LiteLLM Python SDK](https://docs.litellm.ai/docs/#litellm-python-sdk) to access hundreds of LLMs.
@@ -1051,7 +2230,7 @@ class LiteLLMModel(ApiModel):
             **kwargs,
         )
 
-        response = self.client.completion(**completion_kwargs)
+        response = self._call_api(self.client.completion, messages, **completion_kwargs)
 
         self._last_input_token_count = response.usage.prompt_tokens
         self._last_output_token_count = response.usage.completion_tokens
@@ -1086,12 +2265,27 @@ class LiteLLMModel(ApiModel):
             convert_images_to_image_urls=True,
             **kwargs,
         )
-        for event in self.client.completion(**completion_kwargs, stream=True, stream_options={"include_usage": True}):
+        stop_matcher = StopSequenceMatcher(stop_sequences) if stop_sequences else None
+        output_text = ""
+        events = self._stream_api(
+            self.client.completion, messages, **completion_kwargs, stream=True, stream_options={"include_usage": True}
+        )
+        for event in events:
             if event.choices:
                 if event.choices[0].delta.content:
-                    yield ChatMessageStreamDelta(
-                        content=event.choices[0].delta.content,
-                    )
+                    content = event.choices[0].delta.content
+                    output_text += content
+                    if stop_matcher is not None:
+                        content = stop_matcher.feed(content)
+                        if stop_matcher.stopped and "stop" not in completion_kwargs:
+                            # The provider does not know the stop sequences: close its stream here, so that it stops
+                            # generating, and estimate the usage it would have sent at the end
+                            yield ChatMessageStreamDelta(content=content)
+                            events.close()
+                            yield self._estimate_stream_usage(messages, output_text)
+                            return
+                    if content:
+                        yield ChatMessageStreamDelta(content=content)
             if getattr(event, "usage", None):
                 self._last_input_token_count = event.usage.prompt_tokens
                 self._last_output_token_count = event.usage.completion_tokens
@@ -1102,6 +2296,8 @@ class LiteLLMModel(ApiModel):
                         output_tokens=event.usage.completion_tokens,
                     ),
                 )
+        if stop_matcher is not None and not stop_matcher.stopped:
+            yield ChatMessageStreamDelta(content=stop_matcher.flush())
 
 
 class LiteLLMRouterModel(LiteLLMModel):
@@ -1316,7 +2512,7 @@ class InferenceClientModel(ApiModel):
             custom_role_conversions=self.custom_role_conversions,
             **kwargs,
         )
-        response = self.client.chat_completion(**completion_kwargs)
+        response = self._call_api(self.client.chat_completion, messages, **completion_kwargs)
 
         self._last_input_token_count = response.usage.prompt_tokens
         self._last_output_token_count = response.usage.completion_tokens
@@ -1348,75 +2544,9 @@ class InferenceClientModel(ApiModel):
             **kwargs,
         )
 
-        # Track accumulated tool calls and content
-        accumulated_tool_calls = {}
-        current_content = ""
-
-        for event in self.client.chat.completions.create(
-            **completion_kwargs, stream=True, stream_options={"include_usage": True}
-        ):
-            if event.choices:
-                choice = event.choices[0]
-                if choice.delta is None:
-                    if not getattr(choice, "finish_reason", None):
-                        raise ValueError(f"No content or tool calls in event: {event}")
-                else:
-                    delta = choice.delta
-
-                    # Handle content streaming
-                    if delta.content:
-                        current_content += delta.content
-                        yield ChatMessageStreamDelta(content=delta.content)
-
-                    # Handle tool call streaming
-                    if delta.tool_calls:
-                        for tool_call_delta in delta.tool_calls:  # ?ormally there should be only one call at a time
-                            # Extend accumulated_tool_calls list to accommodate the new tool call if needed
-                            while len(accumulated_tool_calls) <= tool_call_delta.index:
-                                accumulated_tool_calls[tool_call_delta.index] = {
-                                    "id": None,
-                                    "type": None,
-                                    "function": {"name": None, "arguments": ""},
-                                }
-
-                            # Update the tool call at the specific index
-                            tool_call = accumulated_tool_calls[tool_call_delta.index]
-
-                            if tool_call_delta.id:
-                                tool_call["id"] = tool_call_delta.index
-                            if tool_call_delta.type:
-                                tool_call["type"] = tool_call_delta.type
-                            if tool_call_delta.function:
-                                if tool_call_delta.function.name:
-                                    tool_call["function"]["name"] = tool_call_delta.function.name
-                                if tool_call_delta.function.arguments:
-                                    tool_call["function"]["arguments"] += tool_call_delta.function.arguments
-
-                        yield ChatMessageStreamDelta(
-                            content=current_content,
-                            tool_calls=[
-                                ToolCallStreamDelta(
-                                    id=tool_call["id"],
-                                    type=tool_call["type"],
-                                    function=ChatMessageToolCallDefinition(
-                                        name=tool_call["function"]["name"],
-                                        arguments=tool_call["function"]["arguments"],
-                                    ),
-                                )
-                                for tool_call in accumulated_tool_calls.values()
-                            ],
-                        )
-
-            if event.usage:
-                self._last_input_token_count = event.usage.prompt_tokens
-                self._last_output_token_count = event.usage.completion_tokens
-                yield ChatMessageStreamDelta(
-                    content="",
-                    token_usage=TokenUsage(
-                        input_tokens=event.usage.prompt_tokens,
-                        output_tokens=event.usage.completion_tokens,
-                    ),
-                )
+        yield from self._stream_chat_completion(
+            self.client.chat.completions.create, messages, completion_kwargs, stop_sequences
+        )
 
 
 class HfApiModel(InferenceClientModel):
@@ -1487,7 +2617,21 @@ class OpenAIServerModel(ApiModel):
                 "Please install 'openai' extra to use OpenAIServerModel: `pip install 'smolagents[openai]'`"
             ) from e
 
-        return openai.OpenAI(**self.client_kwargs)
+        return openai.OpenAI(**self._get_openai_client_kwargs())
+
+    def _get_openai_client_kwargs(self) -> dict[str, Any]:
+        if self.client_registry is None or "http_client" in self.client_kwargs:
+            return self.client_kwargs
+        return {**self.client_kwargs, "http_client": self.client_registry.create_http_client()}
+
+    def create_token_counter(self) -> TokenCounter:
+        if _is_package_available("tiktoken"):
+            try:
+                return TiktokenTokenCounter(model_id=self.model_id)
+            except Exception as e:
+                # tiktoken downloads its encodings on first use
+                logger.warning(f"Could not load a tiktoken encoding, estimating token counts from characters: {e}")
+        return HeuristicTokenCounter()
 
     def generate_stream(
         self,
@@ -1508,75 +2652,9 @@ class OpenAIServerModel(ApiModel):
             **kwargs,
         )
 
-        # Track accumulated tool calls and content
-        accumulated_tool_calls = {}
-        current_content = ""
-
-        for event in self.client.chat.completions.create(
-            **completion_kwargs, stream=True, stream_options={"include_usage": True}
-        ):
-            if event.choices:
-                choice = event.choices[0]
-                if choice.delta is None:
-                    if not getattr(choice, "finish_reason", None):
-                        raise ValueError(f"No content or tool calls in event: {event}")
-                else:
-                    delta = choice.delta
-
-                    # Handle content streaming
-                    if delta.content:
-                        current_content += delta.content
-                        yield ChatMessageStreamDelta(content=delta.content)
-
-                    # Handle tool call streaming
-                    if delta.tool_calls:
-                        for tool_call_delta in delta.tool_calls:  # ?ormally there should be only one call at a time
-                            # Extend accumulated_tool_calls list to accommodate the new tool call if needed
-                            while len(accumulated_tool_calls) <= tool_call_delta.index:
-                                accumulated_tool_calls[tool_call_delta.index] = {
-                                    "id": None,
-                                    "type": None,
-                                    "function": {"name": None, "arguments": ""},
-                                }
-
-                            # Update the tool call at the specific index
-                            tool_call = accumulated_tool_calls[tool_call_delta.index]
-
-                            if tool_call_delta.id:
-                                tool_call["id"] = tool_call_delta.index
-                            if tool_call_delta.type:
-                                tool_call["type"] = tool_call_delta.type
-                            if tool_call_delta.function:
-                                if tool_call_delta.function.name:
-                                    tool_call["function"]["name"] = tool_call_delta.function.name
-                                if tool_call_delta.function.arguments:
-                                    tool_call["function"]["arguments"] += tool_call_delta.function.arguments
-
-                        yield ChatMessageStreamDelta(
-                            content=current_content,
-                            tool_calls=[
-                                ToolCallStreamDelta(
-                                    id=tool_call["id"],
-                                    type=tool_call["type"],
-                                    function=ChatMessageToolCallDefinition(
-                                        name=tool_call["function"]["name"],
-                                        arguments=tool_call["function"]["arguments"],
-                                    ),
-                                )
-                                for tool_call in accumulated_tool_calls.values()
-                            ],
-                        )
-
-            if event.usage:
-                self._last_input_token_count = event.usage.prompt_tokens
-                self._last_output_token_count = event.usage.completion_tokens
-                yield ChatMessageStreamDelta(
-                    content="",
-                    token_usage=TokenUsage(
-                        input_tokens=event.usage.prompt_tokens,
-                        output_tokens=event.usage.completion_tokens,
-                    ),
-                )
+        yield from self._stream_chat_completion(
+            self.client.chat.completions.create, messages, completion_kwargs, stop_sequences
+        )
 
     def generate(
         self,
@@ -1596,7 +2674,7 @@ class OpenAIServerModel(ApiModel):
             convert_images_to_image_urls=True,
             **kwargs,
         )
-        response = self.client.chat.completions.create(**completion_kwargs)
+        response = self._call_api(self.client.chat.completions.create, messages, **completion_kwargs)
 
         self._last_input_token_count = response.usage.prompt_tokens
         self._last_output_token_count = response.usage.completion_tokens
@@ -1664,7 +2742,7 @@ class AzureOpenAIServerModel(OpenAIServerModel):
                 "Please install 'openai' extra to use AzureOpenAIServerModel: `pip install 'smolagents[openai]'`"
             ) from e
 
-        return openai.AzureOpenAI(**self.client_kwargs)
+        return openai.AzureOpenAI(**self._get_openai_client_kwargs())
 
 
 class AmazonBedrockServerModel(ApiModel):
@@ -1780,6 +2858,11 @@ class AmazonBedrockServerModel(ApiModel):
             convert_images_to_image_urls=convert_images_to_image_urls,
             **kwargs,
         )
+        if stop_sequences:
+            # Copied so that the inference configuration given at init is not modified
+            inference_config = dict(completion_kwargs.get("inferenceConfig", {}))
+            inference_config["stopSequences"] = [*inference_config.get("stopSequences", []), *stop_sequences]
+            completion_kwargs["inferenceConfig"] = inference_config
 
         # Not all models in Bedrock support `toolConfig`. Also, smolagents already include the tool call in the prompt,
         # so adding `toolConfig` could cause conflicts. We remove it to avoid issues.
@@ -1807,6 +2890,44 @@ class AmazonBedrockServerModel(ApiModel):
 
         return boto3.client("bedrock-runtime", **self.client_kwargs)
 
+    def _converse_stream(self, **completion_kwargs) -> Any:
+        # The events are in the `stream` field of the response
+        return self.client.converse_stream(**completion_kwargs)["stream"]
+
+    def generate_stream(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta]:
+        if response_format is not None:
+            raise ValueError("Amazon Bedrock does not support response_format")
+        completion_kwargs: dict = self._prepare_completion_kwargs(
+            messages=messages,
+            stop_sequences=stop_sequences,
+            tools_to_call_from=tools_to_call_from,
+            custom_role_conversions=self.custom_role_conversions,
+            convert_images_to_image_urls=True,
+            **kwargs,
+        )
+
+        for event in self._stream_api(self._converse_stream, messages, **completion_kwargs):
+            if "contentBlockDelta" in event:
+                # Other deltas, like reasoning content, are not part of the output
+                text = event["contentBlockDelta"]["delta"].get("text")
+                if text:
+                    yield ChatMessageStreamDelta(content=text)
+            elif "metadata" in event:
+                usage = event["metadata"]["usage"]
+                self._last_input_token_count = usage["inputTokens"]
+                self._last_output_token_count = usage["outputTokens"]
+                yield ChatMessageStreamDelta(
+                    content="",
+                    token_usage=TokenUsage(input_tokens=usage["inputTokens"], output_tokens=usage["outputTokens"]),
+                )
+
     def generate(
         self,
         messages: list[dict[str, str | list[dict]] | ChatMessage],
@@ -1819,6 +2940,7 @@ class AmazonBedrockServerModel(ApiModel):
             raise ValueError("Amazon Bedrock does not support response_format")
         completion_kwargs: dict = self._prepare_completion_kwargs(
             messages=messages,
+            stop_sequences=stop_sequences,
             tools_to_call_from=tools_to_call_from,
             custom_role_conversions=self.custom_role_conversions,
             convert_images_to_image_urls=True,
@@ -1826,7 +2948,7 @@ class AmazonBedrockServerModel(ApiModel):
         )
 
         # self.client is created in ApiModel class
-        response = self.client.converse(**completion_kwargs)
+        response = self._call_api(self.client.converse, messages, **completion_kwargs)
 
         # Get first message
         response["output"]["message"]["content"] = response["output"]["message"]["content"][0]["text"]
@@ -1843,6 +2965,775 @@ class AmazonBedrockServerModel(ApiModel):
         )
 
 
+def _stream_delta_to_dict(delta: ChatMessageStreamDelta) -> dict:
+    return {
+        "content": delta.content,
+        "tool_calls": [asdict(tool_call) for tool_call in delta.tool_calls] if delta.tool_calls else None,
+        "token_usage": delta.token_usage.dict() if delta.token_usage else None,
+    }
+
+
+def _stream_delta_from_dict(data: dict) -> ChatMessageStreamDelta:
+    tool_calls = None
+    if data["tool_calls"]:
+        tool_calls = []
+        for tool_call in data["tool_calls"]:
+            function = ChatMessageToolCallDefinition(**tool_call["function"]) if tool_call["function"] else None
+            if "index" in tool_call:
+                tool_calls.append(ToolCallStreamDelta(**{**tool_call, "function": function}))
+            else:
+                tool_calls.append(ChatMessageToolCall(function=function, id=tool_call["id"], type=tool_call["type"]))
+    token_usage = data["token_usage"]
+    return ChatMessageStreamDelta(
+        content=data["content"],
+        tool_calls=tool_calls,
+        token_usage=TokenUsage(token_usage["input_tokens"], token_usage["output_tokens"]) if token_usage else None,
+    )
+
+
+def _canonical_json_default(obj: Any) -> Any:
+    # Images and bytes are hashed rather than encoded: the key only needs to identify them
+    if hasattr(obj, "tobytes"):
+        return {"sha256": hashlib.sha256(obj.tobytes()).hexdigest(), "size": list(getattr(obj, "size", []))}
+    if isinstance(obj, bytes):
+        return {"sha256": hashlib.sha256(obj).hexdigest()}
+    if isinstance(obj, ChatMessage):
+        return get_dict_from_nested_dataclasses(obj, ignore_key="raw")
+    return str(obj)
+
+
+class CachedModel(Model):
+    """Wraps a model to cache its responses in a local SQLite file, e.g. to re-run benchmarks or debug runs for free.
+
+    Responses are keyed on a hash of the messages, stop sequences, response format, tools and generation arguments,
+    and stored with their token usage. Cache hits do not call the wrapped model at all. Streamed responses are
+    replayed delta by delta.
+
+    Parameters:
+        model ([`Model`]): Model to cache.
+        cache_path (`str` or `Path`, default `"~/.cache/smolagents/model_cache.sqlite"`): Path of the cache file.
+        mode (`str`, default `"record"`): How to use the cache:
+            - `"record"`: serve cached responses, and store new ones.
+            - `"read_only"`: serve cached responses, but never write to the cache.
+            - `"refresh"`: always call the wrapped model, and overwrite cached responses.
+        max_size_bytes (`int`, default 1 GiB): Size of the cache above which least recently used responses are evicted.
+        cache_incomplete_streams (`bool`, default `False`): Whether to store streams closed early by their consumer,
+            like CodeAgent once its code block is complete. They are replayed up to the same delta, which only suits
+            consumers stopping at the same point: by default, only streams consumed until their end are stored.
+    """
+
+    modes = ("record", "read_only", "refresh")
+
+    def __init__(
+        self,
+        model: Model,
+        cache_path: str | Path = "~/.cache/smolagents/model_cache.sqlite",
+        mode: Literal["record", "read_only", "refresh"] = "record",
+        max_size_bytes: int = 1 << 30,
+        cache_incomplete_streams: bool = False,
+    ):
+        if mode not in self.modes:
+            raise ValueError(f"Invalid cache mode {mode!r}: it should be one of {self.modes}.")
+        super().__init__(
+            flatten_messages_as_text=model.flatten_messages_as_text,
+            tool_name_key=model.tool_name_key,
+            tool_arguments_key=model.tool_arguments_key,
+            model_id=model.model_id,
+        )
+        self.model = model
+        self.mode = mode
+        self.max_size_bytes = max_size_bytes
+        self.cache_incomplete_streams = cache_incomplete_streams
+        self.cache_path = Path(cache_path).expanduser()
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.cache_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+        # Only expose streaming if the wrapped model supports it, as agents check for the attribute
+        if hasattr(model, "generate_stream"):
+            self.generate_stream = self._generate_stream
+
+    def create_token_counter(self) -> TokenCounter:
+        return self.model.token_counter
+
+    def cache_key(self, method: str, messages: list[dict[str, str | list[dict]] | ChatMessage], **kwargs) -> str:
+        """Returns the hash identifying a call to the wrapped model."""
+        tools = kwargs.pop("tools_to_call_from", None)
+        key_data = {
+            "model_class": type(self.model).__name__,
+            "model_id": self.model.model_id,
+            "model_kwargs": self.model.kwargs,
+            "method": method,
+            "messages": messages,
+            "tools": [get_tool_json_schema(tool) for tool in tools] if tools else None,
+            "kwargs": kwargs,
+        }
+        canonical_json = json.dumps(key_data, sort_keys=True, default=_canonical_json_default)
+        return hashlib.sha256(canonical_json.encode()).hexdigest()
+
+    def _read(self, key: str) -> Any | None:
+        if self.mode == "refresh":
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.mode == "record":
+                with self._connection:
+                    self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def _write(self, key: str, value: Any):
+        if self.mode == "read_only":
+            return
+        serialized_value = json.dumps(value)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, serialized_value, len(serialized_value), time.time()),
+            )
+            (total_size,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if total_size > self.max_size_bytes:
+                self._evict(total_size)
+
+    def _evict(self, total_size: int):
+        evicted_keys = []
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if total_size <= self.max_size_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+
+    def generate(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> ChatMessage:
+        key = self.cache_key(
+            "generate",
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+        cached = self._read(key)
+        if cached is not None:
+            token_usage = cached["token_usage"]
+            return ChatMessage.from_dict(
+                cached,
+                token_usage=TokenUsage(token_usage["input_tokens"], token_usage["output_tokens"])
+                if token_usage
+                else None,
+            )
+        chat_message = self.model.generate(
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+        self._write(key, get_dict_from_nested_dataclasses(chat_message, ignore_key="raw"))
+        return chat_message
+
+    def _generate_stream(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta]:
+        key = self.cache_key(
+            "generate_stream",
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+        cached = self._read(key)
+        if cached is not None:
+            for delta in cached["deltas"]:
+                yield _stream_delta_from_dict(delta)
+            if not cached["complete"]:
+                logger.warning("The cached stream was closed early when recorded: its remaining deltas are missing.")
+            return
+        deltas = []
+        try:
+            for delta in self.model.generate_stream(
+                messages,
+                stop_sequences=stop_sequences,
+                response_format=response_format,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            ):
+                deltas.append(_stream_delta_to_dict(delta))
+                yield delta
+        except GeneratorExit:
+            if self.cache_incomplete_streams:
+                self._write(key, {"deltas": deltas, "complete": False})
+            raise
+        self._write(key, {"deltas": deltas, "complete": True})
+
+    def to_dict(self) -> dict:
+        return {
+            "model": self.model.to_dict(),
+            "cache_path": str(self.cache_path),
+            "mode": self.mode,
+            "max_size_bytes": self.max_size_bytes,
+            "cache_incomplete_streams": self.cache_incomplete_streams,
+        }
+
+
+class HedgedModel(Model):
+    """Wraps several models serving the same requests, to cut tail latency with hedged requests.
+
+    Each call is first sent to the primary model. If it has not answered (or, when streaming, produced its first
+    token) within the given percentile of its past latencies, the call is also sent to the next model, and so on.
+    The first model to answer wins, and the calls that lost are stopped as soon as it does: calls not started yet are
+    cancelled, losing streams are closed at their next delta, and losing non-streaming calls have their response
+    discarded when it arrives, as a running HTTP request cannot be interrupted from another thread.
+
+    Calls run on a bounded thread pool owned by the model, shut down by [`~HedgedModel.close`].
+
+    Parameters:
+        models (`list[Model]`): Models to use, primary first, for instance the same model on two providers.
+        hedge_percentile (`float`, default `0.9`): Percentile of the latencies of a model after which the next model
+            is called.
+        initial_hedge_delay (`float`, default `5.0`): Delay in seconds before calling the next model, used until
+            `min_samples` latencies of the model have been recorded.
+        min_samples (`int`, default `10`): Number of latencies needed to use the percentile.
+        max_samples (`int`, default `1000`): Number of most recent latencies kept per model.
+        max_workers (`int`, *optional*): Maximum number of calls running at once, across all requests. Defaults to
+            4 times the number of models.
+    """
+
+    def __init__(
+        self,
+        models: list[Model],
+        hedge_percentile: float = 0.9,
+        initial_hedge_delay: float = 5.0,
+        min_samples: int = 10,
+        max_samples: int = 1000,
+        max_workers: int | None = None,
+    ):
+        if not models:
+            raise ValueError("HedgedModel needs at least one model.")
+        super().__init__(
+            flatten_messages_as_text=models[0].flatten_messages_as_text,
+            tool_name_key=models[0].tool_name_key,
+            tool_arguments_key=models[0].tool_arguments_key,
+            model_id=models[0].model_id,
+        )
+        self.models = models
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        # Latencies to the answer for `generate`, to the first token for `generate_stream`
+        self.latencies = {
+            method: [deque(maxlen=max_samples) for _ in models] for method in ("generate", "generate_stream")
+        }
+        self.requests = [0] * len(models)
+        self.wins = [0] * len(models)
+        self._lock = threading.Lock()
+        self.max_workers = max_workers or 4 * len(models)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="smolagents-hedge")
+        # Only expose streaming if all wrapped models support it, as agents check for the attribute
+        if all(hasattr(model, "generate_stream") for model in models):
+            self.generate_stream = self._generate_stream
+
+    def create_token_counter(self) -> TokenCounter:
+        return self.models[0].token_counter
+
+    def get_hedge_delay(self, index: int, method: str) -> float:
+        """Returns the delay after which to call the next model if model `index` has not answered."""
+        with self._lock:
+            latencies = list(self.latencies[method][index])
+        if len(latencies) < self.min_samples:
+            return self.initial_hedge_delay
+        return _percentile(latencies, self.hedge_percentile)
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        """Returns, for each model, its number of requests, wins, win rate and latency percentiles."""
+        total_wins = sum(self.wins) or 1
+        stats = []
+        with self._lock:
+            for index, model in enumerate(self.models):
+                model_stats = {
+                    "model_id": model.model_id,
+                    "requests": self.requests[index],
+                    "wins": self.wins[index],
+                    "win_rate": self.wins[index] / total_wins,
+                }
+                for method, latencies in self.latencies.items():
+                    for percentile in (0.5, 0.9, 0.99):
+                        model_stats[f"{method}_latency_p{round(percentile * 100)}"] = (
+                            _percentile(list(latencies[index]), percentile) if latencies[index] else None
+                        )
+                stats.append(model_stats)
+        return stats
+
+    def close(self):
+        """Shuts down the thread pool of the model, cancelling the calls that have not started yet."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _record_latency(self, index: int, method: str, latency: float):
+        with self._lock:
+            self.latencies[method][index].append(latency)
+
+    def _submit(self, call: Callable[[threading.Event], None]) -> Callable:
+        """Runs `call(stop_event)` on the thread pool, and returns a function stopping it."""
+        stop_event = threading.Event()
+        future = self._executor.submit(call, stop_event)
+
+        def stop():
+            stop_event.set()
+            future.cancel()
+
+        return stop
+
+    def _hedge(
+        self, method: str, start_call: Callable[[int, queue.Queue], Callable]
+    ) -> Generator[tuple[int, str, Any]]:
+        """Starts the models one after the other until one of them produces an event, then yields its events.
+
+        Events are `(index, kind, payload)` tuples put on a queue by the calls, `kind` being `"output"`, `"end"`
+        or `"error"`. Calls are started with `start_call(index, events)`, which returns a function cancelling them.
+        """
+        events = queue.Queue()
+        cancels = []
+        errors = []
+        winner = None
+
+        def start_next_call():
+            index = len(cancels)
+            with self._lock:
+                self.requests[index] += 1
+            cancels.append(start_call(index, events))
+
+        try:
+            while True:
+                if winner is None and len(cancels) < len(self.models) and len(errors) == len(cancels):
+                    # All started calls failed: start the next one without waiting
+                    timeout = 0
+                elif winner is None and len(cancels) < len(self.models):
+                    timeout = self.get_hedge_delay(len(cancels) - 1, method)
+                else:
+                    timeout = None
+                if timeout == 0:
+                    start_next_call()
+                    continue
+                try:
+                    index, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # The last started model is too slow: start the next one
+                    start_next_call()
+                    continue
+                if winner is None:
+                    if kind == "error":
+                        errors.append(payload)
+                        if len(errors) == len(self.models):
+                            raise payload
+                        continue
+                    winner = index
+                    with self._lock:
+                        self.wins[index] += 1
+                    # Stop the calls that lost right away, not once the winner has streamed its whole output
+                    for other_index, cancel in enumerate(cancels):
+                        if other_index != winner:
+                            cancel()
+                elif index != winner:
+                    continue
+                if kind == "error":
+                    raise payload
+                yield index, kind, payload
+                if kind == "end":
+                    return
+        finally:
+            for cancel in cancels:
+                cancel()
+
+    def generate(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> ChatMessage:
+        def start_call(index: int, events: queue.Queue) -> Callable:
+            def call(stop_event: threading.Event):
+                if stop_event.is_set():
+                    return
+                start_time = time.perf_counter()
+                try:
+                    chat_message = self.models[index].generate(
+                        messages,
+                        stop_sequences=stop_sequences,
+                        response_format=response_format,
+                        tools_to_call_from=tools_to_call_from,
+                        **kwargs,
+                    )
+                except Exception as e:
+                    events.put((index, "error", e))
+                    return
+                self._record_latency(index, "generate", time.perf_counter() - start_time)
+                events.put((index, "end", chat_message))
+
+            return self._submit(call)
+
+        for _, _, chat_message in self._hedge("generate", start_call):
+            return chat_message
+
+    def _generate_stream(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta]:
+        def start_call(index: int, events: queue.Queue) -> Callable:
+            def call(stop_event: threading.Event):
+                if stop_event.is_set():
+                    return
+                start_time = time.perf_counter()
+                stream = None
+                try:
+                    stream = self.models[index].generate_stream(
+                        messages,
+                        stop_sequences=stop_sequences,
+                        response_format=response_format,
+                        tools_to_call_from=tools_to_call_from,
+                        **kwargs,
+                    )
+                    for position, delta in enumerate(stream):
+                        if position == 0:
+                            # Recorded for calls that lost too, so that slow first tokens are not left out
+                            self._record_latency(index, "generate_stream", time.perf_counter() - start_time)
+                        if stop_event.is_set():
+                            return
+                        events.put((index, "output", delta))
+                    events.put((index, "end", None))
+                except Exception as e:
+                    events.put((index, "error", e))
+                finally:
+                    if stream is not None:
+                        stream.close()
+
+            # Stopping the call closes the stream at its next delta
+            return self._submit(call)
+
+        for _, kind, delta in self._hedge("generate_stream", start_call):
+            if kind == "output":
+                yield delta
+
+
+@dataclass
+class _CascadeCall:
+    latency: float
+    cost: float | None = None
+    success: bool = True
+
+
+def _has_output(chat_message: ChatMessage) -> bool:
+    return bool(chat_message.tool_calls) or bool(chat_message.content and chat_message.content.strip())
+
+
+class CascadeModel(Model):
+    """Tries cheap models first and escalates to stronger ones when their output is not usable.
+
+    Each call goes to the first model of the cascade that has been reliable enough recently. Its output is checked
+    right away: if the model errors, if tool calls are expected but cannot be parsed, or if `confidence_check` rejects
+    the output, the call is escalated to the next model. When used by an agent, the outcome of each step is also
+    reported back through `record_step_outcome`: if the step failed with one of the `escalate_on` errors, for instance
+    a parsing error or an error in the generated code, the model that produced it is marked as failed and the next
+    step starts one model higher.
+
+    Success rates, latencies, tokens and costs are tracked per model and returned by `get_stats()`. A model whose
+    success rate over the last `window_size` calls drops below `min_success_rate` is skipped, except for a share
+    `exploration_rate` of the calls that keep probing it so that it can recover. Among the models meeting
+    `min_success_rate`, calls start with the one with the lowest expected cost or latency per call, counting the
+    calls escalated to the next models when it fails: a cheap model failing often can cost more than the next one.
+
+    Streaming calls go to the selected model without checking its output before yielding, escalation then only
+    happens at the next step.
+
+    Parameters:
+        models (`list[Model]`): Models to use, from the cheapest to the strongest.
+        confidence_check (`Callable[[ChatMessage], bool]`, *optional*): Returns whether an output can be used.
+            Defaults to checking that the output is not empty.
+        escalate_on (`tuple[type[Exception], ...]`, default `(AgentParsingError, AgentExecutionError)`): Step errors
+            after which the next step is escalated.
+        costs (`list[tuple[float, float]]`, *optional*): Cost per million input and output tokens of each model.
+        min_success_rate (`float`, default `0.5`): Success rate below which a model is skipped.
+        min_samples (`int`, default `5`): Number of calls needed before skipping a model.
+        window_size (`int`, default `50`): Number of most recent calls used to compute success rates.
+        exploration_rate (`float`, default `0.1`): Share of the calls that start with the first model regardless of
+            its success rate.
+        optimize_for (`str`, *optional*, default `"cost"`): Expected value per call minimized when selecting the model
+            to start with, `"cost"` (only used if `costs` is given) or `"latency"`. If None, or while the models
+            have fewer than `min_samples` recent calls, calls start with the first model meeting `min_success_rate`.
+    """
+
+    def __init__(
+        self,
+        models: list[Model],
+        confidence_check: Callable[[ChatMessage], bool] | None = None,
+        escalate_on: tuple[type[Exception], ...] = (AgentParsingError, AgentExecutionError),
+        costs: list[tuple[float, float]] | None = None,
+        min_success_rate: float = 0.5,
+        min_samples: int = 5,
+        window_size: int = 50,
+        exploration_rate: float = 0.1,
+        optimize_for: Literal["cost", "latency"] | None = "cost",
+    ):
+        if not models:
+            raise ValueError("CascadeModel needs at least one model.")
+        if optimize_for not in ("cost", "latency", None):
+            raise ValueError(f"Invalid optimize_for {optimize_for!r}: it should be 'cost', 'latency' or None.")
+        if costs is not None and len(costs) != len(models):
+            raise ValueError(f"Got {len(costs)} costs for {len(models)} models.")
+        super().__init__(
+            flatten_messages_as_text=models[0].flatten_messages_as_text,
+            tool_name_key=models[0].tool_name_key,
+            tool_arguments_key=models[0].tool_arguments_key,
+            model_id=models[-1].model_id,
+        )
+        self.models = models
+        self.confidence_check = confidence_check or _has_output
+        self.escalate_on = escalate_on
+        self.costs = costs
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self.exploration_rate = exploration_rate
+        self.optimize_for = optimize_for
+        self.calls = [deque(maxlen=window_size) for _ in models]
+        self.failures = [0] * len(models)
+        self.token_usages = [TokenUsage(input_tokens=0, output_tokens=0) for _ in models]
+        self._lock = threading.Lock()
+        # The last call of each thread, to attribute step outcomes when several agents share the model
+        self._local = threading.local()
+        if all(hasattr(model, "generate_stream") for model in models):
+            self.generate_stream = self._generate_stream
+
+    def create_token_counter(self) -> TokenCounter:
+        return self.models[-1].token_counter
+
+    def get_success_rate(self, index: int) -> float | None:
+        """Returns the success rate of model `index` over its recent calls, or None if it has too few calls."""
+        with self._lock:
+            outcomes = [call.success for call in self.calls[index]]
+        if len(outcomes) < self.min_samples:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    def get_expected_values(self, metric: Literal["cost", "latency"]) -> list[float | None]:
+        """Returns, for each model, the expected cost or latency of a call starting with it.
+
+        A call starting with model `index` costs its own call, plus the expected value of starting with the next model
+        when it fails. The value is None if a model involved has fewer than `min_samples` recent calls. Costs need
+        `costs` to be given.
+        """
+        expected_values = [None] * len(self.models)
+        next_value = None
+        for index in reversed(range(len(self.models))):
+            with self._lock:
+                calls = list(self.calls[index])
+            values = [getattr(call, metric) for call in calls]
+            if len(calls) < self.min_samples:
+                next_value = None
+                continue
+            failure_rate = 1 - sum(call.success for call in calls) / len(calls)
+            is_last_model = index == len(self.models) - 1
+            if is_last_model or failure_rate == 0:
+                next_value = sum(values) / len(values)
+            elif next_value is not None:
+                next_value = sum(values) / len(values) + failure_rate * next_value
+            expected_values[index] = next_value
+        return expected_values
+
+    def select_model(self) -> int:
+        """Returns the index of the model to start the next call with."""
+        escalate_from = getattr(self._local, "escalate_from", None)
+        if escalate_from is not None:
+            self._local.escalate_from = None
+            return min(escalate_from + 1, len(self.models) - 1)
+        if random.random() < self.exploration_rate:
+            return 0
+        candidates = [
+            index
+            for index in range(len(self.models) - 1)
+            if (success_rate := self.get_success_rate(index)) is None or success_rate >= self.min_success_rate
+        ] + [len(self.models) - 1]
+        if self.optimize_for is None or (self.optimize_for == "cost" and self.costs is None):
+            return candidates[0]
+        expected_values = self.get_expected_values(self.optimize_for)
+        if expected_values[candidates[0]] is None:
+            # Keep sampling the first usable model until its expected value is known
+            return candidates[0]
+        return min(
+            (index for index in candidates if expected_values[index] is not None),
+            key=lambda index: expected_values[index],
+        )
+
+    def record_step_outcome(self, memory_step) -> None:
+        """Marks the model that produced the output of `memory_step` as failed if the step failed.
+
+        Agents register this method as a step callback.
+        """
+        last_call = getattr(self._local, "last_call", None)
+        if last_call is None:
+            return
+        index, call = last_call
+        self._local.last_call = None
+        if isinstance(memory_step.error, self.escalate_on):
+            with self._lock:
+                call.success = False
+                self.failures[index] += 1
+            if index < len(self.models) - 1:
+                self._local.escalate_from = index
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        """Returns, for each model, its recent calls, success rate, failures, latency percentiles, tokens and cost."""
+        stats = []
+        for index, model in enumerate(self.models):
+            with self._lock:
+                latencies = [call.latency for call in self.calls[index]]
+                token_usage = self.token_usages[index]
+            success_rate = self.get_success_rate(index)
+            model_stats = {
+                "model_id": model.model_id,
+                "calls": len(latencies),
+                "success_rate": success_rate,
+                "failures": self.failures[index],
+                "latency_p50": _percentile(latencies, 0.5) if latencies else None,
+                "latency_p90": _percentile(latencies, 0.9) if latencies else None,
+                "input_tokens": token_usage.input_tokens,
+                "output_tokens": token_usage.output_tokens,
+            }
+            if self.costs is not None:
+                input_cost, output_cost = self.costs[index]
+                model_stats["cost"] = (
+                    token_usage.input_tokens * input_cost + token_usage.output_tokens * output_cost
+                ) / 1_000_000
+            stats.append(model_stats)
+        return stats
+
+    def _record_call(self, index: int, latency: float, token_usage: TokenUsage | None, success: bool) -> _CascadeCall:
+        cost = None
+        if self.costs is not None:
+            # Failed calls without a response are not billed
+            input_cost, output_cost = self.costs[index]
+            cost = (
+                (token_usage.input_tokens * input_cost + token_usage.output_tokens * output_cost) / 1_000_000
+                if token_usage is not None
+                else 0.0
+            )
+        call = _CascadeCall(latency=latency, cost=cost, success=success)
+        with self._lock:
+            self.calls[index].append(call)
+            if token_usage is not None:
+                self.token_usages[index].input_tokens += token_usage.input_tokens
+                self.token_usages[index].output_tokens += token_usage.output_tokens
+            if not success:
+                self.failures[index] += 1
+        if success:
+            self._local.last_call = (index, call)
+        return call
+
+    def _check_output(
+        self, index: int, chat_message: ChatMessage, tools_to_call_from: list[Tool] | None
+    ) -> ChatMessage:
+        if not self.confidence_check(chat_message):
+            raise ValueError("Output rejected by the confidence check")
+        if tools_to_call_from and not chat_message.tool_calls:
+            # Parse on a copy so that the agent still gets the original output if the last model fails too
+            chat_message = self.models[index].parse_tool_calls(deepcopy(chat_message))
+        return chat_message
+
+    def generate(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> ChatMessage:
+        start_index = self.select_model()
+        for index in range(start_index, len(self.models)):
+            is_last_model = index == len(self.models) - 1
+            start_time = time.perf_counter()
+            chat_message = None
+            try:
+                chat_message = self.models[index].generate(
+                    messages,
+                    stop_sequences=stop_sequences,
+                    response_format=response_format,
+                    tools_to_call_from=tools_to_call_from,
+                    **kwargs,
+                )
+                checked_message = self._check_output(index, chat_message, tools_to_call_from)
+            except Exception as e:
+                latency = time.perf_counter() - start_time
+                self._record_call(index, latency, chat_message.token_usage if chat_message else None, success=False)
+                if is_last_model:
+                    if chat_message is not None:
+                        # Let the agent handle the unusable output of the strongest model
+                        self._local.last_call = None
+                        return chat_message
+                    raise
+                logger.info(f"Escalating from model {self.models[index].model_id} after: {e}")
+                continue
+            self._record_call(index, time.perf_counter() - start_time, chat_message.token_usage, success=True)
+            return checked_message
+
+    def _generate_stream(
+        self,
+        messages: list[dict[str, str | list[dict]] | ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta]:
+        index = self.select_model()
+        start_time = time.perf_counter()
+        token_usage = TokenUsage(input_tokens=0, output_tokens=0)
+        success = False
+        try:
+            for delta in self.models[index].generate_stream(
+                messages,
+                stop_sequences=stop_sequences,
+                response_format=response_format,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            ):
+                if delta.token_usage:
+                    token_usage.input_tokens += delta.token_usage.input_tokens
+                    token_usage.output_tokens += delta.token_usage.output_tokens
+                yield delta
+            success = True
+        except GeneratorExit:
+            # Closed by its consumer, like CodeAgent once its code block is complete: the call completed
+            success = True
+            raise
+        finally:
+            self._record_call(index, time.perf_counter() - start_time, token_usage, success=success)
+
+
 __all__ = [
     "MessageRole",
     "tool_role_conversions",
@@ -1860,4 +3751,16 @@ __all__ = [
     "AzureOpenAIServerModel",
     "AmazonBedrockServerModel",
     "ChatMessage",
+    "TokenCounter",
+    "HeuristicTokenCounter",
+    "TiktokenTokenCounter",
+    "TokenizerTokenCounter",
+    "CachedModel",
+    "RateLimiter",
+    "ClientRegistry",
+    "HedgedModel",
+    "CascadeModel",
+    "StopSequenceMatcher",
+    "ToolCallStreamAccumulator",
+    "StreamingToolCallParser",
 ]
@@ -15,11 +15,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import json
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Generator, Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from enum import IntEnum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
 
 from rich import box
 from rich.console import Console, Group
+from rich.live import Live
+from rich.markdown import Markdown
 from rich.panel import Panel
 from rich.rule import Rule
 from rich.syntax import Syntax
@@ -30,7 +41,17 @@ from rich.tree import Tree
 from smolagents.utils import escape_code_brackets
 
 
-__all__ = ["AgentLogger", "LogLevel", "Monitor", "TokenUsage", "Timing"]
+__all__ = [
+    "AgentLogger",
+    "LogLevel",
+    "MetricsRegistry",
+    "Monitor",
+    "RunProfiler",
+    "StepMetrics",
+    "StreamingRenderer",
+    "TokenUsage",
+    "Timing",
+]
 
 
 @dataclass
@@ -78,13 +99,92 @@ class Timing:
         return f"Timing(start_time={self.start_time}, end_time={self.end_time}, duration={self.duration})"
 
 
+@dataclass
+class StepMetrics:
+    """
+    Contains the time spent in the model, the tools and the code executor during a given step, in seconds.
+    """
+
+    model_duration: float | None = None
+    time_to_first_token: float | None = None
+    output_tokens_per_second: float | None = None
+    tool_durations: dict[str, list[float]] = field(default_factory=dict)
+    executor_duration: float | None = None
+    executor_operations: int | None = None
+
+    def record_model_call(
+        self,
+        start_time: float,
+        end_time: float,
+        first_token_time: float | None = None,
+        output_tokens: int | None = None,
+    ):
+        """Records a model call, timed with `time.perf_counter()`.
+
+        Throughput is computed after the first token when streaming, so that it does not include the prefill latency.
+        """
+        self.model_duration = end_time - start_time
+        if first_token_time is not None:
+            self.time_to_first_token = first_token_time - start_time
+        if output_tokens:
+            generation_duration = end_time - (first_token_time if first_token_time is not None else start_time)
+            if generation_duration > 0:
+                self.output_tokens_per_second = output_tokens / generation_duration
+
+    def record_tool_call(self, tool_name: str, duration: float):
+        # setdefault and append are atomic, so tools called in parallel can record their duration concurrently
+        self.tool_durations.setdefault(tool_name, []).append(duration)
+
+    def dict(self):
+        return {
+            "model_duration": self.model_duration,
+            "time_to_first_token": self.time_to_first_token,
+            "output_tokens_per_second": self.output_tokens_per_second,
+            "tool_durations": self.tool_durations,
+            "executor_duration": self.executor_duration,
+            "executor_operations": self.executor_operations,
+        }
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    """Returns the nearest-rank percentile of non-empty `values`, `percentile` being between 0 and 1."""
+    sorted_values = sorted(values)
+    return sorted_values[max(0, math.ceil(percentile * len(sorted_values)) - 1)]
+
+
+def _summarize(values: list[float]) -> dict[str, float]:
+    summary = {"count": len(values), "sum": sum(values)}
+    for percentile in Monitor.percentiles:
+        summary[f"p{round(percentile * 100)}"] = _percentile(values, percentile) if values else None
+    return summary
+
+
+_PROMETHEUS_METRICS = {
+    "step_durations": ("step_duration_seconds", "Duration of the agent steps."),
+    "model_durations": ("model_duration_seconds", "Wall time of the model calls."),
+    "times_to_first_token": ("time_to_first_token_seconds", "Time to the first token of streamed model calls."),
+    "output_tokens_per_second": ("output_tokens_per_second", "Output tokens generated per second."),
+    "tool_durations": ("tool_duration_seconds", "Duration of the tool calls."),
+    "executor_durations": ("executor_duration_seconds", "Duration of the code executions."),
+}
+
+
 class Monitor:
+    percentiles = (0.5, 0.9, 0.99)
+
     def __init__(self, tracked_model, logger):
         self.step_durations = []
         self.tracked_model = tracked_model
         self.logger = logger
         self.total_input_token_count = 0
         self.total_output_token_count = 0
+        # (estimated, actual) input tokens of the steps for which both are known
+        self.input_token_estimates: list[tuple[int, int]] = []
+        self.model_durations: list[float] = []
+        self.times_to_first_token: list[float] = []
+        self.output_tokens_per_second: list[float] = []
+        self.tool_durations: dict[str, list[float]] = {}
+        self.executor_durations: list[float] = []
 
     def get_total_token_counts(self) -> TokenUsage:
         return TokenUsage(
@@ -92,10 +192,74 @@ class Monitor:
             output_tokens=self.total_output_token_count,
         )
 
+    def get_token_estimate_accuracy(self) -> dict[str, float] | None:
+        """Compares the local estimates of input tokens with the counts reported by the model.
+
+        Returns:
+            `dict[str, float] | None`: Number of steps compared, total estimated and actual input tokens, and mean
+            relative error of the estimates. `None` if no step had both counts.
+        """
+        if not self.input_token_estimates:
+            return None
+        return {
+            "steps": len(self.input_token_estimates),
+            "estimated_input_tokens": sum(estimated for estimated, _ in self.input_token_estimates),
+            "input_tokens": sum(actual for _, actual in self.input_token_estimates),
+            "mean_relative_error": sum(
+                abs(estimated - actual) / actual for estimated, actual in self.input_token_estimates
+            )
+            / len(self.input_token_estimates),
+        }
+
+    def get_metrics(self) -> dict:
+        """Returns the count, sum and percentiles of the step, model, tool and executor metrics, and token totals.
+
+        Durations are in seconds. Tool metrics are given per tool name.
+        """
+        metrics = {name: _summarize(getattr(self, name)) for name in _PROMETHEUS_METRICS if name != "tool_durations"}
+        metrics["tool_durations"] = {
+            tool_name: _summarize(values) for tool_name, values in self.tool_durations.items()
+        }
+        metrics["token_usage"] = self.get_total_token_counts().dict()
+        return metrics
+
+    def to_prometheus(self, prefix: str = "smolagents") -> str:
+        """Returns the metrics in the Prometheus text exposition format, as summaries with quantiles."""
+        lines = []
+        for name, (metric_name, description) in _PROMETHEUS_METRICS.items():
+            metric_name = f"{prefix}_{metric_name}"
+            lines += [f"# HELP {metric_name} {description}", f"# TYPE {metric_name} summary"]
+            if name == "tool_durations":
+                series = {f'tool="{tool_name}"': values for tool_name, values in self.tool_durations.items()}
+            else:
+                series = {"": getattr(self, name)}
+            for labels, values in series.items():
+                if values:
+                    for percentile in self.percentiles:
+                        quantile_labels = ",".join(filter(None, [labels, f'quantile="{percentile}"']))
+                        lines.append(f"{metric_name}{{{quantile_labels}}} {_percentile(values, percentile)}")
+                suffix_labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{metric_name}_sum{suffix_labels} {sum(values)}")
+                lines.append(f"{metric_name}_count{suffix_labels} {len(values)}")
+        for token_type, count in [("input", self.total_input_token_count), ("output", self.total_output_token_count)]:
+            metric_name = f"{prefix}_{token_type}_tokens_total"
+            lines += [
+                f"# HELP {metric_name} Total {token_type} tokens.",
+                f"# TYPE {metric_name} counter",
+                f"{metric_name} {count}",
+            ]
+        return "\n".join(lines) + "\n"
+
     def reset(self):
         self.step_durations = []
         self.total_input_token_count = 0
         self.total_output_token_count = 0
+        self.input_token_estimates = []
+        self.model_durations = []
+        self.times_to_first_token = []
+        self.output_tokens_per_second = []
+        self.tool_durations = {}
+        self.executor_durations = []
 
     def update_metrics(self, step_log):
         """Update the metrics of the monitor.
@@ -105,16 +269,355 @@ class Monitor:
         """
         step_duration = step_log.timing.duration
         self.step_durations.append(step_duration)
-        console_outputs = f"[Step {len(self.step_durations)}: Duration {step_duration:.2f} seconds"
-
         if step_log.token_usage is not None:
             self.total_input_token_count += step_log.token_usage.input_tokens
             self.total_output_token_count += step_log.token_usage.output_tokens
+            estimated_input_tokens = getattr(step_log, "estimated_input_tokens", None)
+            if estimated_input_tokens is not None and step_log.token_usage.input_tokens > 0:
+                self.input_token_estimates.append((estimated_input_tokens, step_log.token_usage.input_tokens))
+        step_metrics = getattr(step_log, "metrics", None)
+        if step_metrics is not None:
+            for name, value in [
+                ("model_durations", step_metrics.model_duration),
+                ("times_to_first_token", step_metrics.time_to_first_token),
+                ("output_tokens_per_second", step_metrics.output_tokens_per_second),
+                ("executor_durations", step_metrics.executor_duration),
+            ]:
+                if value is not None:
+                    getattr(self, name).append(value)
+            for tool_name, durations in step_metrics.tool_durations.items():
+                self.tool_durations.setdefault(tool_name, []).extend(durations)
+        if not self.logger.is_enabled(LogLevel.INFO):
+            return
+
+        console_outputs = f"[Step {len(self.step_durations)}: Duration {step_duration:.2f} seconds"
+        if step_log.token_usage is not None:
             console_outputs += (
                 f"| Input tokens: {self.total_input_token_count:,} | Output tokens: {self.total_output_token_count:,}"
             )
         console_outputs += "]"
-        self.logger.log(Text(console_outputs, style="dim"), level=1)
+        self.logger.log(Text(console_outputs, style="dim"), level=LogLevel.INFO)
+
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+@dataclass
+class _Metric:
+    name: str
+    type: str
+    description: str
+    # Counters and gauges: labels -> value. Histograms: labels -> [bucket counts..., sum, count]
+    values: dict[tuple[tuple[str, str], ...], Any] = field(default_factory=dict)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped_labels = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped_labels.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped_labels) + "}"
+
+
+class MetricsRegistry:
+    """Process-wide metrics of agent runs, exposed in the OpenMetrics text format.
+
+    One registry can be shared by all the agents of a process, by passing it as `metrics_registry` to each agent.
+    It counts runs, steps, errors per [`AgentError`] subclass, tokens and code executor operations, tracks the
+    number of active runs, and keeps histograms of model, tool and code executor latencies. Updates take a single
+    lock, so that the registry can be used from many threads.
+
+    Metrics can be scraped with [`~MetricsRegistry.generate_latest`], or served over HTTP with
+    [`~MetricsRegistry.serve`].
+
+    Args:
+        latency_buckets (`tuple[float, ...]`): Upper bounds of the latency histogram buckets, in seconds.
+        prefix (`str`, default `"smolagents"`): Prefix of the metric names.
+
+    Example:
+    ```py
+    registry = MetricsRegistry()
+    registry.serve(port=9464)
+    agent = CodeAgent(tools=[], model=model, metrics_registry=registry)
+    ```
+    """
+
+    def __init__(self, latency_buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS, prefix: str = "smolagents"):
+        self.latency_buckets = tuple(sorted(latency_buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+        for name, metric_type, description in [
+            ("runs", "counter", "Agent runs started."),
+            ("active_runs", "gauge", "Agent runs in progress."),
+            ("steps", "counter", "Agent steps."),
+            ("errors", "counter", "Agent step errors, per error type."),
+            ("tokens", "counter", "Model tokens, per token type."),
+            ("model_latency_seconds", "histogram", "Wall time of the model calls."),
+            ("tool_latency_seconds", "histogram", "Duration of the tool calls."),
+            ("executor_latency_seconds", "histogram", "Duration of the code executions."),
+            ("executor_operations", "counter", "Operations evaluated by the local Python executor."),
+        ]:
+            self.register(name, metric_type, description)
+
+    def register(self, name: str, metric_type: str, description: str) -> None:
+        """Declares a metric of type `"counter"`, `"gauge"` or `"histogram"`."""
+        if metric_type not in ("counter", "gauge", "histogram"):
+            raise ValueError(f"Unknown metric type {metric_type!r}.")
+        self._metrics[name] = _Metric(name=f"{self.prefix}_{name}", type=metric_type, description=description)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increments a counter or a gauge. Gauges can be decremented with a negative `value`."""
+        metric = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric.values[key] = metric.values.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Adds a value to a histogram."""
+        metric = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = metric.values.get(key)
+            if histogram is None:
+                histogram = metric.values[key] = [0] * (len(self.latency_buckets) + 2)
+            for index, bound in enumerate(self.latency_buckets):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def get(self, name: str, **labels: str) -> Any:
+        """Returns the value of a counter or gauge, or the `(sum, count)` of a histogram, for the given labels."""
+        metric = self._metrics[name]
+        with self._lock:
+            value = metric.values.get(tuple(sorted(labels.items())))
+        if metric.type == "histogram":
+            return (value[-2], value[-1]) if value is not None else (0.0, 0)
+        return value or 0
+
+    def track_run(self, run_stream: Generator) -> Generator:
+        """Counts the run of `run_stream` as active until the generator is exhausted or closed."""
+        self.inc("runs")
+        self.inc("active_runs")
+        try:
+            yield from run_stream
+        finally:
+            self.inc("active_runs", -1)
+
+    def record_step(self, memory_step, agent=None) -> None:
+        """Step callback recording the step count, errors, tokens and latencies of an action step."""
+        self.inc("steps", agent=getattr(agent, "name", None) or type(agent).__name__)
+        if memory_step.error is not None:
+            self.inc("errors", error_type=type(memory_step.error).__name__)
+        if memory_step.token_usage is not None:
+            self.inc("tokens", memory_step.token_usage.input_tokens, type="input")
+            self.inc("tokens", memory_step.token_usage.output_tokens, type="output")
+        step_metrics = memory_step.metrics
+        if step_metrics.model_duration is not None:
+            model_id = getattr(getattr(agent, "model", None), "model_id", None)
+            self.observe("model_latency_seconds", step_metrics.model_duration, model_id=str(model_id))
+        for tool_name, durations in step_metrics.tool_durations.items():
+            for duration in durations:
+                self.observe("tool_latency_seconds", duration, tool=tool_name)
+        if step_metrics.executor_duration is not None:
+            self.observe("executor_latency_seconds", step_metrics.executor_duration)
+        if step_metrics.executor_operations is not None:
+            self.inc("executor_operations", step_metrics.executor_operations)
+
+    def generate_latest(self) -> str:
+        """Returns all metrics in the OpenMetrics text format."""
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines += [f"# TYPE {metric.name} {metric.type}", f"# HELP {metric.name} {metric.description}"]
+                for labels, value in metric.values.items():
+                    if metric.type == "counter":
+                        lines.append(f"{metric.name}_total{_format_labels(labels)} {value}")
+                    elif metric.type == "gauge":
+                        lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+                    else:
+                        for bound, count in zip(self.latency_buckets + (float("inf"),), value[:-2] + [value[-1]]):
+                            le = "+Inf" if bound == float("inf") else str(bound)
+                            lines.append(f"{metric.name}_bucket{_format_labels(labels + (('le', le),))} {count}")
+                        lines.append(f"{metric.name}_sum{_format_labels(labels)} {value[-2]}")
+                        lines.append(f"{metric.name}_count{_format_labels(labels)} {value[-1]}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serves the metrics over HTTP from a daemon thread, at any path.
+
+        Args:
+            port (`int`, default `9464`): Port to listen on. Use 0 to pick a free port.
+            host (`str`, default `"127.0.0.1"`): Address to listen on.
+
+        Returns:
+            `ThreadingHTTPServer`: The running server: stop it with `shutdown()`.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.generate_latest().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="smolagents-metrics", daemon=True).start()
+        return server
+
+
+# Profiler of the run executing in the current context, so that phases deep in the call stack can be reported
+_active_profiler: ContextVar["RunProfiler | None"] = ContextVar("smolagents_active_profiler", default=None)
+
+
+def profile_phase(name: str, **args):
+    """Returns a context manager timing a phase of the run being profiled, if any, or doing nothing otherwise."""
+    profiler = _active_profiler.get()
+    return profiler.phase(name, **args) if profiler is not None else nullcontext()
+
+
+@dataclass
+class _ProfiledPhase:
+    name: str
+    start_ns: int
+    end_ns: int
+    thread_id: int
+    args: dict[str, Any]
+
+
+class RunProfiler:
+    """Opt-in profiler breaking down the time of agent runs into phases.
+
+    Pass it as `profiler` to an agent: its runs are then split into steps, planning, model calls, tool calls, code
+    interpreter, prompt assembly, output parsing, logging and step callbacks. Time spent by the caller of the run on
+    the steps or deltas it yields is reported as `caller`, and time spent in the agent but in none of these phases as
+    `run` or `step`: this is the framework overhead. Phases are nested, and each one is reported with both its total
+    time and its self time, i.e. excluding the phases nested in it, so that self times add up to the run time.
+
+    Tool calls running in parallel are profiled in their own threads, so their time adds to the run time.
+
+    Example:
+    ```py
+    profiler = RunProfiler()
+    agent = CodeAgent(tools=[], model=model, profiler=profiler)
+    agent.run("What is the 20th Fibonacci number?")
+    agent.logger.console.print(profiler.breakdown_table())
+    profiler.save_chrome_trace("trace.json")  # Open in chrome://tracing or https://ui.perfetto.dev
+    ```
+    """
+
+    def __init__(self):
+        self.phases: list[_ProfiledPhase] = []
+
+    def reset(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str, **args) -> Iterator[None]:
+        """Times the enclosed code as a phase called `name`, with optional `args` shown in the trace."""
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            # list.append is atomic: phases can be recorded from several threads
+            self.phases.append(_ProfiledPhase(name, start_ns, time.perf_counter_ns(), threading.get_ident(), args))
+
+    def profile_run(self, run_stream: Generator) -> Generator:
+        """Profiles `run_stream` as a `run` phase, in which the time its caller spends on each yielded item is a
+        `caller` phase."""
+        with self.phase("run"):
+            try:
+                while True:
+                    # Only activate the profiler while the run executes, not while the caller handles its outputs
+                    token = _active_profiler.set(self)
+                    try:
+                        item = next(run_stream)
+                    except StopIteration:
+                        return
+                    finally:
+                        _active_profiler.reset(token)
+                    with self.phase("caller"):
+                        yield item
+            finally:
+                run_stream.close()
+
+    def get_breakdown(self) -> dict[str, dict[str, float]]:
+        """Returns, for each phase, its number of calls, total and self time in seconds, and share of the run time."""
+        self_ns = {id(phase): phase.end_ns - phase.start_ns for phase in self.phases}
+        phases_by_thread: dict[int, list[_ProfiledPhase]] = {}
+        for phase in self.phases:
+            phases_by_thread.setdefault(phase.thread_id, []).append(phase)
+        for thread_phases in phases_by_thread.values():
+            stack: list[_ProfiledPhase] = []
+            # Parents start first, or at the same time but end later
+            for phase in sorted(thread_phases, key=lambda phase: (phase.start_ns, -phase.end_ns)):
+                while stack and stack[-1].end_ns <= phase.start_ns:
+                    stack.pop()
+                if stack:
+                    self_ns[id(stack[-1])] -= phase.end_ns - phase.start_ns
+                stack.append(phase)
+
+        breakdown: dict[str, dict[str, float]] = {}
+        for phase in self.phases:
+            phase_breakdown = breakdown.setdefault(phase.name, {"calls": 0, "total_time": 0.0, "self_time": 0.0})
+            phase_breakdown["calls"] += 1
+            phase_breakdown["total_time"] += (phase.end_ns - phase.start_ns) / 1e9
+            phase_breakdown["self_time"] += self_ns[id(phase)] / 1e9
+        run_time = breakdown.get("run", {}).get("total_time", 0.0)
+        for phase_breakdown in breakdown.values():
+            phase_breakdown["share"] = phase_breakdown["self_time"] / run_time if run_time else 0.0
+        return dict(sorted(breakdown.items(), key=lambda item: -item[1]["self_time"]))
+
+    def breakdown_table(self) -> Table:
+        """Returns the breakdown of the profiled runs as a table to print."""
+        table = Table(title="Run profile", box=box.SIMPLE_HEAD)
+        for column in ["Phase", "Calls", "Total (s)", "Self (s)", "Share of run"]:
+            table.add_column(column, justify="left" if column == "Phase" else "right")
+        for name, phase_breakdown in self.get_breakdown().items():
+            table.add_row(
+                name,
+                str(phase_breakdown["calls"]),
+                f"{phase_breakdown['total_time']:.4f}",
+                f"{phase_breakdown['self_time']:.4f}",
+                f"{phase_breakdown['share']:.1%}",
+            )
+        return table
+
+    def to_chrome_trace(self) -> dict[str, Any]:
+        """Returns the profiled phases in the Chrome trace event format, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": phase.name,
+                    "cat": "smolagents",
+                    "ph": "X",
+                    "ts": phase.start_ns / 1000,
+                    "dur": (phase.end_ns - phase.start_ns) / 1000,
+                    "pid": pid,
+                    "tid": phase.thread_id,
+                    "args": {key: str(value) for key, value in phase.args.items()},
+                }
+                for phase in self.phases
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def save_chrome_trace(self, path: str | os.PathLike) -> None:
+        """Saves the profiled phases to a Chrome trace event JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
 
 
 class LogLevel(IntEnum):
@@ -135,21 +638,42 @@ class AgentLogger:
         else:
             self.console = console
 
+    def is_enabled(self, level: int | str | LogLevel) -> bool:
+        """Returns whether messages at the given level are printed.
+
+        Use it to skip building expensive log records, e.g. `if logger.is_enabled(LogLevel.DEBUG): ...`.
+        """
+        if isinstance(level, str):
+            level = LogLevel[level.upper()]
+        return level <= self.level
+
     def log(self, *args, level: int | str | LogLevel = LogLevel.INFO, **kwargs) -> None:
         """Logs a message to the console.
 
         Args:
             level (LogLevel, optional): Defaults to LogLevel.INFO.
         """
-        if isinstance(level, str):
-            level = LogLevel[level.upper()]
-        if level <= self.level:
-            self.console.print(*args, **kwargs)
+        if self.is_enabled(level):
+            with profile_phase("logging"):
+                self.console.print(*args, **kwargs)
+
+    def log_lazy(self, *builders: Callable[[], Any], level: int | str | LogLevel = LogLevel.INFO, **kwargs) -> None:
+        """Logs the objects returned by callables taking no arguments.
+
+        The callables are only called if the level is enabled, so building the log record costs nothing otherwise.
+
+        Args:
+            level (LogLevel, optional): Defaults to LogLevel.INFO.
+        """
+        if self.is_enabled(level):
+            self.log(*(build() for build in builders), level=level, **kwargs)
 
     def log_error(self, error_message: str) -> None:
-        self.log(escape_code_brackets(error_message), style="bold red", level=LogLevel.ERROR)
+        self.log_lazy(lambda: escape_code_brackets(error_message), style="bold red", level=LogLevel.ERROR)
 
     def log_markdown(self, content: str, title: str | None = None, level=LogLevel.INFO, style=YELLOW_HEX) -> None:
+        if not self.is_enabled(level):
+            return
         markdown_content = Syntax(
             content,
             lexer="markdown",
@@ -172,6 +696,8 @@ class AgentLogger:
             self.log(markdown_content, level=level)
 
     def log_code(self, title: str, content: str, level: int = LogLevel.INFO) -> None:
+        if not self.is_enabled(level):
+            return
         self.log(
             Panel(
                 Syntax(
@@ -188,8 +714,8 @@ class AgentLogger:
         )
 
     def log_rule(self, title: str, level: int = LogLevel.INFO) -> None:
-        self.log(
-            Rule(
+        self.log_lazy(
+            lambda: Rule(
                 "[bold]" + title,
                 characters="━",
                 style=YELLOW_HEX,
@@ -198,8 +724,8 @@ class AgentLogger:
         )
 
     def log_task(self, content: str, subtitle: str, title: str | None = None, level: LogLevel = LogLevel.INFO) -> None:
-        self.log(
-            Panel(
+        self.log_lazy(
+            lambda: Panel(
                 f"\n[bold]{escape_code_brackets(content)}\n",
                 title="[bold]New run" + (f" - {title}" if title else ""),
                 subtitle=subtitle,
@@ -210,6 +736,8 @@ class AgentLogger:
         )
 
     def log_messages(self, messages: list[dict], level: LogLevel = LogLevel.DEBUG) -> None:
+        if not self.is_enabled(level):
+            return
         messages_as_string = "\n".join([json.dumps(dict(message), indent=4) for message in messages])
         self.log(
             Syntax(
@@ -263,3 +791,76 @@ class AgentLogger:
             )
         build_agent_tree(main_tree, agent)
         self.console.print(main_tree)
+
+
+class StreamingRenderer:
+    """Renders a streamed model output live to the logger's console, at a bounded frame rate.
+
+    Chunks are only buffered when appended: the Markdown view of the accumulated text is rebuilt at most
+    `refresh_per_second` times per second, plus once at the end. Nothing is rendered while streaming if the logger level
+    is below `LogLevel.INFO`, and consoles that are not interactive (files, pipes, CI logs) only get the final text.
+
+    Args:
+        logger (`AgentLogger`): Logger whose console and level are used.
+        footer (`Callable[[], str]`, *optional*): Returns text to render below the streamed output, e.g. the tool calls
+            received so far. It is only called when a frame is rendered.
+        refresh_per_second (`float`, default `10`): Maximum number of frames rendered per second.
+
+    Example:
+    ```py
+    with StreamingRenderer(logger) as renderer:
+        for event in model.generate_stream(messages):
+            renderer.append(event.content)
+    ```
+    """
+
+    def __init__(self, logger: "AgentLogger", footer: Callable[[], str] | None = None, refresh_per_second: float = 10):
+        self.logger = logger
+        self.footer = footer
+        self.min_frame_interval = 1 / refresh_per_second
+        self.enabled = logger.level >= LogLevel.INFO
+        console = logger.console
+        self.interactive = console.is_jupyter or (console.is_terminal and not console.is_dumb_terminal)
+        self._chunks: list[str] = []
+        self._live: Live | None = None
+        self._last_frame_time = float("-inf")
+        self._pending_frame = False
+
+    @property
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def __enter__(self) -> "StreamingRenderer":
+        if self.enabled and self.interactive:
+            self._live = Live("", console=self.logger.console, vertical_overflow="visible", auto_refresh=False)
+            self._live.start()
+        return self
+
+    def append(self, text: str | None = None) -> None:
+        """Appends a chunk of output, or only schedules a new frame if `text` is empty (e.g. when the footer changed)."""
+        if text:
+            self._chunks.append(text)
+        if self._live is None:
+            return
+        self._pending_frame = True
+        if time.perf_counter() - self._last_frame_time >= self.min_frame_interval:
+            self._render_frame()
+
+    def _full_text(self) -> str:
+        return self.text + (self.footer() if self.footer is not None else "")
+
+    def _render_frame(self) -> None:
+        with profile_phase("logging"):
+            self._live.update(Markdown(self._full_text()), refresh=True)
+        self._last_frame_time = time.perf_counter()
+        self._pending_frame = False
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._live is not None:
+            if self._pending_frame:
+                self._render_frame()
+            self._live.stop()
+        elif self.enabled and (full_text := self._full_text()):
+            self.logger.console.print(Markdown(full_text))
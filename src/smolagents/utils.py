@@ -151,25 +151,306 @@ def make_json_serializable(obj: Any) -> Any:
 
 def parse_json_blob(json_blob: str) -> tuple[dict[str, str], str]:
     "Extracts the JSON blob from the input and returns the JSON data and the rest of the input."
-    try:
-        first_accolade_index = json_blob.find("{")
-        last_accolade_index = [a.start() for a in list(re.finditer("}", json_blob))][-1]
-        json_data = json_blob[first_accolade_index : last_accolade_index + 1]
-        json_data = json.loads(json_data, strict=False)
-        return json_data, json_blob[:first_accolade_index]
-    except IndexError:
+    first_accolade_index = json_blob.find("{")
+    if first_accolade_index == -1:
         raise ValueError("The model output does not contain any JSON blob.")
-    except json.JSONDecodeError as e:
-        place = e.pos
-        if json_blob[place - 1 : place + 2] == "},\n":
-            raise ValueError(
-                "JSON is invalid: you probably tried to provide multiple tool calls in one action. PROVIDE ONLY ONE TOOL CALL."
-            )
+    # The blob ends with its closing accolade: the text after it is ignored without being scanned
+    parser = IncrementalJSONParser(strict=False, stop_at_end=True)
+    try:
+        parser.feed(json_blob[first_accolade_index:])
+        json_data = parser.close()
+    except JSONStreamDecodeError as e:
+        place = first_accolade_index + e.pos
         raise ValueError(
             f"The JSON blob you used is invalid due to the following error: {e}.\n"
             f"JSON blob was: {json_blob}, decoding failed on that specific part of the blob:\n"
-            f"'{json_blob[place - 4 : place + 5]}'."
+            f"'{json_blob[max(place - 4, 0) : place + 5]}'."
+        )
+    text_after_blob = json_blob[first_accolade_index + parser.end_position :].lstrip()
+    if text_after_blob.startswith(",") and "{" in text_after_blob:
+        raise ValueError(
+            "JSON is invalid: you probably tried to provide multiple tool calls in one action. PROVIDE ONLY ONE TOOL CALL."
         )
+    return json_data, json_blob[:first_accolade_index]
+
+
+class JSONStreamDecodeError(ValueError):
+    """Raised by [`IncrementalJSONParser`] on invalid JSON, with the position of the error in the whole stream."""
+
+    def __init__(self, msg: str, pos: int, lineno: int, colno: int):
+        super().__init__(f"{msg}: line {lineno} column {colno} (char {pos})")
+        self.msg = msg
+        self.pos = pos
+        self.lineno = lineno
+        self.colno = colno
+
+
+_JSON_WHITESPACE = frozenset(" \t\n\r")
+_JSON_NUMBER_CHARACTERS = frozenset("0123456789+-.eE")
+_JSON_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+_JSON_LITERALS = {"t": ("true", True), "f": ("false", False), "n": ("null", None)}
+_JSON_ESCAPES = frozenset('"\\/bfnrtu')
+_JSON_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+_JSON_STRING_SPECIAL_CHARACTERS = re.compile(r'["\\]')
+_JSON_STRICT_STRING_SPECIAL_CHARACTERS = re.compile(r'["\\\x00-\x1f]')
+
+# Errors raised by `json.loads` when the text ends while expecting a token
+_JSON_EXPECTED_MESSAGES = {
+    "value": "Expecting value",
+    "value_or_end": "Expecting value",
+    "key": "Expecting property name enclosed in double quotes",
+    "key_or_end": "Expecting property name enclosed in double quotes",
+    "colon": "Expecting ':' delimiter",
+    "comma_or_end": "Expecting ',' delimiter",
+}
+
+
+class IncrementalJSONParser:
+    """Parses a JSON value fed in chunks, for instance the arguments of a tool call streamed by a model.
+
+    The parser keeps its state between chunks, so that each character is read once whatever the number of chunks.
+    Containers are built as they are parsed: `value` holds the value parsed so far, and is final once `is_complete`
+    is `True`. Invalid JSON raises a [`JSONStreamDecodeError`] as soon as the invalid character is fed, giving its
+    position in the whole stream.
+
+    Args:
+        strict (`bool`, default `True`): Whether to reject control characters in strings, as `json.loads` does.
+        stop_at_end (`bool`, default `False`): Whether to stop reading at the end of the value and ignore the text
+            after it, whose start is then given by `end_position`. By default, any text other than whitespace after
+            the value is an error.
+
+    Example:
+    ```python
+    >>> parser = IncrementalJSONParser()
+    >>> parser.feed('{"query": "weather in ')
+    False
+    >>> parser.value
+    {}
+    >>> parser.feed('Paris", "limit": 3}')
+    True
+    >>> parser.value
+    {'query': 'weather in Paris', 'limit': 3}
+    ```
+    """
+
+    def __init__(self, strict: bool = True, stop_at_end: bool = False):
+        self.strict = strict
+        self.stop_at_end = stop_at_end
+        self.value: Any = None
+        self.is_complete = False
+        self.end_position: int | None = None
+        # Number of characters fed before the current chunk
+        self.position = 0
+        self._line = 1
+        self._line_start = 0
+        # Containers being parsed, innermost last, with the key awaiting a value for objects
+        self._stack: list[list | dict] = []
+        self._keys: list[str | None] = []
+        self._expected = "value"
+        # String, key, number or literal being read: its kind, characters and start position
+        self._token_kind: str | None = None
+        self._token: list[str] = []
+        self._token_start: tuple[int, int, int] = (0, 1, 0)
+        self._escape: str | None = None
+
+    def feed(self, chunk: str) -> bool:
+        """Parses a chunk of the JSON text, and returns whether the value is complete."""
+        if self.is_complete and self.stop_at_end:
+            return True
+        index, length = 0, len(chunk)
+        while index < length:
+            if self.is_complete and self.stop_at_end:
+                break
+            if self._token_kind in ("string", "key"):
+                index = self._read_string(chunk, index)
+                continue
+            character = chunk[index]
+            if self._token_kind == "number":
+                if character in _JSON_NUMBER_CHARACTERS:
+                    self._token.append(character)
+                    index += 1
+                    continue
+                self._end_number()
+                # The character ending a number is not part of it
+                continue
+            elif self._token_kind == "literal":
+                self._read_literal(character, index)
+                index += 1
+                continue
+            if character in _JSON_WHITESPACE:
+                if character == "\n":
+                    self._line += 1
+                    self._line_start = self.position + index + 1
+            else:
+                self._read_structural_character(character, index)
+            index += 1
+        if self.is_complete and self.stop_at_end:
+            self.end_position = self.position + index
+        self.position += index
+        return self.is_complete
+
+    def close(self) -> Any:
+        """Ends the stream and returns the parsed value, raising an error if it is incomplete."""
+        if self._token_kind == "number":
+            self._end_number()
+            if self.stop_at_end:
+                self.end_position = self.position
+        if self._token_kind in ("string", "key"):
+            raise self._error("Unterminated string starting at", *self._token_start)
+        if not self.is_complete:
+            raise self._error(_JSON_EXPECTED_MESSAGES[self._expected], self.position, self._line, self._line_start)
+        return self.value
+
+    def _error(self, message: str, position: int, line: int, line_start: int) -> JSONStreamDecodeError:
+        return JSONStreamDecodeError(message, position, line, position - line_start + 1)
+
+    def _error_at(self, message: str, index: int) -> JSONStreamDecodeError:
+        return self._error(message, self.position + index, self._line, self._line_start)
+
+    def _start_token(self, kind: str, index: int, first_characters: str = ""):
+        self._token_kind = kind
+        self._token = [first_characters] if first_characters else []
+        self._token_start = (self.position + index, self._line, self._line_start)
+
+    def _add_value(self, value: Any):
+        if not self._stack:
+            self.value = value
+        elif isinstance(self._stack[-1], list):
+            self._stack[-1].append(value)
+        else:
+            self._stack[-1][self._keys[-1]] = value
+        if isinstance(value, (dict, list)):
+            self._stack.append(value)
+            self._keys.append(None)
+            self._expected = "key_or_end" if isinstance(value, dict) else "value_or_end"
+        else:
+            self._end_value()
+
+    def _end_value(self):
+        if self._stack:
+            self._expected = "comma_or_end"
+        else:
+            self._expected = "end"
+            self.is_complete = True
+
+    def _close_container(self):
+        self._stack.pop()
+        self._keys.pop()
+        self._end_value()
+
+    def _read_structural_character(self, character: str, index: int):
+        expected = self._expected
+        if expected in ("value", "value_or_end"):
+            if character == "]" and expected == "value_or_end":
+                self._close_container()
+            elif character == "{":
+                self._add_value({})
+            elif character == "[":
+                self._add_value([])
+            elif character == '"':
+                self._start_token("string", index)
+            elif character == "-" or character.isdigit():
+                self._start_token("number", index, character)
+            elif character in _JSON_LITERALS:
+                self._start_token("literal", index, character)
+            else:
+                raise self._error_at("Expecting value", index)
+        elif expected in ("key", "key_or_end"):
+            if character == '"':
+                self._start_token("key", index)
+            elif character == "}" and expected == "key_or_end":
+                self._close_container()
+            else:
+                raise self._error_at("Expecting property name enclosed in double quotes", index)
+        elif expected == "colon":
+            if character != ":":
+                raise self._error_at("Expecting ':' delimiter", index)
+            self._expected = "value"
+        elif expected == "comma_or_end":
+            is_object = isinstance(self._stack[-1], dict)
+            if character == ",":
+                self._expected = "key" if is_object else "value"
+            elif character == ("}" if is_object else "]"):
+                self._close_container()
+            else:
+                raise self._error_at("Expecting ',' delimiter", index)
+        else:
+            raise self._error_at("Extra data", index)
+
+    def _read_string(self, chunk: str, index: int) -> int:
+        """Reads string characters from `index`, returning the index of the first character left to read."""
+        special_characters = _JSON_STRICT_STRING_SPECIAL_CHARACTERS if self.strict else _JSON_STRING_SPECIAL_CHARACTERS
+        length = len(chunk)
+        while index < length:
+            if self._escape is not None:
+                index = self._read_escape(chunk, index)
+                continue
+            match = special_characters.search(chunk, index)
+            end = match.start() if match else length
+            if end > index:
+                segment = chunk[index:end]
+                self._token.append(segment)
+                if not self.strict and "\n" in segment:
+                    self._line += segment.count("\n")
+                    self._line_start = self.position + index + segment.rindex("\n") + 1
+            if match is None:
+                return length
+            character = chunk[end]
+            if character == "\\":
+                self._escape = ""
+                index = end + 1
+            elif character == '"':
+                self._end_string()
+                return end + 1
+            else:
+                raise self._error_at("Invalid control character at", end)
+        return index
+
+    def _read_escape(self, chunk: str, index: int) -> int:
+        character = chunk[index]
+        if self._escape == "":
+            if character not in _JSON_ESCAPES:
+                raise self._error_at("Invalid \\escape", index - 1)
+            if character != "u":
+                self._token.append("\\" + character)
+                self._escape = None
+                return index + 1
+        elif character not in _JSON_HEX_DIGITS:
+            raise self._error_at("Invalid \\uXXXX escape", index - len(self._escape))
+        self._escape += character
+        if len(self._escape) == 5:
+            self._token.append("\\" + self._escape)
+            self._escape = None
+        return index + 1
+
+    def _end_string(self):
+        kind, self._token_kind = self._token_kind, None
+        # Escapes were validated while reading, so decoding cannot fail
+        value = "".join(self._token)
+        if "\\" in value:
+            value = json.loads(f'"{value}"', strict=False)
+        if kind == "key":
+            self._keys[-1] = value
+            self._expected = "colon"
+        else:
+            self._add_value(value)
+
+    def _end_number(self):
+        self._token_kind = None
+        token = "".join(self._token)
+        match = _JSON_NUMBER.fullmatch(token)
+        if match is None:
+            raise self._error("Invalid number", *self._token_start)
+        self._add_value(float(token) if match.group(1) or match.group(2) else int(token))
+
+    def _read_literal(self, character: str, index: int):
+        literal, value = _JSON_LITERALS[self._token[0]]
+        if literal[len(self._token)] != character:
+            raise self._error("Expecting value", *self._token_start)
+        self._token.append(character)
+        if len(self._token) == len(literal):
+            self._token_kind = None
+            self._add_value(value)
 
 
 def extract_code_from_text(text: str) -> str | None:
@@ -237,6 +518,60 @@ def parse_code_blobs(text: str) -> str:
     )
 
 
+class CodeBlockDetector:
+    """Incrementally detects the end of the first code block in a streamed model output.
+
+    Chunks are fed as they arrive, and each one is scanned only once, so detection stays linear in the output length.
+    Code blocks are recognized with the same fences as [`extract_code_from_text`]: once `feed` returns `True`,
+    `text[:code_end]` holds the output up to and including the closing fence.
+    """
+
+    _opening_fence = re.compile(r"```(?:py|python)?\s*\n")
+    # Prefix of an opening fence that may still become a full one when more text arrives
+    _partial_opening_fence = re.compile(r"```(?:p(?:y(?:t(?:h(?:o(?:n)?)?)?)?)?)?\s*")
+
+    def __init__(self):
+        self.text = ""
+        self.code_start: int | None = None
+        self.code_end: int | None = None
+        self._scan_from = 0
+
+    @property
+    def is_complete(self) -> bool:
+        return self.code_end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of model output, and returns whether a complete code block has been seen."""
+        if self.is_complete:
+            return True
+        self.text += chunk
+        if self.code_start is None and not self._find_opening_fence():
+            return False
+        closing_index = self.text.find("\n```", self._scan_from)
+        if closing_index == -1:
+            self._scan_from = max(self.code_start - 1, len(self.text) - 3)
+            return False
+        self.code_end = closing_index + 4
+        return True
+
+    def _find_opening_fence(self) -> bool:
+        while True:
+            fence_index = self.text.find("```", self._scan_from)
+            if fence_index == -1:
+                self._scan_from = max(0, len(self.text) - 2)
+                return False
+            match = self._opening_fence.match(self.text, fence_index)
+            if match:
+                self.code_start = match.end()
+                # The closing fence may directly follow the newline ending the opening fence
+                self._scan_from = match.end() - 1
+                return True
+            if self._partial_opening_fence.fullmatch(self.text, fence_index):
+                self._scan_from = fence_index
+                return False
+            self._scan_from = fence_index + 3
+
+
 MAX_LENGTH_TRUNCATE_CONTENT = 20000
 
 
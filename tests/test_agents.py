@@ -16,9 +16,12 @@ import io
 import os
 import re
 import tempfile
+import threading
+import time
 import uuid
 import warnings
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import nullcontext as does_not_raise
 from dataclasses import dataclass
 from pathlib import Path
@@ -43,15 +46,21 @@ from smolagents.agents import (
     ToolCall,
     ToolCallingAgent,
     populate_template,
+    run_agents_in_lockstep,
 )
 from smolagents.default_tools import DuckDuckGoSearchTool, FinalAnswerTool, PythonInterpreterTool, VisitWebpageTool
 from smolagents.memory import (
     ActionStep,
+    CallbackEvent,
+    CallbackRegistry,
     PlanningStep,
+    SlidingWindowPolicy,
     TaskStep,
 )
 from smolagents.models import (
+    CascadeModel,
     ChatMessage,
+    ChatMessageStreamDelta,
     ChatMessageToolCall,
     ChatMessageToolCallDefinition,
     InferenceClientModel,
@@ -573,6 +582,22 @@ class TestAgent:
         assert "Called Tool" in str_output
         assert "arguments" in str_output
 
+    def test_code_step_logs_execution_outputs(self, agent_logger):
+        class PrintingCodeModel(Model):
+            def generate(self, messages, stop_sequences=None):
+                return ChatMessage(
+                    role="assistant",
+                    content="Thought: I print, then answer.\nCode:\n```py\nprint('printed line')\nfinal_answer(42)\n```<end_code>",
+                )
+
+        agent = CodeAgent(tools=[], model=PrintingCodeModel(), logger=agent_logger)
+        agent.run("Print, then answer.")
+        str_output = agent_logger.console.export_text()
+        assert "Execution logs:" in str_output
+        assert "printed line" in str_output
+        assert "Out - Final answer: 42" in str_output
+        assert "<function" not in str_output
+
     def test_code_nontrivial_final_answer_works(self):
         class FakeCodeModelFinalAnswer(Model):
             def generate(self, messages, stop_sequences=None):
@@ -872,7 +897,7 @@ class TestMultiStepAgent:
                     expected_content["text"] = expected_message_texts[expected_content["text"]]
         assert isinstance(planning_step, PlanningStep)
         expected_model_input_messages = expected_messages_list[0]
-        model_input_messages = planning_step.model_input_messages
+        model_input_messages = list(planning_step.model_input_messages)
         assert isinstance(model_input_messages, list)
         assert len(model_input_messages) == len(expected_model_input_messages)  # 2
         for message, expected_message in zip(model_input_messages, expected_model_input_messages):
@@ -999,6 +1024,161 @@ class TestMultiStepAgent:
             agent.run("Test task")
         assert "Agent interrupted" in str(e)
 
+    def test_step_callbacks_events(self):
+        events = []
+
+        def record_event(event):
+            def callback(memory_step, **kwargs):
+                events.append((event, type(memory_step).__name__, kwargs.get("tool_output")))
+
+            return callback
+
+        agent = ToolCallingAgent(
+            tools=[PythonInterpreterTool()],
+            model=FakeToolCallModel(),
+            step_callbacks={event: record_event(event) for event in CallbackEvent},
+        )
+        agent.run("What is 2 multiplied by 3.6452?")
+        assert [(event, step_type) for event, step_type, _ in events] == [
+            (CallbackEvent.STEP_START, "ActionStep"),
+            (CallbackEvent.MODEL_OUTPUT, "ActionStep"),
+            (CallbackEvent.TOOL_RESULT, "ActionStep"),
+            (CallbackEvent.STEP_END, "ActionStep"),
+        ] * 2
+        assert "7.2904" in events[2][2]
+        assert events[6][2] == "7.2904"
+
+    def test_agents_sharing_a_callback_registry(self):
+        calls = []
+        registry = CallbackRegistry()
+        registry.append(lambda memory_step, agent: calls.append(agent))
+        agent_a = CodeAgent(tools=[], model=FakeCodeModel(), step_callbacks=registry)
+        agent_b = CodeAgent(tools=[], model=FakeCodeModel(), step_callbacks=registry)
+        agent_a.run("What is 2 multiplied by 3.6452?")
+        assert calls == [agent_a, agent_a]
+        # The internal callbacks of an agent are only dispatched by that agent
+        assert len(agent_a.monitor.step_durations) == 2
+        assert len(agent_b.monitor.step_durations) == 0
+        assert len(registry) == 1
+
+    def test_memory_policy_records_compaction(self):
+        agent = CodeAgent(
+            tools=[],
+            model=FakeCodeModel(),
+            memory_policy=SlidingWindowPolicy(max_tokens=10, keep_last_steps=0),
+            max_steps=2,
+        )
+        assert agent.memory.token_counter is agent.model.token_counter
+        agent.run("What is 2 multiplied by 3.6452?")
+        first_step, second_step = agent.memory.steps[1:3]
+        # The task step is never dropped
+        assert first_step.memory_compaction.dropped_steps == []
+        assert second_step.memory_compaction.dropped_steps == [1]
+        assert "memory_compaction" in agent.memory.get_full_steps()[1]
+        # The estimate reuses the count of the policy
+        assert second_step.estimated_input_tokens == second_step.memory_compaction.tokens_after
+
+    def test_memory_policy_shared_by_agents_is_not_changed(self):
+        policy = SlidingWindowPolicy(max_tokens=10_000)
+        agents = [
+            CodeAgent(tools=[], model=model, memory_policy=policy) for model in (FakeCodeModel(), FakeCodeModel())
+        ]
+        assert policy.token_counter is None
+        assert all(agent.memory.token_counter is agent.model.token_counter for agent in agents)
+        assert agents[0].memory.token_counter is not agents[1].memory.token_counter
+
+    def test_input_tokens_are_only_counted_on_demand(self):
+        model = FakeCodeModel()
+        with patch.object(Model, "count_tokens", autospec=True, return_value=123) as mock_count_tokens:
+            agent = CodeAgent(tools=[], model=model, max_steps=1)
+            agent.run("What is 2 multiplied by 3.6452?")
+            mock_count_tokens.assert_not_called()
+            assert agent.memory.steps[1].estimated_input_tokens is None
+            agent = CodeAgent(tools=[], model=model, max_steps=1, count_input_tokens=True)
+            agent.run("What is 2 multiplied by 3.6452?")
+            assert agent.memory.steps[1].estimated_input_tokens == 123
+
+    def test_step_callbacks_signatures_are_inspected_once(self):
+        calls = []
+
+        def legacy_callback(memory_step):
+            calls.append("legacy")
+
+        def agent_callback(memory_step, agent):
+            calls.append(agent)
+
+        agent = CodeAgent(tools=[], model=FakeCodeModel(), step_callbacks=[legacy_callback, agent_callback])
+        with patch("smolagents.memory.inspect.signature") as mock_signature:
+            agent.run("What is 2 multiplied by 3.6452?")
+        mock_signature.assert_not_called()
+        assert calls == ["legacy", agent, "legacy", agent]
+
+    def test_cascade_model_escalates_after_failed_step(self):
+        class SmallModel(FakeCodeModelError):
+            def generate(self, messages, stop_sequences=None, **kwargs):
+                return super().generate(messages, stop_sequences)
+
+        class LargeModel(FakeCodeModel):
+            def generate(self, messages, stop_sequences=None, **kwargs):
+                return super().generate(messages, stop_sequences)
+
+        model = CascadeModel([SmallModel(), LargeModel()], exploration_rate=0)
+        agent = CodeAgent(tools=[], model=model, max_steps=3)
+        assert agent.run("What is 2 multiplied by 3.6452?") == 7.2904
+        assert isinstance(agent.memory.steps[1].error, AgentExecutionError)
+        stats = model.get_stats()
+        assert (stats[0]["calls"], stats[0]["failures"]) == (1, 1)
+        assert (stats[1]["calls"], stats[1]["failures"]) == (1, 0)
+
+    def test_cascade_model_escalates_after_failed_streamed_step(self):
+        class StreamingCodeModel(Model):
+            def __init__(self, code):
+                super().__init__()
+                self.code = code
+
+            def generate_stream(self, messages, stop_sequences=None, **kwargs):
+                # The agent closes the stream at the closing code fence, before the trailing text
+                for chunk in ["Thought: compute\nCode:\n```py\n", self.code, "\n```\n", "Trailing text"]:
+                    yield ChatMessageStreamDelta(content=chunk)
+
+        model = CascadeModel(
+            [StreamingCodeModel("result = 1 / 0"), StreamingCodeModel("final_answer(7.2904)")], exploration_rate=0
+        )
+        agent = CodeAgent(tools=[], model=model, stream_outputs=True, max_steps=3)
+        assert agent.run("What is 2 multiplied by 3.6452?") == 7.2904
+        assert isinstance(agent.memory.steps[1].error, AgentExecutionError)
+        stats = model.get_stats()
+        assert (stats[0]["calls"], stats[0]["failures"]) == (1, 1)
+        assert (stats[1]["calls"], stats[1]["failures"]) == (1, 0)
+
+    def test_run_agents_in_lockstep_batches_model_calls(self):
+        class BatchingModel(FakeCodeModel):
+            def __init__(self):
+                super().__init__()
+                self.batch_sizes = []
+
+            def generate(self, messages, stop_sequences=None, **kwargs):
+                return super().generate(messages, stop_sequences)
+
+            def generate_batch(self, messages_batch, **kwargs):
+                self.batch_sizes.append(len(messages_batch))
+                return super().generate_batch(messages_batch, **kwargs)
+
+        model = BatchingModel()
+        agents = [CodeAgent(tools=[], model=model, max_steps=3, stream_outputs=False) for _ in range(3)]
+        tasks = [f"Task {index}: what is 2 multiplied by 3.6452?" for index in range(3)]
+        assert run_agents_in_lockstep(agents, tasks) == [7.2904] * 3
+        # Each of the two steps of the three agents is answered by one batched call
+        assert model.batch_sizes == [3, 3]
+        assert all(agent.model is model for agent in agents)
+
+    def test_run_agents_in_lockstep_needs_one_task_per_agent(self):
+        agent = CodeAgent(tools=[], model=FakeCodeModel())
+        with pytest.raises(ValueError, match="one task per agent"):
+            run_agents_in_lockstep([agent], ["task 1", "task 2"])
+        with pytest.raises(ValueError, match="distinct agent objects"):
+            run_agents_in_lockstep([agent, agent], ["task 1", "task 2"])
+
     @pytest.mark.parametrize(
         "tools, managed_agents, name, expectation",
         [
@@ -1232,6 +1412,68 @@ class TestToolCallingAgent:
         # The agent should return the first final_answer result
         assert result == "output1"
 
+    def test_toolcalling_agent_stream_outputs_sets_up_tool_during_generation(self):
+        setup_started = threading.Event()
+        setup_calls = []
+
+        class SlowSetupTool(Tool):
+            name = "weather_api"
+            description = "Gets the weather."
+            inputs = {"location": {"type": "string", "description": "The location."}}
+            output_type = "string"
+
+            def setup(self):
+                setup_calls.append(threading.current_thread().name)
+                setup_started.set()
+                time.sleep(0.05)
+                self.is_initialized = True
+
+            def forward(self, location):
+                return f"Sunny in {location}"
+
+        class FakeStreamingModel(Model):
+            def generate_stream(self, messages, stop_sequences=None, **kwargs):
+                if len(messages) > 2:
+                    chunks = ['{"name": "final_answer", "arguments": {"answer": "sunny"}}']
+                else:
+                    chunks = ['Action:\n{"name": "weather', '_api", "arguments": {"locat', 'ion": "Paris"}}']
+                for chunk in chunks:
+                    if chunk.startswith("ion"):
+                        # The tool is set up while the model is still generating its arguments
+                        assert setup_started.wait(timeout=5)
+                    yield ChatMessageStreamDelta(content=chunk)
+
+        agent = ToolCallingAgent(tools=[SlowSetupTool()], model=FakeStreamingModel(), stream_outputs=True)
+        assert agent.run("What's the weather in Paris?") == "sunny"
+        assert agent.memory.steps[1].observations == "Sunny in Paris"
+        assert len(setup_calls) == 1 and setup_calls[0].startswith("smolagents-tool")
+        assert agent._tool_setups == {}
+
+    def test_toolcalling_agent_failed_tool_setup_is_forgotten(self):
+        release_setup = threading.Event()
+
+        class FailingSetupTool(Tool):
+            name = "weather_api"
+            description = "Gets the weather."
+            inputs = {"location": {"type": "string", "description": "The location."}}
+            output_type = "string"
+
+            def setup(self):
+                release_setup.wait(timeout=5)
+                raise RuntimeError("Weather service unreachable")
+
+            def forward(self, location):
+                return f"Sunny in {location}"
+
+        agent = ToolCallingAgent(tools=[FailingSetupTool()], model=MagicMock())
+        agent._prepare_tool("weather_api")
+        setup_future = agent._tool_setups["weather_api"]
+        release_setup.set()
+        # Waiting for the pool also waits for the done callbacks of its futures
+        agent.tool_executor.shutdown(wait=True)
+        assert isinstance(setup_future.exception(), RuntimeError)
+        assert agent._tool_setups == {}
+
     @patch("huggingface_hub.InferenceClient")
     def test_toolcalling_agent_api_misformatted_output(self, mock_inference_client):
         """Test that even misformatted json blobs don't interrupt the run for a ToolCallingAgent."""
@@ -1342,7 +1584,7 @@ class TestToolCallingAgent:
                     ),
                 ],
                 "expected_model_output": "Called Tool: 'test_tool' with arguments: {'input': 'value1'}\nCalled Tool: 'test_tool' with arguments: {'input': 'value2'}",
-                "expected_observations": "Processed: value1\nProcessed: value2",
+                "expected_observations": "Call id: call_1\nProcessed: value1\nCall id: call_2\nProcessed: value2",
                 "expected_final_outputs": [None, None],
                 "expected_error": None,
             },
@@ -1429,6 +1671,126 @@ class TestToolCallingAgent:
                     for tool_call in test_case["tool_calls"]
                 ]
 
+    def test_process_tool_calls_keeps_tool_call_order(self):
+        @tool
+        def slow_tool(delay: float) -> str:
+            """Sleeps then returns the delay.
+
+            Args:
+                delay: Seconds to sleep.
+            """
+            time.sleep(delay)
+            return f"slept {delay}"
+
+        agent = ToolCallingAgent(tools=[slow_tool], model=MagicMock())
+        chat_message = ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content="",
+            tool_calls=[
+                ChatMessageToolCall(
+                    id=f"call_{i}",
+                    type="function",
+                    function=ChatMessageToolCallDefinition(name="slow_tool", arguments={"delay": delay}),
+                )
+                for i, delay in enumerate([0.2, 0.0])
+            ],
+        )
+        memory_step = ActionStep(step_number=1, timing="mock_timing")
+        list(agent.process_tool_calls(chat_message, memory_step))
+        # The second call finishes first, but observations follow tool call order
+        assert memory_step.observations == "Call id: call_0\nslept 0.2\nCall id: call_1\nslept 0.0"
+
+        # The pool is reused across steps
+        executor = agent.tool_executor
+        list(agent.process_tool_calls(chat_message, ActionStep(step_number=2, timing="mock_timing")))
+        assert agent.tool_executor is executor
+
+    def test_shared_tool_executor_and_concurrency_limits(self):
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        @tool
+        def limited_tool(value: str) -> str:
+            """Records how many calls run at the same time.
+
+            Args:
+                value: Any value.
+            """
+            with lock:
+                running["current"] += 1
+                running["max"] = max(running["max"], running["current"])
+            time.sleep(0.05)
+            with lock:
+                running["current"] -= 1
+            return value
+
+        with ThreadPoolExecutor(4) as executor:
+            agents = [
+                ToolCallingAgent(
+                    tools=[limited_tool],
+                    model=MagicMock(),
+                    tool_executor=executor,
+                    tool_concurrency_limits={"limited_tool": 1},
+                )
+                for _ in range(2)
+            ]
+            assert all(agent.tool_executor is executor for agent in agents)
+            chat_message = ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content="",
+                tool_calls=[
+                    ChatMessageToolCall(
+                        id=f"call_{i}",
+                        type="function",
+                        function=ChatMessageToolCallDefinition(name="limited_tool", arguments={"value": str(i)}),
+                    )
+                    for i in range(4)
+                ],
+            )
+            # Both agents run their tool calls at the same time: the limit holds across them
+            with ThreadPoolExecutor(2) as agent_runner:
+                runs = [
+                    agent_runner.submit(
+                        lambda agent: list(
+                            agent.process_tool_calls(chat_message, ActionStep(step_number=1, timing="mock_timing"))
+                        ),
+                        agent,
+                    )
+                    for agent in agents
+                ]
+                for run in runs:
+                    run.result()
+            # A shared pool is not shut down by the agents
+            agents[0].cleanup()
+            assert executor.submit(lambda: 1).result() == 1
+            with pytest.raises(ValueError, match="another agent sharing the same tool_executor limits it to 1"):
+                ToolCallingAgent(
+                    tools=[limited_tool],
+                    model=MagicMock(),
+                    tool_executor=executor,
+                    tool_concurrency_limits={"limited_tool": 3},
+                )
+        assert running["max"] == 1
+
+    def test_tool_executor_is_shut_down_after_run(self):
+        model = MagicMock()
+        model.generate.return_value = ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content="",
+            tool_calls=[
+                ChatMessageToolCall(
+                    id="call_0",
+                    type="function",
+                    function=ChatMessageToolCallDefinition(name="final_answer", arguments={"answer": "done"}),
+                )
+            ],
+        )
+        agent = ToolCallingAgent(tools=[], model=model)
+        executor = agent.tool_executor
+        assert agent.run("Finish.") == "done"
+        assert executor._shutdown
+        assert agent.tool_executor is not executor
+
 
 class TestCodeAgent:
     @pytest.mark.filterwarnings("ignore")  # Ignore FutureWarning for deprecated grammar parameter
@@ -1576,6 +1938,34 @@ class TestCodeAgent:
         answer = agent.run("Fake task.")
         assert answer == "2CUSTOM"
 
+    def test_stream_outputs_stops_at_closing_code_fence(self):
+        consumed_chunks = []
+
+        class FakeStreamingCodeModel(Model):
+            def generate_stream(self, messages, stop_sequences=None, **kwargs):
+                for chunk in [
+                    "Thought: compute\nCode:\n```py\nresult = 2 * 3",
+                    "\nfinal_answer(result)\n`",
+                    "``\n",
+                    "Trailing",
+                    " text",
+                ]:
+                    consumed_chunks.append(chunk)
+                    yield ChatMessageStreamDelta(
+                        content=chunk, token_usage=TokenUsage(input_tokens=10, output_tokens=1)
+                    )
+
+        agent = CodeAgent(tools=[], model=FakeStreamingCodeModel(), stream_outputs=True, max_steps=1)
+        assert agent.run("Compute 2 * 3") == 6
+        # Generation is cancelled as soon as the code block is complete
+        assert consumed_chunks[-1] == "``\n"
+        action_step = agent.memory.steps[1]
+        assert (
+            action_step.model_output
+            == "Thought: compute\nCode:\n```py\nresult = 2 * 3\nfinal_answer(result)\n```<end_code>"
+        )
+        assert action_step.token_usage.output_tokens == 3
+
     def test_local_python_executor_with_custom_functions(self):
         model = MagicMock()
         model.generate.return_value = ChatMessage(
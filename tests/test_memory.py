@@ -1,18 +1,30 @@
+import threading
+from unittest.mock import MagicMock
+
 import pytest
 
 from smolagents.agents import ToolCall
 from smolagents.memory import (
     ActionStep,
     AgentMemory,
+    CallbackEvent,
+    CallbackRegistry,
     ChatMessage,
+    CompositeMemoryPolicy,
+    DropImagesPolicy,
+    KeepErrorsPolicy,
     MemoryStep,
     Message,
+    MessageLog,
     MessageRole,
     PlanningStep,
+    SlidingWindowPolicy,
+    SummarizePolicy,
     SystemPromptStep,
     TaskStep,
 )
 from smolagents.monitoring import Timing, TokenUsage
+from smolagents.utils import AgentError
 
 
 class TestAgentMemory:
@@ -234,3 +246,224 @@ def test_system_prompt_step_to_messages():
             assert isinstance(content, dict)
             assert "type" in content
             assert "text" in content
+
+
+class TestMessageLog:
+    @staticmethod
+    def make_message(text):
+        return Message(role=MessageRole.USER, content=[{"type": "text", "text": text}])
+
+    def test_record_appends_only_new_messages(self):
+        log = MessageLog()
+        first = log.record([self.make_message("system"), self.make_message("task")])
+        second = log.record([self.make_message("system"), self.make_message("task"), self.make_message("step 1")])
+        assert len(log.messages) == 3
+        assert second.ranges == ((0, 3),)
+        assert list(first) == log.messages[:2]
+        assert second[-1] == self.make_message("step 1")
+        assert second[1:] == [self.make_message("task"), self.make_message("step 1")]
+
+    def test_record_diverging_messages(self):
+        log = MessageLog()
+        log.record([self.make_message("system"), self.make_message("task")])
+        back = log.record([self.make_message("other system"), self.make_message("task")])
+        assert back.ranges == ((2, 4),)
+        assert back.dict() == {"message_log_ranges": [[2, 4]]}
+
+    def test_record_interleaved_planning_prompts(self):
+        log = MessageLog()
+        action_messages = [self.make_message("system"), self.make_message("task")]
+        log.record(action_messages)
+        for step_number in range(1, 4):
+            planning_messages = [self.make_message("plan system"), self.make_message(f"facts {step_number}")]
+            assert list(log.record(planning_messages, kind="planning")) == planning_messages
+            action_messages = action_messages + [self.make_message(f"plan {step_number}")]
+            action = log.record(action_messages)
+            assert list(action) == action_messages
+            action_messages = action_messages + [self.make_message(f"step {step_number}")]
+            log.record(action_messages)
+        # The action history is not copied again after each planning prompt
+        action_texts = [message["content"][0]["text"] for message in log.messages]
+        assert action_texts.count("step 1") == 1
+        assert action_texts.count("plan 1") == 1
+        assert action == action_messages[:-1]
+
+    def test_memory_steps_export_messages_once(self):
+        memory = AgentMemory(system_prompt="system")
+        messages = [self.make_message("system")]
+        for step_number in range(1, 11):
+            messages = messages + [self.make_message(f"step {step_number}")]
+            memory.steps.append(
+                ActionStep(
+                    step_number=step_number,
+                    timing=Timing(start_time=0.0),
+                    model_input_messages=memory.message_log.record(messages),
+                )
+            )
+        assert len(memory.get_message_log()) == 11
+        assert memory.get_full_steps()[-1]["model_input_messages"] == {"message_log_ranges": [[0, 11]]}
+        assert list(memory.steps[4].model_input_messages) == messages[:6]
+
+
+class TestMemoryPolicy:
+    @staticmethod
+    def make_memory(policy, n_steps=5, error_step=None, image=None):
+        memory = AgentMemory(system_prompt="System prompt.", policy=policy)
+        memory.steps.append(TaskStep(task="Task."))
+        for step_number in range(1, n_steps + 1):
+            memory.steps.append(
+                ActionStep(
+                    step_number=step_number,
+                    timing=Timing(start_time=0.0),
+                    model_output=f"Output {step_number}. " + "x" * 400,
+                    observations=f"Observation {step_number}.",
+                    observations_images=[image] if image is not None else None,
+                    error=AgentError(f"Error {step_number}.", MagicMock()) if step_number == error_step else None,
+                )
+            )
+        return memory
+
+    @staticmethod
+    def texts(messages):
+        return [item["text"] for message in messages for item in message["content"] if item["type"] == "text"]
+
+    def test_no_compaction_within_budget(self):
+        memory = self.make_memory(SlidingWindowPolicy(max_tokens=100_000))
+        assert memory.write_to_messages() == self.make_memory(None).write_to_messages()
+        assert memory.last_compaction is None
+
+    def test_sliding_window(self):
+        memory = self.make_memory(SlidingWindowPolicy(max_tokens=300))
+        texts = self.texts(memory.write_to_messages())
+        assert texts[:2] == ["System prompt.", "New task:\nTask."]
+        assert not any("Output 1." in text for text in texts)
+        assert any("Output 5." in text for text in texts)
+        compaction = memory.last_compaction
+        assert compaction.dropped_steps == [1, 2, 3]
+        assert compaction.tokens_after <= 300 < compaction.tokens_before
+
+    def test_keep_errors(self):
+        memory = self.make_memory(KeepErrorsPolicy(max_tokens=300), error_step=2)
+        texts = self.texts(memory.write_to_messages())
+        assert "Error:\nError 2." in texts
+        assert not any("Output 2." in text for text in texts)
+        assert any("Observation 5." in text for text in texts)
+        assert memory.last_compaction.dropped_steps[:2] == [1, 2]
+
+    def test_drop_images_then_sliding_window(self):
+        policy = CompositeMemoryPolicy([DropImagesPolicy(), SlidingWindowPolicy()], max_tokens=2_000)
+        memory = self.make_memory(policy, image="image")
+        messages = memory.write_to_messages()
+        images = [item for message in messages for item in message["content"] if item["type"] == "image"]
+        assert len(images) == 1
+        assert memory.last_compaction.dropped_images == 4
+        assert memory.last_compaction.dropped_steps == []
+        memory.policy.max_tokens = 300
+        memory.write_to_messages()
+        assert memory.last_compaction.dropped_steps == [1, 2, 3, 4]
+
+    def test_composite_does_not_change_given_policies(self):
+        def token_counter(messages):
+            return 100 * len(messages)
+
+        drop_images = DropImagesPolicy()
+        policy = CompositeMemoryPolicy(
+            [drop_images, SlidingWindowPolicy()], max_tokens=300, token_counter=token_counter
+        )
+        memory = self.make_memory(policy)
+        memory.write_to_messages()
+        assert drop_images.token_counter is None
+        assert all(child.token_counter is None for child in policy.policies)
+        # 100 tokens per message: only the system prompt, the task and the two messages of the last step are kept
+        assert memory.last_compaction.dropped_steps == [1, 2, 3, 4]
+        assert memory.last_token_count == 400
+
+    def test_shared_policy_uses_the_token_counter_of_each_memory(self):
+        policy = SlidingWindowPolicy(max_tokens=1_000)
+        memory = self.make_memory(policy)
+        memory.token_counter = lambda messages: 100 * len(messages)
+        other_memory = self.make_memory(policy)
+        other_memory.token_counter = lambda messages: len(messages)
+        memory.write_to_messages()
+        other_memory.write_to_messages()
+        assert policy.token_counter is None
+        assert memory.last_compaction is not None and other_memory.last_compaction is None
+        assert other_memory.last_token_count == 12
+
+    def test_summarize_reuses_cached_summary(self):
+        model = MagicMock()
+        model.generate.return_value = ChatMessage(role=MessageRole.ASSISTANT, content="Summary.")
+        memory = self.make_memory(SummarizePolicy(model, max_summary_tokens=20, max_tokens=300))
+        texts = self.texts(memory.write_to_messages())
+        assert "Summary of previous steps:\nSummary." in texts
+        assert memory.last_compaction.summarized_steps == [1, 2, 3]
+        memory.write_to_messages()
+        assert model.generate.call_count == 1
+
+
+class TestCallbackRegistry:
+    def test_dispatch_filters_events_and_step_types(self):
+        calls = []
+        registry = CallbackRegistry()
+        registry.register(lambda step: calls.append(("any step", step.step_number)))
+        registry.register(lambda step: calls.append("planning"), step_type=PlanningStep)
+        registry.register(lambda step: calls.append("start"), CallbackEvent.STEP_START)
+        registry.dispatch(CallbackEvent.STEP_END, ActionStep(step_number=1, timing=Timing(start_time=0.0)))
+        assert calls == [("any step", 1)]
+
+    def test_dispatch_passes_accepted_kwargs_only(self):
+        calls = []
+        registry = CallbackRegistry()
+        registry.register(lambda step: calls.append("step only"), CallbackEvent.TOOL_RESULT)
+        registry.register(lambda step, agent: calls.append(agent), CallbackEvent.TOOL_RESULT)
+        registry.register(lambda step, **kwargs: calls.append(sorted(kwargs)), CallbackEvent.TOOL_RESULT)
+        step = ActionStep(step_number=1, timing=Timing(start_time=0.0))
+        registry.dispatch(CallbackEvent.TOOL_RESULT, step, agent="agent", tool_call=None, tool_output="output")
+        assert calls == ["step only", "agent", ["agent", "tool_call", "tool_output"]]
+
+    def test_copy_is_independent(self):
+        calls = []
+        registry = CallbackRegistry()
+        registry.append(lambda step: calls.append("shared"))
+        copy = registry.copy()
+        copy.append(lambda step: calls.append("copy only"))
+        registry.dispatch(CallbackEvent.STEP_END, ActionStep(step_number=1, timing=Timing(start_time=0.0)))
+        assert calls == ["shared"]
+        copy.dispatch(CallbackEvent.STEP_END, ActionStep(step_number=1, timing=Timing(start_time=0.0)))
+        assert calls == ["shared", "shared", "copy only"]
+
+    def test_append_registers_action_step_end(self):
+        calls = []
+        registry = CallbackRegistry()
+        registry.append(lambda step: calls.append(type(step).__name__))
+        registry.dispatch(CallbackEvent.STEP_END, TaskStep(task="task"))
+        registry.dispatch(CallbackEvent.STEP_END, ActionStep(step_number=1, timing=Timing(start_time=0.0)))
+        assert calls == ["ActionStep"]
+        assert len(registry) == 1
+
+    def test_async_callbacks_run_in_background(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_callback(step):
+            release.wait(timeout=5)
+            calls.append(step.step_number)
+
+        registry = CallbackRegistry()
+        registry.register(slow_callback, run_async=True)
+        for step_number in range(3):
+            registry.dispatch(CallbackEvent.STEP_END, ActionStep(step_number=step_number, timing=Timing(start_time=0)))
+        assert calls == []
+        release.set()
+        registry.wait()
+        assert calls == [0, 1, 2]
+
+    def test_async_callback_errors_are_logged(self, caplog):
+        def failing_callback(step):
+            raise ValueError("callback error")
+
+        registry = CallbackRegistry()
+        registry.register(failing_callback, run_async=True)
+        registry.dispatch(CallbackEvent.STEP_END, TaskStep(task="task"))
+        registry.wait()
+        assert "Asynchronous step callback failed" in caplog.text
@@ -14,19 +14,30 @@
 # limitations under the License.
 import json
 import sys
+import threading
+import time
 import unittest
 from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
 
 import pytest
 from huggingface_hub import ChatCompletionOutputMessage
 
 from smolagents.default_tools import FinalAnswerTool
+from smolagents.memory import ActionStep
 from smolagents.models import (
     AmazonBedrockServerModel,
     AzureOpenAIServerModel,
+    CachedModel,
+    CascadeModel,
     ChatMessage,
+    ChatMessageStreamDelta,
     ChatMessageToolCall,
+    ChatMessageToolCallDefinition,
+    ClientRegistry,
+    HedgedModel,
+    HeuristicTokenCounter,
     HfApiModel,
     InferenceClientModel,
     LiteLLMModel,
@@ -35,14 +46,27 @@ from smolagents.models import (
     MLXModel,
     Model,
     OpenAIServerModel,
+    RateLimiter,
+    StopSequenceMatcher,
+    StreamingToolCallParser,
+    TokenizerTokenCounter,
+    TokenUsage,
+    ToolCallStreamAccumulator,
+    ToolCallStreamDelta,
     TransformersModel,
+    _GenerationBatcher,
+    _GenerationRequest,
+    _PrefixKVCache,
     get_clean_message_list,
     get_tool_call_from_text,
     get_tool_json_schema,
     parse_json_if_needed,
+    remove_stop_sequences,
     supports_stop_parameter,
 )
+from smolagents.monitoring import AgentLogger, LogLevel, Timing
 from smolagents.tools import tool
+from smolagents.utils import AgentParsingError
 
 from .utils.markers import require_run_all
 
@@ -213,6 +237,524 @@ class TestModel:
         assert parsed_args == 3
 
 
+class TestTokenCounter:
+    messages = [
+        {"role": MessageRole.SYSTEM, "content": [{"type": "text", "text": "a" * 40}]},
+        {"role": MessageRole.TOOL_RESPONSE, "content": [{"type": "text", "text": "b" * 20}, {"type": "image"}]},
+        ChatMessage(role=MessageRole.ASSISTANT, content="c" * 8),
+    ]
+
+    def test_heuristic_token_counter(self):
+        counter = HeuristicTokenCounter(tokens_per_message=1, tokens_per_image=100)
+        assert counter(self.messages) == (1 + 10) + (1 + 5 + 100) + (1 + 2)
+
+    def test_tokenizer_token_counter_applies_chat_template(self):
+        tokenizer = MagicMock()
+        tokenizer.apply_chat_template.return_value = list(range(50))
+        counter = TokenizerTokenCounter(tokenizer, tokens_per_image=100)
+        assert counter(self.messages) == 150
+        text_messages = tokenizer.apply_chat_template.call_args.args[0]
+        assert text_messages[1] == {"role": MessageRole.USER, "content": "b" * 20}
+
+    def test_tokenizer_token_counter_without_chat_template(self):
+        tokenizer = MagicMock(chat_template=None)
+        tokenizer.encode.side_effect = lambda text, add_special_tokens: text
+        counter = TokenizerTokenCounter(tokenizer, tokens_per_message=0, tokens_per_image=0)
+        assert counter(self.messages) == 68
+
+    def test_model_count_tokens_includes_tools(self):
+        model = Model(token_counter=HeuristicTokenCounter())
+        tokens_without_tools = model.count_tokens(self.messages)
+        assert model.count_tokens(self.messages, tools_to_call_from=[FinalAnswerTool()]) > tokens_without_tools
+        assert "token_counter" not in model.kwargs
+
+
+class CountingModel(Model):
+    def __init__(self, **kwargs):
+        super().__init__(model_id="counting-model", **kwargs)
+        self.calls = 0
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        self.calls += 1
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=f"Answer {self.calls}",
+            raw=object(),
+            token_usage=TokenUsage(input_tokens=10, output_tokens=5),
+        )
+
+    def generate_stream(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        self.calls += 1
+        for token in ["Ans", "wer ", str(self.calls)]:
+            yield ChatMessageStreamDelta(content=token)
+        yield ChatMessageStreamDelta(content="", token_usage=TokenUsage(input_tokens=10, output_tokens=3))
+
+
+class TestCachedModel:
+    messages = [{"role": MessageRole.USER, "content": [{"type": "text", "text": "Hello"}]}]
+
+    def test_cache_hit_skips_wrapped_model(self, tmp_path):
+        model = CountingModel()
+        cached_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite")
+        first = cached_model.generate(self.messages, stop_sequences=["Observation:"])
+        second = cached_model.generate(self.messages, stop_sequences=["Observation:"])
+        assert model.calls == 1
+        assert (second.content, second.token_usage) == (first.content, first.token_usage)
+        assert (cached_model.hits, cached_model.misses) == (1, 1)
+        # The cache persists across instances
+        assert CachedModel(model, cache_path=tmp_path / "cache.sqlite").generate(self.messages, ["Observation:"])
+        assert model.calls == 1
+
+    @pytest.mark.parametrize(
+        "call_kwargs",
+        [{"stop_sequences": ["Other stop"]}, {"temperature": 0.5}, {"tools_to_call_from": [FinalAnswerTool()]}],
+    )
+    def test_cache_key_covers_call_arguments(self, tmp_path, call_kwargs):
+        model = CountingModel()
+        cached_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite")
+        cached_model.generate(self.messages)
+        cached_model.generate(self.messages, **call_kwargs)
+        assert model.calls == 2
+
+    def test_modes(self, tmp_path):
+        model = CountingModel()
+        CachedModel(model, cache_path=tmp_path / "read_only.sqlite", mode="read_only").generate(self.messages)
+        CachedModel(model, cache_path=tmp_path / "read_only.sqlite", mode="read_only").generate(self.messages)
+        assert model.calls == 2
+        refreshing_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite", mode="refresh")
+        refreshing_model.generate(self.messages)
+        refreshed = refreshing_model.generate(self.messages)
+        assert model.calls == 4
+        assert CachedModel(model, cache_path=tmp_path / "cache.sqlite").generate(self.messages).content == "Answer 4"
+        assert refreshed.content == "Answer 4"
+        with pytest.raises(ValueError, match="Invalid cache mode"):
+            CachedModel(model, cache_path=tmp_path / "cache.sqlite", mode="write_only")
+
+    def test_stream_replay(self, tmp_path):
+        model = CountingModel()
+        cached_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite")
+        recorded = list(cached_model.generate_stream(self.messages))
+        replayed = list(cached_model.generate_stream(self.messages))
+        assert model.calls == 1
+        assert replayed == recorded
+        assert replayed[-1].token_usage.output_tokens == 3
+
+    def test_stream_closed_early_is_not_cached(self, tmp_path):
+        model = CountingModel()
+        cached_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite")
+        stream = cached_model.generate_stream(self.messages, stop_sequences=["wer"])
+        assert next(stream).content == "Ans"
+        stream.close()
+        replayed = list(cached_model.generate_stream(self.messages, stop_sequences=["wer"]))
+        assert len(replayed) > 1
+        assert model.calls == 2
+
+    def test_stream_closed_early_is_replayed_up_to_the_same_delta(self, tmp_path):
+        model = CountingModel()
+        cached_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite", cache_incomplete_streams=True)
+        stream = cached_model.generate_stream(self.messages, stop_sequences=["wer"])
+        assert next(stream).content == "Ans"
+        stream.close()
+        assert [delta.content for delta in cached_model.generate_stream(self.messages, stop_sequences=["wer"])] == [
+            "Ans"
+        ]
+        assert model.calls == 1
+
+    def test_streaming_only_exposed_if_wrapped_model_streams(self, tmp_path):
+        model = CountingModel()
+        assert hasattr(CachedModel(model, cache_path=tmp_path / "cache.sqlite"), "generate_stream")
+        assert not hasattr(CachedModel(Model(), cache_path=tmp_path / "cache.sqlite"), "generate_stream")
+
+    def test_size_based_eviction(self, tmp_path):
+        model = CountingModel()
+        cached_model = CachedModel(model, cache_path=tmp_path / "cache.sqlite", max_size_bytes=500)
+        for index in range(10):
+            cached_model.generate(self.messages, temperature=index / 10)
+        (total_size,) = cached_model._connection.execute("SELECT SUM(size) FROM responses").fetchone()
+        assert total_size <= 500
+        # The least recently used responses are evicted first
+        cached_model.generate(self.messages, temperature=0.9)
+        assert model.calls == 10
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = MagicMock(status_code=status_code, headers=headers or {})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock():
+    clock = FakeClock()
+    with (
+        patch("smolagents.models.time.monotonic", clock.monotonic),
+        patch("smolagents.models.time.sleep", clock.sleep),
+    ):
+        yield clock
+
+
+class TestRateLimiter:
+    def test_request_and_token_buckets(self, fake_clock):
+        rate_limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=1000)
+        rate_limiter.acquire(tokens=100)
+        rate_limiter.acquire(tokens=100)
+        assert fake_clock.sleeps == []
+        rate_limiter.acquire(tokens=100)
+        assert fake_clock.now == pytest.approx(30)
+        # 800 tokens left after 30s of refill, capped at the bucket size: 1000 tokens need 12 more seconds
+        rate_limiter.acquire(tokens=1000)
+        assert fake_clock.now == pytest.approx(60)
+
+    def test_retry_honours_retry_after(self, fake_clock):
+        api_call = MagicMock(side_effect=[FakeAPIError(429, {"retry-after": "7"}), FakeAPIError(503), "response"])
+        rate_limiter = RateLimiter(base_delay=1.0)
+        assert rate_limiter.call(api_call) == "response"
+        assert api_call.call_count == 3
+        assert fake_clock.sleeps[0] == 7
+        assert 0 <= fake_clock.sleeps[1] <= 2
+        assert rate_limiter.total_retries == 2
+
+    def test_retry_after_longer_than_max_delay(self, fake_clock):
+        api_call = MagicMock(side_effect=[FakeAPIError(429, {"retry-after": "120"}), "response"])
+        assert RateLimiter(max_delay=60.0).call(api_call) == "response"
+        assert fake_clock.sleeps == [120]
+
+    def test_no_retry_on_client_errors(self, fake_clock):
+        api_call = MagicMock(side_effect=FakeAPIError(400))
+        with pytest.raises(FakeAPIError):
+            RateLimiter().call(api_call)
+        assert api_call.call_count == 1
+
+    def test_gives_up_after_max_retries(self, fake_clock):
+        api_call = MagicMock(side_effect=FakeAPIError(429))
+        with pytest.raises(FakeAPIError):
+            RateLimiter(max_retries=2).call(api_call)
+        assert api_call.call_count == 3
+
+    def test_concurrency_cap(self):
+        rate_limiter = RateLimiter(max_concurrent_requests=2)
+        in_flight, max_in_flight = 0, 0
+        lock = threading.Lock()
+
+        def api_call():
+            nonlocal in_flight, max_in_flight
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+
+        threads = [threading.Thread(target=rate_limiter.call, args=(api_call,)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert max_in_flight == 2
+
+    def test_api_model_retries_rate_limited_calls(self, fake_clock):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = [
+            FakeAPIError(429, {"retry-after-ms": "1500"}),
+            MagicMock(
+                choices=[
+                    MagicMock(message=MagicMock(model_dump=lambda include: {"role": "assistant", "content": "Hi"}))
+                ],
+                usage=MagicMock(prompt_tokens=10, completion_tokens=2),
+            ),
+        ]
+        rate_limiter = RateLimiter(tokens_per_minute=100_000)
+        model = OpenAIServerModel(model_id="gpt-4o", client=client, rate_limiter=rate_limiter, max_tokens=1000)
+        messages = [{"role": MessageRole.USER, "content": [{"type": "text", "text": "Hello"}]}]
+        assert model.generate(messages).content == "Hi"
+        assert fake_clock.sleeps[0] == 1.5
+        # Requests count their input tokens and maximum output tokens
+        assert rate_limiter._available_tokens < 100_000 - 1000
+
+
+class TestClientRegistry:
+    def test_models_share_clients_per_api_and_credentials(self):
+        registry = ClientRegistry()
+        model = OpenAIServerModel(model_id="gpt-4o", api_key="key-1", client_registry=registry)
+        same_api_model = OpenAIServerModel(model_id="gpt-4o-mini", api_key="key-1", client_registry=registry)
+        other_key_model = OpenAIServerModel(model_id="gpt-4o", api_key="key-2", client_registry=registry)
+        other_url_model = OpenAIServerModel(
+            model_id="gpt-4o", api_key="key-1", api_base="http://localhost:8000/v1", client_registry=registry
+        )
+        assert model.client is same_api_model.client
+        assert model.client is not other_key_model.client
+        assert model.client is not other_url_model.client
+        assert not any("key-1" in repr(key) for key in registry._clients)
+        # Without a registry, each model has its own client
+        assert OpenAIServerModel(model_id="gpt-4o", api_key="key-1").client is not model.client
+        registry.close()
+
+    def test_openai_client_uses_registry_settings(self):
+        registry = ClientRegistry(max_connections=4, timeout=30.0, connect_timeout=2.0)
+        model = OpenAIServerModel(model_id="gpt-4o", api_key="key", client_registry=registry)
+        assert model.client.timeout.read == 30.0
+        assert model.client.timeout.connect == 2.0
+        registry.close()
+
+    def test_inference_client_models_share_clients(self):
+        registry = ClientRegistry()
+        with patch("huggingface_hub.InferenceClient") as MockInferenceClient:
+            model = InferenceClientModel(model_id="test-model", token="token", client_registry=registry)
+            same_model = InferenceClientModel(model_id="test-model", token="token", client_registry=registry)
+        assert MockInferenceClient.call_count == 1
+        assert model.client is same_model.client
+
+    def test_connection_metrics(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        registry = ClientRegistry()
+        try:
+            http_client = registry.create_http_client()
+            for _ in range(3):
+                assert http_client.get(f"http://127.0.0.1:{server.server_port}/").text == "ok"
+        finally:
+            registry.close()
+            server.shutdown()
+        metrics = registry.connection_metrics()[f"127.0.0.1:{server.server_port}"]
+        assert metrics["requests"] == 3
+        assert metrics["connections_opened"] == 1
+        assert metrics["reused_connections"] == 2
+        assert metrics["tls_handshakes"] == 0
+        assert metrics["handshake_time"] > 0
+
+
+class DelayedModel(Model):
+    def __init__(self, name, delay=0.0, error=None, content=None):
+        super().__init__(model_id=name)
+        self.delay = delay
+        self.error = error
+        self.content = name if content is None else content
+        self.calls = 0
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=self.content,
+            token_usage=TokenUsage(input_tokens=100, output_tokens=10),
+        )
+
+    def generate_stream(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        for token in [self.model_id, " done"]:
+            yield ChatMessageStreamDelta(content=token)
+
+
+class TestHedgedModel:
+    messages = [{"role": MessageRole.USER, "content": [{"type": "text", "text": "Hello"}]}]
+
+    def test_fast_primary_is_not_hedged(self):
+        primary, backup = DelayedModel("primary"), DelayedModel("backup")
+        model = HedgedModel([primary, backup], initial_hedge_delay=1.0)
+        assert model.generate(self.messages).content == "primary"
+        assert (primary.calls, backup.calls) == (1, 0)
+        assert model.model_id == "primary"
+
+    def test_slow_primary_is_hedged(self):
+        primary, backup = DelayedModel("primary", delay=1.0), DelayedModel("backup")
+        model = HedgedModel([primary, backup], initial_hedge_delay=0.05)
+        assert model.generate(self.messages).content == "backup"
+        assert (primary.calls, backup.calls) == (1, 1)
+        stats = model.get_stats()
+        assert [(model_stats["requests"], model_stats["wins"]) for model_stats in stats] == [(1, 0), (1, 1)]
+        assert stats[1]["win_rate"] == 1.0
+        assert stats[1]["generate_latency_p50"] < 1.0
+
+    def test_failing_primary_falls_back_immediately(self):
+        primary = DelayedModel("primary", error=ValueError("Provider down"))
+        backup = DelayedModel("backup")
+        model = HedgedModel([primary, backup], initial_hedge_delay=10.0)
+        start_time = time.perf_counter()
+        assert model.generate(self.messages).content == "backup"
+        assert time.perf_counter() - start_time < 5.0
+        with pytest.raises(ValueError, match="Provider down"):
+            HedgedModel([primary, primary]).generate(self.messages)
+
+    def test_hedge_delay_uses_latency_percentile(self):
+        model = HedgedModel([DelayedModel("primary")], initial_hedge_delay=3.0, min_samples=10)
+        assert model.get_hedge_delay(0, "generate") == 3.0
+        for latency in range(1, 11):
+            model._record_latency(0, "generate", latency / 10)
+        assert model.get_hedge_delay(0, "generate") == pytest.approx(0.9)
+        assert model.get_hedge_delay(0, "generate_stream") == 3.0
+
+    def test_stream_keeps_first_model_to_produce_a_token(self):
+        primary, backup = DelayedModel("primary", delay=1.0), DelayedModel("backup")
+        model = HedgedModel([primary, backup], initial_hedge_delay=0.05)
+        assert "".join(delta.content for delta in model.generate_stream(self.messages)) == "backup done"
+        assert model.get_stats()[1]["generate_stream_latency_p50"] is not None
+
+    def test_losing_stream_is_closed_while_winner_streams(self):
+        closed = threading.Event()
+        produced = []
+
+        class FastStreamModel(DelayedModel):
+            def generate_stream(self, messages, **kwargs):
+                time.sleep(self.delay)
+                try:
+                    for index in range(100):
+                        produced.append(index)
+                        yield ChatMessageStreamDelta(content=str(index))
+                        time.sleep(0.01)
+                finally:
+                    closed.set()
+
+        class SlowStreamModel(DelayedModel):
+            def generate_stream(self, messages, **kwargs):
+                for token in ["backup", " is", " slow", " to", " finish"]:
+                    yield ChatMessageStreamDelta(content=token)
+                    time.sleep(0.2)
+
+        model = HedgedModel(
+            [FastStreamModel("primary", delay=0.3), SlowStreamModel("backup")], initial_hedge_delay=0.05
+        )
+        contents = []
+        for delta in model.generate_stream(self.messages):
+            contents.append(delta.content)
+            if len(contents) == 4:
+                # The primary produced its first token long ago: it must be closed before the backup ends
+                assert closed.wait(timeout=0.1)
+        assert "".join(contents) == "backup is slow to finish"
+        assert produced == [0]
+        # The first token latency of the losing primary is recorded as well
+        assert model.get_stats()[0]["generate_stream_latency_p50"] >= 0.3
+        model.close()
+
+    def test_generate_stream_requires_all_models_to_stream(self):
+        assert hasattr(HedgedModel([DelayedModel("primary"), CountingModel()]), "generate_stream")
+        assert not hasattr(HedgedModel([Model(model_id="no-stream")]), "generate_stream")
+
+
+class TestCascadeModel:
+    messages = [{"role": MessageRole.USER, "content": [{"type": "text", "text": "Hello"}]}]
+
+    def test_small_model_answers_when_usable(self):
+        small, large = DelayedModel("small"), DelayedModel("large")
+        model = CascadeModel([small, large], costs=[(1.0, 2.0), (10.0, 20.0)], exploration_rate=0)
+        assert model.generate(self.messages).content == "small"
+        assert (small.calls, large.calls) == (1, 0)
+        stats = model.get_stats()
+        assert stats[0]["calls"] == 1 and stats[0]["failures"] == 0
+        assert stats[0]["cost"] == pytest.approx((100 * 1.0 + 10 * 2.0) / 1_000_000)
+        assert stats[1]["cost"] == 0
+
+    @pytest.mark.parametrize(
+        "small, tools_to_call_from",
+        [
+            (DelayedModel("small", error=ValueError("Overloaded")), None),
+            (DelayedModel("small", content="  "), None),
+            (DelayedModel("small", content="I would call a tool here."), [FinalAnswerTool()]),
+        ],
+    )
+    def test_escalates_unusable_outputs(self, small, tools_to_call_from):
+        large = DelayedModel("large", content='{"name": "final_answer", "arguments": {"answer": "42"}}')
+        model = CascadeModel([small, large], exploration_rate=0)
+        chat_message = model.generate(self.messages, tools_to_call_from=tools_to_call_from)
+        assert chat_message.content == large.content
+        if tools_to_call_from:
+            assert chat_message.tool_calls[0].function.name == "final_answer"
+        assert [model_stats["failures"] for model_stats in model.get_stats()] == [1, 0]
+
+    def test_last_model_output_is_returned_even_if_unusable(self):
+        model = CascadeModel([DelayedModel("small", content=""), DelayedModel("large", content="")])
+        assert model.generate(self.messages).content == ""
+        with pytest.raises(ValueError, match="Overloaded"):
+            CascadeModel([DelayedModel("large", error=ValueError("Overloaded"))]).generate(self.messages)
+
+    def test_failed_step_escalates_next_call(self):
+        small, large = DelayedModel("small"), DelayedModel("large")
+        model = CascadeModel([small, large], exploration_rate=0)
+        model.generate(self.messages)
+        model.record_step_outcome(
+            ActionStep(
+                step_number=1, timing=Timing(start_time=0.0), error=AgentParsingError("Bad", AgentLogger(LogLevel.OFF))
+            )
+        )
+        assert model.generate(self.messages).content == "large"
+        model.record_step_outcome(ActionStep(step_number=2, timing=Timing(start_time=0.0)))
+        # Escalation only lasts one call
+        assert model.generate(self.messages).content == "small"
+        assert model.get_stats()[0]["failures"] == 1
+
+    def test_unreliable_model_is_skipped(self):
+        small, large = DelayedModel("small", content=""), DelayedModel("large")
+        model = CascadeModel([small, large], min_samples=3, min_success_rate=0.5, exploration_rate=0)
+        for _ in range(5):
+            assert model.generate(self.messages).content == "large"
+        assert small.calls == 3
+        assert model.get_success_rate(0) == 0.0
+        assert model.select_model() == 1
+        model.exploration_rate = 1.0
+        assert model.select_model() == 0
+
+    @pytest.mark.parametrize("optimize_for, small_latency, large_latency", [("cost", 1.0, 1.0), ("latency", 0.5, 1.0)])
+    def test_stats_change_selected_model(self, optimize_for, small_latency, large_latency):
+        model = CascadeModel(
+            [DelayedModel("small"), DelayedModel("large")],
+            costs=[(1.0, 1.0), (2.0, 2.0)],
+            min_success_rate=0.3,
+            min_samples=3,
+            exploration_rate=0,
+            optimize_for=optimize_for,
+        )
+        token_usage = TokenUsage(input_tokens=100, output_tokens=10)
+        for _ in range(3):
+            model._record_call(1, large_latency, token_usage, success=True)
+        for success in [True] * 9 + [False]:
+            model._record_call(0, small_latency, token_usage, success=success)
+        # A failed call of the small model also pays for the large one, which is rare enough to start with the small one
+        assert model.select_model() == 0
+        for _ in range(10):
+            model._record_call(0, small_latency, token_usage, success=False)
+        # Failing 55% of the time, the small model still meets min_success_rate but is worse than the large one
+        assert model.get_success_rate(0) == pytest.approx(0.45)
+        assert model.select_model() == 1
+        assert (
+            CascadeModel(model.models, min_success_rate=0.3, exploration_rate=0, optimize_for=None).select_model() == 0
+        )
+
+    def test_invalid_optimize_for(self):
+        with pytest.raises(ValueError, match="Invalid optimize_for"):
+            CascadeModel([DelayedModel("small")], optimize_for="quality")
+
+
 class TestInferenceClientModel:
     def test_call_with_custom_role_conversions(self):
         custom_role_conversions = {MessageRole.USER: MessageRole.SYSTEM}
@@ -315,6 +857,18 @@ class TestLiteLLMModel:
         model = LiteLLMModel(model_id="fal/llama-3.3-70b", flatten_messages_as_text=True)
         assert model.flatten_messages_as_text
 
+    def test_stream_closed_at_stop_sequence_estimates_usage(self):
+        def event(content):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=content))], usage=None)
+
+        model = LiteLLMModel(model_id="o3")
+        model.client = MagicMock()
+        model.client.completion.return_value = iter([event("Answer<end"), event("_code> and more")])
+        deltas = list(model.generate_stream([{"role": "user", "content": "Hi"}], stop_sequences=["<end_code>"]))
+        assert "".join(delta.content for delta in deltas) == "Answer"
+        assert "stop" not in model.client.completion.call_args.kwargs
+        assert deltas[-1].token_usage.input_tokens > 0 and deltas[-1].token_usage.output_tokens > 0
+
 
 class TestLiteLLMRouterModel:
     @pytest.mark.parametrize(
@@ -398,6 +952,85 @@ class TestOpenAIServerModel:
         assert args == '{"answer": "blob"}'
         assert args2 == '{"answer": "blob2"}'
 
+    def test_stream_yields_tool_call_deltas(self):
+        def event(tool_call_delta):
+            delta = MagicMock(content=None, tool_calls=[tool_call_delta])
+            return MagicMock(choices=[MagicMock(delta=delta)], usage=None)
+
+        function = MagicMock()
+        function.name, function.arguments = "final_answer", ""
+        first = MagicMock(index=0, id="call_1", type="function", function=function)
+        fragments = [MagicMock(index=0, id=None, type=None) for _ in range(2)]
+        for fragment, arguments in zip(fragments, ['{"answer"', ': "blob"}']):
+            fragment.function.name, fragment.function.arguments = None, arguments
+
+        with patch("openai.OpenAI"):
+            model = OpenAIServerModel(model_id="gpt-4o")
+        model.client.chat.completions.create.return_value = iter([event(first)] + [event(f) for f in fragments])
+        deltas = list(model.generate_stream([{"role": "user", "content": "Hi"}]))
+        assert [delta.tool_calls[0].function.arguments for delta in deltas] == ["", '{"answer"', ': "blob"}']
+        assert all(delta.content is None for delta in deltas)
+        accumulator = ToolCallStreamAccumulator()
+        for delta in deltas:
+            accumulator.add(delta.tool_calls)
+        assert accumulator.get_tool_calls()[0].function.arguments == {"answer": "blob"}
+        assert accumulator.get_tool_calls()[0].id == "call_1"
+
+    @pytest.mark.parametrize("model_id, sends_stop", [("gpt-4o", True), ("o4-mini", False)])
+    def test_stream_stops_at_stop_sequence(self, model_id, sends_stop):
+        def event(content=None, usage=None):
+            choices = [MagicMock(delta=MagicMock(content=content, tool_calls=None))] if content else []
+            return MagicMock(choices=choices, usage=usage)
+
+        with patch("openai.OpenAI"):
+            model = OpenAIServerModel(model_id=model_id)
+        model.client.chat.completions.create.return_value = iter(
+            [
+                event("Code: print(1)<end"),
+                event("_code>Observation: 1"),
+                event("more"),
+                event(usage=MagicMock(prompt_tokens=10, completion_tokens=7)),
+            ]
+        )
+        deltas = list(model.generate_stream([{"role": "user", "content": "Hi"}], stop_sequences=["<end_code>"]))
+        assert "".join(delta.content for delta in deltas) == "Code: print(1)"
+        assert ("stop" in model.client.chat.completions.create.call_args.kwargs) is sends_stop
+        # Streams closed at the stop sequence never get the usage of the provider: it is estimated instead
+        token_usages = [delta.token_usage for delta in deltas if delta.token_usage is not None]
+        assert len(token_usages) == 1
+        if sends_stop:
+            assert (token_usages[0].input_tokens, token_usages[0].output_tokens) == (10, 7)
+        else:
+            assert token_usages[0].input_tokens > 0 and token_usages[0].output_tokens > 0
+
+
+# Events of a `converse_stream` response of Amazon Bedrock, as recorded from the `stream` field
+BEDROCK_CONVERSE_STREAM_EVENTS = [
+    {"messageStart": {"role": "assistant"}},
+    {"contentBlockDelta": {"delta": {"text": "Thought: I will"}, "contentBlockIndex": 0}},
+    {"contentBlockDelta": {"delta": {"text": " answer.\nCode:\n```py\nfinal_answer(4)\n```"}, "contentBlockIndex": 0}},
+    {"contentBlockStop": {"contentBlockIndex": 0}},
+    {"messageStop": {"stopReason": "stop_sequence"}},
+    {
+        "metadata": {
+            "usage": {"inputTokens": 42, "outputTokens": 17, "totalTokens": 59},
+            "metrics": {"latencyMs": 512},
+        }
+    },
+]
+
+
+class StubBedrockClient:
+    """Replays recorded `converse_stream` events, recording the requests."""
+
+    def __init__(self, events: list[dict]):
+        self.events = events
+        self.requests = []
+
+    def converse_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}, "stream": iter(self.events)}
+
 
 class TestAmazonBedrockServerModel:
     def test_client_for_bedrock(self):
@@ -410,6 +1043,36 @@ class TestAmazonBedrockServerModel:
 
         assert model.client == MockBoto3.return_value
 
+    def test_generate_stream(self):
+        client = StubBedrockClient(BEDROCK_CONVERSE_STREAM_EVENTS)
+        model = AmazonBedrockServerModel(model_id="us.amazon.nova-pro-v1:0", client=client)
+        messages = [{"role": "user", "content": [{"type": "text", "text": "What is 2 + 2?"}]}]
+        deltas = list(model.generate_stream(messages))
+        assert [delta.content for delta in deltas] == [
+            "Thought: I will",
+            " answer.\nCode:\n```py\nfinal_answer(4)\n```",
+            "",
+        ]
+        assert deltas[-1].token_usage == TokenUsage(input_tokens=42, output_tokens=17)
+        assert (model._last_input_token_count, model._last_output_token_count) == (42, 17)
+        assert client.requests[0]["modelId"] == "us.amazon.nova-pro-v1:0"
+        assert client.requests[0]["messages"] == [{"role": "user", "content": [{"text": "What is 2 + 2?"}]}]
+
+    def test_stop_sequences_are_sent_in_inference_config(self):
+        client = StubBedrockClient(BEDROCK_CONVERSE_STREAM_EVENTS)
+        model = AmazonBedrockServerModel(
+            model_id="us.amazon.nova-pro-v1:0", client=client, inferenceConfig={"maxTokens": 100}
+        )
+        list(model.generate_stream([{"role": "user", "content": "Hi"}], stop_sequences=["<end_code>"]))
+        assert client.requests[0]["inferenceConfig"] == {"maxTokens": 100, "stopSequences": ["<end_code>"]}
+        # The inference configuration given at init is not modified
+        assert model.kwargs["inferenceConfig"] == {"maxTokens": 100}
+
+    def test_generate_stream_rejects_response_format(self):
+        model = AmazonBedrockServerModel(model_id="us.amazon.nova-pro-v1:0", client=StubBedrockClient([]))
+        with pytest.raises(ValueError, match="does not support response_format"):
+            list(model.generate_stream([{"role": "user", "content": "Hi"}], response_format={"type": "json_object"}))
+
 
 class TestAzureOpenAIServerModel:
     def test_client_kwargs_passed_correctly(self):
@@ -491,6 +1154,252 @@ class TestTransformersModel:
             assert mocks["transformers.AutoProcessor.from_pretrained"].call_args.kwargs == {"trust_remote_code": True}
 
 
+def test_generate_batch_defaults_to_sequential_calls():
+    class EchoModel(Model):
+        def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+            content = messages[-1]["content"]
+            return ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=f"{content} {stop_sequences}",
+                token_usage=TokenUsage(input_tokens=len(content), output_tokens=1),
+            )
+
+    outputs = EchoModel().generate_batch(
+        [[{"role": "user", "content": "a"}], [{"role": "user", "content": "bcd"}]], stop_sequences=["STOP"]
+    )
+    assert [output.content for output in outputs] == ["a ['STOP']", "bcd ['STOP']"]
+    assert [output.token_usage.input_tokens for output in outputs] == [1, 3]
+
+
+class TestToolCallStreamAccumulator:
+    @staticmethod
+    def delta(index, arguments=None, name=None, id=None):
+        return ToolCallStreamDelta(
+            index=index,
+            id=id,
+            type="function" if id else None,
+            function=ChatMessageToolCallDefinition(name=name, arguments=arguments),
+        )
+
+    def test_reassembles_argument_fragments(self):
+        accumulator = ToolCallStreamAccumulator()
+        accumulator.add([self.delta(0, name="web_search", id="call_1")])
+        accumulator.add([self.delta(0, '{"query": "sm')])
+        accumulator.add([self.delta(1, name="final_answer", id="call_2"), self.delta(0, 'olagents"}')])
+        accumulator.add([self.delta(1, '{"answer": 4')])
+        tool_calls = accumulator.get_tool_calls()
+        assert [(tool_call.id, tool_call.function.name) for tool_call in tool_calls] == [
+            ("call_1", "web_search"),
+            ("call_2", "final_answer"),
+        ]
+        assert tool_calls[0].function.arguments == {"query": "smolagents"}
+        # Arguments still streaming are returned as text
+        assert tool_calls[1].function.arguments == '{"answer": 4'
+        accumulator.add([self.delta(1, "2}")])
+        assert accumulator.get_tool_calls()[1].function.arguments == {"answer": 42}
+
+    def test_invalid_arguments_are_detected_while_streaming(self):
+        accumulator = ToolCallStreamAccumulator()
+        accumulator.add([self.delta(0, '{"query" "oops', name="web_search", id="call_1")])
+        assert accumulator.errors[0].pos == 9
+        accumulator.add([self.delta(0, '"}')])
+        assert accumulator.get_tool_calls()[0].function.arguments == '{"query" "oops"}'
+
+    def test_accepts_complete_tool_calls(self):
+        tool_call = ChatMessageToolCall(
+            id="call_1", type="function", function=ChatMessageToolCallDefinition(name="final_answer", arguments={})
+        )
+        accumulator = ToolCallStreamAccumulator()
+        accumulator.add([tool_call])
+        accumulator.add([tool_call])
+        assert accumulator.get_tool_calls() == [tool_call]
+
+
+class TestStopSequenceMatcher:
+    def test_holds_back_possible_start_of_stop_sequence(self):
+        matcher = StopSequenceMatcher(["<end_code>", "Observation:"])
+        assert matcher.feed("print(1)<en") == "print(1)"
+        assert matcher.feed("d") == ""
+        assert matcher.feed("ing>") == "<ending>"
+        assert matcher.feed("Obs") == ""
+        assert not matcher.stopped
+        assert matcher.flush() == "Obs"
+
+    def test_stops_at_first_stop_sequence_across_chunks(self):
+        matcher = StopSequenceMatcher(["<end_code>", "Observation:"])
+        assert matcher.feed("x = 1\nObserv") == "x = 1\n"
+        assert matcher.feed("ation: <end_code>") == ""
+        assert matcher.stopped
+        assert matcher.feed("more") == ""
+        assert matcher.flush() == ""
+
+    def test_keeps_bounded_tail(self):
+        matcher = StopSequenceMatcher(["STOP"])
+        for _ in range(1000):
+            matcher.feed("abcST")
+            assert len(matcher._tail) < len("STOP")
+        assert not matcher.stopped
+
+    def test_token_ids(self):
+        matcher = StopSequenceMatcher([[5, 6, 7], [9]])
+        assert matcher.feed([1, 2, 5, 6]) == [1, 2]
+        assert matcher.feed((7, 8)) == []
+        assert matcher.stopped
+        assert StopSequenceMatcher([[9]]).feed([1, 2]) == [1, 2]
+
+    @pytest.mark.parametrize(
+        "content, stop_sequences, expected",
+        [
+            ("Answer<end_code>", ["<end_code>"], "Answer"),
+            ("Answer<end_code>'", ["<end_code>"], "Answer"),
+            ("Answer. Observation: x<end_code>", ["<end_code>", "Observation:"], "Answer. "),
+            ("Answer<end", ["<end_code>"], "Answer<end"),
+            ("Answer", [], "Answer"),
+        ],
+    )
+    def test_remove_stop_sequences(self, content, stop_sequences, expected):
+        assert remove_stop_sequences(content, stop_sequences) == expected
+
+
+class TestGenerationBatcher:
+    @staticmethod
+    def run_batch(batches):
+        def run_batch(requests):
+            batches.append([request.generation_kwargs["inputs"] for request in requests])
+            for request in requests:
+                request.future.set_result(request.generation_kwargs["inputs"] * 2)
+
+        return run_batch
+
+    @staticmethod
+    def submit_while_busy(batcher, requests):
+        """Submits `requests` while a first request runs, and returns their futures."""
+        started, release = threading.Event(), threading.Event()
+        run_batch = batcher.run_batch
+
+        def blocking_run_batch(batch):
+            started.set()
+            release.wait(timeout=5)
+            batcher.run_batch = run_batch
+            run_batch(batch)
+
+        batcher.run_batch = blocking_run_batch
+        first_request = _GenerationRequest({"inputs": -1})
+        threading.Thread(target=batcher.submit, args=(first_request,)).start()
+        assert started.wait(timeout=5)
+        futures = [batcher.submit(request) for request in requests]
+        release.set()
+        assert first_request.future.result(timeout=5) == -2
+        return futures
+
+    def test_request_runs_directly_when_idle(self):
+        threads = []
+
+        def run_batch(requests):
+            threads.append(threading.current_thread())
+            requests[0].future.set_result(0)
+
+        batcher = _GenerationBatcher(run_batch, max_batch_size=8, max_wait_time=10.0)
+        start_time = time.perf_counter()
+        assert batcher.submit(_GenerationRequest({"inputs": 0})).result(timeout=5) == 0
+        assert time.perf_counter() - start_time < 5.0
+        assert threads == [threading.current_thread()]
+        assert batcher._worker is None
+
+    def test_concurrent_requests_are_batched(self):
+        batches = []
+        batcher = _GenerationBatcher(self.run_batch(batches), max_batch_size=3, max_wait_time=0.5)
+        futures = self.submit_while_busy(
+            batcher, [_GenerationRequest({"inputs": index, "max_new_tokens": 10}) for index in range(4)]
+        )
+        assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6]
+        assert batches == [[-1], [0, 1, 2], [3]]
+        assert list(batcher.batch_sizes) == [1, 3, 1]
+
+    def test_requests_with_different_arguments_run_separately(self):
+        batches = []
+        batcher = _GenerationBatcher(self.run_batch(batches), max_batch_size=8, max_wait_time=0.5)
+        futures = self.submit_while_busy(
+            batcher,
+            [
+                _GenerationRequest({"inputs": 1, "temperature": 0.0}),
+                _GenerationRequest({"inputs": 2, "temperature": 1.0}),
+                _GenerationRequest({"inputs": 3, "temperature": 0.0}),
+            ],
+        )
+        assert [future.result(timeout=5) for future in futures] == [2, 4, 6]
+        assert sorted(batches[1:]) == [[1, 3], [2]]
+
+    def test_errors_are_raised_to_all_callers_and_worker_stops_when_idle(self):
+        def run_batch(requests):
+            raise RuntimeError("out of memory")
+
+        batcher = _GenerationBatcher(run_batch, max_batch_size=2, max_wait_time=0.1)
+        futures = [batcher.submit(_GenerationRequest({"inputs": index})) for index in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="out of memory"):
+                future.result(timeout=5)
+        for _ in range(50):
+            if batcher._worker is None:
+                break
+            time.sleep(0.01)
+        assert batcher._worker is None
+
+
+class FakeKVCache:
+    def __init__(self, length: int):
+        self.length = length
+
+    def get_seq_length(self) -> int:
+        return self.length
+
+    def crop(self, max_length: int):
+        self.length = min(self.length, max_length)
+
+
+class TestPrefixKVCache:
+    def test_take_reuses_longest_common_prefix(self):
+        prefix_cache = _PrefixKVCache(max_tokens=100)
+        # The cache lacks the last generated token
+        prefix_cache.put("conversation", [1, 2, 3, 4, 5, 6], FakeKVCache(5))
+        past_key_values, reused_tokens = prefix_cache.take("conversation", [1, 2, 3, 4, 7, 8, 9])
+        assert reused_tokens == 4
+        assert past_key_values.get_seq_length() == 4
+        assert (prefix_cache.reused_tokens, prefix_cache.prefilled_tokens) == (4, 3)
+        # The cache is handed over to the caller until it is stored again
+        assert prefix_cache.take("conversation", [1, 2, 3]) == (None, 0)
+
+    def test_take_always_leaves_last_input_token_to_prefill(self):
+        prefix_cache = _PrefixKVCache(max_tokens=100)
+        prefix_cache.put("conversation", [1, 2, 3, 4], FakeKVCache(4))
+        past_key_values, reused_tokens = prefix_cache.take("conversation", [1, 2, 3])
+        assert reused_tokens == 2
+        assert past_key_values.get_seq_length() == 2
+
+    def test_take_without_common_prefix(self):
+        prefix_cache = _PrefixKVCache(max_tokens=100)
+        prefix_cache.put("conversation", [1, 2, 3], FakeKVCache(3))
+        assert prefix_cache.take("conversation", [4, 5, 6]) == (None, 0)
+        assert prefix_cache.take("other", [1, 2, 3]) == (None, 0)
+
+    def test_put_evicts_least_recently_used(self):
+        prefix_cache = _PrefixKVCache(max_tokens=10)
+        prefix_cache.put("a", [1, 2, 3, 4], FakeKVCache(4))
+        prefix_cache.put("b", [5, 6, 7, 8], FakeKVCache(4))
+        prefix_cache.take("a", [1, 2, 3, 4, 9])
+        prefix_cache.put("a", [1, 2, 3, 4, 9, 10], FakeKVCache(5))
+        prefix_cache.put("c", [10, 11], FakeKVCache(2))
+        assert prefix_cache.take("b", [5, 6, 7, 8, 9]) == (None, 0)
+        assert prefix_cache.take("a", [1, 2, 3, 9])[1] == 3
+        assert prefix_cache.take("c", [10, 11, 12])[1] == 2
+
+    def test_put_skips_caches_over_budget_or_without_crop(self):
+        prefix_cache = _PrefixKVCache(max_tokens=3)
+        prefix_cache.put("large", [1, 2, 3, 4], FakeKVCache(4))
+        prefix_cache.put("static", [1, 2], object())
+        assert prefix_cache.cached_tokens == 0
+
+
 def test_get_clean_message_list_basic():
     messages = [
         {"role": "user", "content": [{"type": "text", "text": "Hello!"}]},
@@ -658,6 +1567,41 @@ def test_supports_stop_parameter(model_id, expected):
     assert supports_stop_parameter(model_id) == expected, f"Failed for model_id: {model_id}"
 
 
+class TestStreamingToolCallParser:
+    def test_tool_name_is_known_before_the_arguments(self):
+        parser = StreamingToolCallParser()
+        assert not parser.feed('Thought: I need the weather.\nAction:\n{"na')
+        assert parser.tool_name is None
+        parser.feed('me": "weather_t')
+        assert parser.tool_name is None
+        parser.feed('ool", "arguments": {"city": "Par')
+        assert parser.tool_name == "weather_tool"
+        assert parser.feed('is"}}\nObservation:')
+        tool_call = parser.get_tool_call()
+        assert tool_call.function.name == "weather_tool"
+        assert tool_call.function.arguments == {"city": "Paris"}
+
+    def test_custom_keys(self):
+        parser = StreamingToolCallParser(tool_name_key="tool", tool_arguments_key="params")
+        parser.feed('{"tool": "weather_tool", "params": "Paris"}')
+        assert parser.tool_name == "weather_tool"
+        assert parser.get_tool_call().function.arguments == "Paris"
+
+    @pytest.mark.parametrize(
+        "text,error",
+        [
+            ("No tool call here", "does not contain any JSON blob"),
+            ('{"name": "weather_tool" "arguments": {}}', "Expecting ',' delimiter"),
+            ('{"name": "weather_tool", "arguments": {"city"', "Expecting ':' delimiter"),
+        ],
+    )
+    def test_invalid_tool_call(self, text, error):
+        parser = StreamingToolCallParser()
+        parser.feed(text)
+        with pytest.raises(ValueError, match=error):
+            parser.get_tool_call()
+
+
 class TestGetToolCallFromText:
     @pytest.fixture(autouse=True)
     def mock_uuid4(self):
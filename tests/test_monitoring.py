@@ -13,9 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import json
+import threading
 import unittest
+import urllib.request
+from unittest.mock import MagicMock, patch
 
 import pytest
+from rich.console import Console
+from rich.markdown import Markdown
 
 from smolagents import (
     AgentImage,
@@ -31,6 +38,18 @@ from smolagents.models import (
     Model,
     TokenUsage,
 )
+from smolagents.monitoring import (
+    AgentLogger,
+    LogLevel,
+    MetricsRegistry,
+    Monitor,
+    RunProfiler,
+    StepMetrics,
+    StreamingRenderer,
+    Timing,
+    profile_phase,
+)
+from smolagents.utils import AgentGenerationError
 
 
 class FakeLLMModel(Model):
@@ -87,6 +106,73 @@ class MonitoringTester(unittest.TestCase):
         self.assertEqual(agent.monitor.total_input_token_count, 10)
         self.assertEqual(agent.monitor.total_output_token_count, 20)
 
+    def test_token_estimate_accuracy(self):
+        agent = CodeAgent(tools=[], model=FakeLLMModel(), max_steps=1, count_input_tokens=True)
+        agent.run("Fake task")
+
+        estimated_input_tokens = agent.memory.steps[1].estimated_input_tokens
+        self.assertEqual(
+            estimated_input_tokens, agent.model.count_tokens(list(agent.memory.steps[1].model_input_messages))
+        )
+        accuracy = agent.monitor.get_token_estimate_accuracy()
+        self.assertEqual(accuracy["steps"], 1)
+        self.assertEqual(accuracy["estimated_input_tokens"], estimated_input_tokens)
+        self.assertEqual(accuracy["input_tokens"], 10)
+        self.assertAlmostEqual(accuracy["mean_relative_error"], abs(estimated_input_tokens - 10) / 10)
+
+        agent.monitor.reset()
+        self.assertIsNone(agent.monitor.get_token_estimate_accuracy())
+
+    def test_step_latency_metrics(self):
+        agent = CodeAgent(tools=[], model=FakeLLMModel(), max_steps=1, return_full_result=True)
+        result = agent.run("Fake task")
+
+        step_metrics = agent.memory.steps[1].metrics
+        self.assertGreater(step_metrics.model_duration, 0)
+        self.assertIsNone(step_metrics.time_to_first_token)
+        self.assertGreater(step_metrics.output_tokens_per_second, 0)
+        self.assertGreater(step_metrics.executor_duration, 0)
+        self.assertEqual(result.metrics["model_durations"]["count"], 1)
+        self.assertEqual(result.metrics["model_durations"]["p50"], step_metrics.model_duration)
+        self.assertEqual(result.metrics["token_usage"]["output_tokens"], 20)
+
+        agent = ToolCallingAgent(tools=[], model=FakeLLMModel(), max_steps=1)
+        agent.run("Fake task")
+        self.assertEqual(agent.monitor.get_metrics()["tool_durations"]["final_answer"]["count"], 1)
+        self.assertIn("executor_duration", agent.memory.get_full_steps()[1]["metrics"])
+
+    def test_streaming_step_metrics(self):
+        step_metrics = StepMetrics()
+        step_metrics.record_model_call(start_time=10.0, end_time=12.0, first_token_time=10.5, output_tokens=30)
+        self.assertEqual(step_metrics.model_duration, 2.0)
+        self.assertEqual(step_metrics.time_to_first_token, 0.5)
+        self.assertEqual(step_metrics.output_tokens_per_second, 20.0)
+
+    def test_metrics_prometheus_exposition(self):
+        monitor = Monitor(tracked_model=None, logger=AgentLogger(LogLevel.OFF))
+        for duration in [0.1, 0.2, 0.3, 0.4]:
+            step_metrics = StepMetrics(model_duration=duration)
+            step_metrics.record_tool_call("web_search", duration * 10)
+            monitor.update_metrics(MagicMock(timing=Timing(0.0, 1.0), token_usage=None, metrics=step_metrics))
+
+        metrics = monitor.get_metrics()
+        self.assertEqual(metrics["step_durations"]["count"], 4)
+        self.assertEqual(metrics["model_durations"]["p50"], 0.2)
+        self.assertEqual(metrics["model_durations"]["p99"], 0.4)
+        self.assertIsNone(metrics["times_to_first_token"]["p50"])
+        self.assertEqual(metrics["tool_durations"]["web_search"]["count"], 4)
+
+        exposition = monitor.to_prometheus()
+        self.assertIn("# TYPE smolagents_model_duration_seconds summary", exposition)
+        self.assertIn('smolagents_model_duration_seconds{quantile="0.9"} 0.4', exposition)
+        self.assertIn('smolagents_tool_duration_seconds{tool="web_search",quantile="0.5"} 2.0', exposition)
+        self.assertIn('smolagents_tool_duration_seconds_count{tool="web_search"} 4', exposition)
+        self.assertIn("smolagents_time_to_first_token_seconds_count 0", exposition)
+        self.assertIn("smolagents_output_tokens_total 0", exposition)
+
+        monitor.reset()
+        self.assertEqual(monitor.get_metrics()["tool_durations"], {})
+
     def test_code_agent_metrics_max_steps(self):
         class FakeLLMModelMalformedAnswer(Model):
             def generate(self, prompt, **kwargs):
@@ -251,3 +337,234 @@ class MonitoringTester(unittest.TestCase):
         self.assertIsNone(result.token_usage)
         self.assertIsInstance(result.messages, list)
         self.assertGreater(result.timing.duration, 0)
+
+
+class TestMetricsRegistry:
+    def test_agent_runs_are_recorded(self):
+        registry = MetricsRegistry()
+        agent = CodeAgent(tools=[], model=FakeLLMModel(), max_steps=1, metrics_registry=registry)
+        agent.run("Fake task")
+        agent.run("Fake task")
+
+        assert registry.get("runs") == 2
+        assert registry.get("active_runs") == 0
+        assert registry.get("steps", agent="CodeAgent") == 2
+        assert registry.get("tokens", type="output") == 40
+        assert registry.get("executor_operations") > 0
+        assert registry.get("executor_latency_seconds")[1] == 2
+        assert registry.get("model_latency_seconds", model_id="None")[1] == 2
+
+    def test_active_runs_and_errors(self):
+        class MalformedModel(Model):
+            def generate(self, messages, **kwargs):
+                return ChatMessage(role="assistant", content="Malformed answer")
+
+        registry = MetricsRegistry()
+        agent = CodeAgent(tools=[], model=MalformedModel(), max_steps=2, metrics_registry=registry)
+        run_stream = agent.run("Fake task", stream=True)
+        next(run_stream)
+        assert registry.get("active_runs") == 1
+        list(run_stream)
+        assert registry.get("active_runs") == 0
+        assert registry.get("errors", error_type="AgentParsingError") == 2
+
+    def test_generation_errors_are_counted(self):
+        class FailingModel(Model):
+            def generate(self, messages, **kwargs):
+                raise Exception("Cannot generate")
+
+        registry = MetricsRegistry()
+        agent = CodeAgent(tools=[], model=FailingModel(), max_steps=1, metrics_registry=registry)
+        with pytest.raises(AgentGenerationError):
+            agent.run("Fake task")
+        assert registry.get("errors", error_type="AgentGenerationError") == 1
+        assert agent.memory.steps[-1].error is not None
+
+    def test_concurrent_updates(self):
+        registry = MetricsRegistry()
+
+        def update():
+            for _ in range(1000):
+                registry.inc("steps", agent="worker")
+                registry.observe("tool_latency_seconds", 0.02, tool="web_search")
+
+        threads = [threading.Thread(target=update) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert registry.get("steps", agent="worker") == 8000
+        assert registry.get("tool_latency_seconds", tool="web_search") == (pytest.approx(160.0), 8000)
+
+    def test_openmetrics_exposition(self):
+        registry = MetricsRegistry(latency_buckets=(0.1, 1.0))
+        registry.inc("errors", error_type="AgentParsingError")
+        registry.observe("tool_latency_seconds", 0.5, tool='say "hi"')
+        exposition = registry.generate_latest()
+        assert "# TYPE smolagents_errors counter" in exposition
+        assert 'smolagents_errors_total{error_type="AgentParsingError"} 1' in exposition
+        assert 'smolagents_tool_latency_seconds_bucket{tool="say \\"hi\\"",le="0.1"} 0' in exposition
+        assert 'smolagents_tool_latency_seconds_bucket{tool="say \\"hi\\"",le="1.0"} 1' in exposition
+        assert 'smolagents_tool_latency_seconds_bucket{tool="say \\"hi\\"",le="+Inf"} 1' in exposition
+        assert 'smolagents_tool_latency_seconds_count{tool="say \\"hi\\""} 1' in exposition
+        assert exposition.endswith("# EOF\n")
+        with pytest.raises(ValueError, match="Unknown metric type"):
+            registry.register("queue_size", "summary", "Queue size.")
+
+    def test_serve(self):
+        registry = MetricsRegistry()
+        registry.inc("runs")
+        server = registry.serve(port=0)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+                assert response.headers["Content-Type"].startswith("application/openmetrics-text")
+                assert "smolagents_runs_total 1" in response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestRunProfiler:
+    def test_agent_run_breakdown(self, tmp_path):
+        profiler = RunProfiler()
+        agent = CodeAgent(tools=[], model=FakeLLMModel(), max_steps=1, profiler=profiler)
+        agent.run("Fake task")
+
+        breakdown = profiler.get_breakdown()
+        for phase in ["run", "caller", "step", "prompt_assembly", "model", "parsing", "interpreter", "callbacks"]:
+            assert breakdown[phase]["calls"] >= 1, phase
+        assert breakdown["run"]["calls"] == 1
+        assert sum(phase["self_time"] for phase in breakdown.values()) == pytest.approx(breakdown["run"]["total_time"])
+        assert sum(phase["share"] for phase in breakdown.values()) == pytest.approx(1.0)
+
+        trace_path = tmp_path / "trace.json"
+        profiler.save_chrome_trace(trace_path)
+        trace = json.loads(trace_path.read_text())
+        assert {event["ph"] for event in trace["traceEvents"]} == {"X"}
+        step_event = next(event for event in trace["traceEvents"] if event["name"] == "step")
+        assert step_event["args"] == {"step": "1"}
+
+        table = profiler.breakdown_table()
+        assert table.row_count == len(breakdown)
+
+        # The profile covers a single run when the memory is reset
+        agent.run("Fake task")
+        assert profiler.get_breakdown()["run"]["calls"] == 1
+
+    def test_tool_calls_are_profiled(self):
+        profiler = RunProfiler()
+        agent = ToolCallingAgent(tools=[], model=FakeLLMModel(), max_steps=1, profiler=profiler)
+        agent.run("Fake task")
+        assert profiler.get_breakdown()["tool"]["calls"] == 1
+        assert [phase.args for phase in profiler.phases if phase.name == "tool"] == [{"tool": "final_answer"}]
+
+    def test_self_time_excludes_nested_phases(self):
+        profiler = RunProfiler()
+        with patch("smolagents.monitoring.time.perf_counter_ns", side_effect=[0, 10, 20, 40, 50, 60, 80, 100]):
+            with profiler.phase("run"):
+                with profiler.phase("model"):
+                    with profiler.phase("prompt_assembly"):
+                        pass
+                with profiler.phase("model"):
+                    pass
+        breakdown = profiler.get_breakdown()
+        assert breakdown["run"]["total_time"] == pytest.approx(100e-9)
+        assert breakdown["run"]["self_time"] == pytest.approx(40e-9)
+        assert breakdown["model"] == {
+            "calls": 2,
+            "total_time": pytest.approx(60e-9),
+            "self_time": pytest.approx(40e-9),
+            "share": pytest.approx(0.4),
+        }
+        assert breakdown["prompt_assembly"]["self_time"] == pytest.approx(20e-9)
+
+    def test_phases_are_not_recorded_outside_profiled_runs(self):
+        profiler = RunProfiler()
+        agent = CodeAgent(tools=[], model=FakeLLMModel(), max_steps=1, profiler=profiler)
+        run_stream = agent.run("Fake task", stream=True)
+        next(run_stream)
+        recorded_phases = len(profiler.phases)
+        # The caller of a streamed run is not profiled
+        with profile_phase("model"):
+            pass
+        assert len(profiler.phases) == recorded_phases
+        list(run_stream)
+
+
+class TestStreamingRenderer:
+    def test_renderer_is_silent_below_info_level(self):
+        logger = AgentLogger(level=LogLevel.OFF, console=Console(record=True, force_terminal=True))
+        with patch("smolagents.monitoring.Live") as mock_live:
+            with StreamingRenderer(logger) as renderer:
+                for chunk in ["Hello", " world"]:
+                    renderer.append(chunk)
+        mock_live.assert_not_called()
+        assert renderer.text == "Hello world"
+        assert logger.console.export_text() == ""
+
+    def test_renderer_prints_final_text_once_without_tty(self):
+        logger = AgentLogger(level=LogLevel.INFO, console=Console(record=True, file=io.StringIO()))
+        with patch("smolagents.monitoring.Markdown", wraps=Markdown) as mock_markdown:
+            with StreamingRenderer(logger) as renderer:
+                for _ in range(100):
+                    renderer.append("token ")
+        assert mock_markdown.call_count == 1
+        assert "token token" in logger.console.export_text()
+
+    def test_renderer_throttles_frames(self):
+        logger = AgentLogger(level=LogLevel.INFO, console=Console(file=io.StringIO(), force_terminal=True))
+        with patch("smolagents.monitoring.Markdown", wraps=Markdown) as mock_markdown:
+            with StreamingRenderer(logger, footer=lambda: "\nfooter", refresh_per_second=1e-3) as renderer:
+                for _ in range(100):
+                    renderer.append("token ")
+        # One frame for the first token, then one final frame with the full text
+        assert mock_markdown.call_count == 2
+        assert mock_markdown.call_args.args[0] == "token " * 100 + "\nfooter"
+
+
+class TestAgentLogger:
+    @pytest.mark.parametrize(
+        "logger_level, message_level, expected",
+        [
+            (LogLevel.OFF, LogLevel.ERROR, False),
+            (LogLevel.INFO, LogLevel.ERROR, True),
+            (LogLevel.INFO, LogLevel.DEBUG, False),
+            (LogLevel.DEBUG, "debug", True),
+        ],
+    )
+    def test_is_enabled(self, logger_level, message_level, expected):
+        assert AgentLogger(level=logger_level).is_enabled(message_level) is expected
+
+    def test_log_lazy_defers_builders(self):
+        logger = AgentLogger(level=LogLevel.INFO, console=Console(record=True, file=io.StringIO()))
+        build_record = MagicMock(return_value="Deferred record")
+        logger.log_lazy(build_record, level=LogLevel.DEBUG)
+        build_record.assert_not_called()
+        logger.log_lazy(build_record, lambda: "and more text", level=LogLevel.INFO)
+        build_record.assert_called_once()
+        assert "Deferred record and more text" in logger.console.export_text()
+
+    def test_log_does_not_call_callables(self):
+        calls = []
+
+        def callback():
+            calls.append("called")
+            return "Callback result"
+
+        logger = AgentLogger(level=LogLevel.INFO, console=Console(record=True, file=io.StringIO()))
+        # Callables are printed as given, only log_lazy calls them
+        logger.log(callback, level=LogLevel.INFO)
+        assert calls == []
+        assert "function" in logger.console.export_text()
+
+    def test_no_log_records_built_when_off(self):
+        agent = ToolCallingAgent(tools=[], model=FakeLLMModel(), max_steps=1, verbosity_level=LogLevel.OFF)
+        with (
+            patch("smolagents.agents.Panel") as mock_panel,
+            patch("smolagents.agents.Text") as mock_text,
+            patch("smolagents.monitoring.Text") as mock_monitoring_text,
+            patch("smolagents.monitoring.Rule") as mock_rule,
+        ):
+            agent.run("Fake task")
+        for mock_renderable in [mock_panel, mock_text, mock_monitoring_text, mock_rule]:
+            mock_renderable.assert_not_called()
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import inspect
+import json
 import os
 import textwrap
 import unittest
@@ -22,7 +23,16 @@ from IPython.core.interactiveshell import InteractiveShell
 
 from smolagents import Tool
 from smolagents.tools import tool
-from smolagents.utils import get_source, instance_to_source, is_valid_name, parse_code_blobs, parse_json_blob
+from smolagents.utils import (
+    CodeBlockDetector,
+    IncrementalJSONParser,
+    JSONStreamDecodeError,
+    get_source,
+    instance_to_source,
+    is_valid_name,
+    parse_code_blobs,
+    parse_json_blob,
+)
 
 
 class ValidTool(Tool):
@@ -441,6 +451,11 @@ def test_e2e_ipython_function_tool_save(tmp_path):
             {"simple": "json"},
             "With text before",
         ),
+        (
+            """{"simple": "json"} and another {brace} after""",
+            {"simple": "json"},
+            "",
+        ),
     ],
 )
 def test_parse_json_blob_with_valid_json(raw_json, expected_data, expected_blob):
@@ -494,3 +509,127 @@ def test_parse_json_blob_with_invalid_json(raw_json):
 def test_is_valid_name(name, expected):
     """Test the is_valid_name function with various inputs."""
     assert is_valid_name(name) is expected
+
+
+@pytest.mark.parametrize(
+    "chunks, expected_text",
+    [
+        (
+            ["Thought: easy\nCode:\n```py\nprint(1)", "\n```<end_code>", "Observation:"],
+            "Thought: easy\nCode:\n```py\nprint(1)\n```",
+        ),
+        (["``", "`pyt", "hon\nx = 1\n`", "``\nextra text"], "```python\nx = 1\n```"),
+        (["Inline ``` fence, then ```py  \n", "a = 2", "\n", "```"], "Inline ``` fence, then ```py  \na = 2\n```"),
+        (["No code at all"], None),
+        (["```py\nunfinished = True\n``"], None),
+    ],
+)
+def test_code_block_detector(chunks, expected_text):
+    detector = CodeBlockDetector()
+    for chunk in chunks:
+        if detector.feed(chunk):
+            break
+    if expected_text is None:
+        assert not detector.is_complete
+    else:
+        assert detector.is_complete
+        assert detector.text[: detector.code_end] == expected_text
+        assert parse_code_blobs(detector.text[: detector.code_end]) == parse_code_blobs(expected_text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"query": "weather", "limit": 3, "ratio": -1.5e-3, "flags": [true, false, null], "nested": {"a": []}}',
+        '{"escapes": "quote \\" backslash \\\\ unicode \\u00e9 emoji \\ud83d\\ude00 newline \\n"}',
+        '\n  [1, {"key" : "value"} , [ ] ]\n',
+        '"just a string"',
+    ],
+)
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_incremental_json_parser(text, chunk_size):
+    parser = IncrementalJSONParser()
+    for index in range(0, len(text), chunk_size):
+        parser.feed(text[index : index + chunk_size])
+    assert parser.is_complete
+    assert parser.close() == json.loads(text)
+
+
+def test_incremental_json_parser_exposes_partial_value():
+    parser = IncrementalJSONParser()
+    assert not parser.feed('{"name": "web_search", "arguments": {"query": "sm')
+    assert parser.value == {"name": "web_search", "arguments": {}}
+    assert parser.feed('olagents"}}')
+    assert parser.value == {"name": "web_search", "arguments": {"query": "smolagents"}}
+    parser = IncrementalJSONParser()
+    parser.feed("12")
+    assert not parser.is_complete
+    assert parser.close() == 12
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"a" 1}',
+        '{"a": tru}',
+        "[1,]",
+        '{"a": "\\x"}',
+        '{"a": 1}}',
+        "{a: 1}",
+        '{"a": "b\nc"}',
+        '{"a":\n  [1,\n  2,, 3]}',
+        '["\\u12G4"]',
+        '{"a"',
+        '{"a": 1',
+        "[1,",
+    ],
+)
+def test_incremental_json_parser_error_positions(text):
+    with pytest.raises(json.JSONDecodeError) as expected:
+        json.loads(text)
+    parser = IncrementalJSONParser()
+    with pytest.raises(JSONStreamDecodeError) as error:
+        for character in text:
+            parser.feed(character)
+        parser.close()
+    assert (error.value.msg, error.value.pos, error.value.lineno, error.value.colno) == (
+        expected.value.msg,
+        expected.value.pos,
+        expected.value.lineno,
+        expected.value.colno,
+    )
+
+
+def test_parse_json_blob_error_position():
+    with pytest.raises(ValueError, match="Expecting ',' delimiter") as e:
+        parse_json_blob('Action: {"a": 1 "b": 2}')
+    assert """': 1 "b": '""" in str(e.value)
+
+
+def test_parse_json_blob_with_multiple_tool_calls():
+    with pytest.raises(ValueError, match="multiple tool calls"):
+        parse_json_blob('{"name": "a", "arguments": {}},\n{"name": "b", "arguments": {}}')
+
+
+@pytest.mark.parametrize(
+    "text,expected_value,expected_end_position",
+    [
+        ('{"a": [1, 2]} text after', {"a": [1, 2]}, 13),
+        ('"string", more', "string", 8),
+        ("12 text", 12, 2),
+        ("true}", True, 4),
+    ],
+)
+def test_incremental_json_parser_stop_at_end(text, expected_value, expected_end_position):
+    parser = IncrementalJSONParser(stop_at_end=True)
+    for character in text:
+        parser.feed(character)
+    assert parser.close() == expected_value
+    assert parser.end_position == expected_end_position
+
+
+def test_incremental_json_parser_incomplete_value():
+    parser = IncrementalJSONParser()
+    parser.feed('{"a": "unterminated')
+    with pytest.raises(JSONStreamDecodeError, match="Unterminated string starting at: line 1 column 7"):
+        parser.close()